@@ -80,17 +80,27 @@ def main():
 
 	programs = ["kraken2", "krakenuniq","ganon"]
 
+	from modules.database.DatabaseConnection import DatabaseConnection,PROFILES
+
 	parser = argparse.ArgumentParser()
 	basic = parser.add_argument_group('basic', 'Basic commands')
 	basic.add_argument('-o', '--outdir',metavar="", default=".", help="Output directory (same directory as custom_taxonomy_databases dump)")
 	basic.add_argument('-db', '--database',metavar="", type=str, default=".ctdb" , help="Custom taxonomy sqlite3 database file")
+	basic.add_argument('--db_profile', metavar="", default="default", choices=list(PROFILES), help="SQLite connection profile [default, safe, bulk, readonly (recommended, the database is only read)]")
 
 	### Download options, process local directory and potentially download files
 	download_opts = parser.add_argument_group('download_opts', "Download and file handling")
 	download_opts.add_argument('-p', '--processes',metavar="",type=int, default = 8, help="Use multiple cores for downloading genomes and kraken if -kp is not set")
 	download_opts.add_argument('--download', action='store_true', help="Download additional sequences")
 	download_opts.add_argument('--force_download', action='store_true', help="Download sequences from genbank if not in refseq (WARNING: might include genome withdrawals)")
+	download_opts.add_argument('--assembly_summary', metavar="",default=None,  help='Directory with NCBI assembly_summary_{refseq,genbank}.txt used to find the genomes to download, downloaded if missing (default: outdir, "" to download with ncbi-genome-download)')
+	download_opts.add_argument('--download_url', metavar="",default=False,  help='Download genomes from this server instead of the host in the assembly summary ftp paths (mirror)')
+	download_opts.add_argument('--genome_cache', metavar="",default=False,  help='Directory with genome files shared between builds, missing genomes found there are linked into genomes_path/downloads and downloaded genomes are added')
+	download_opts.add_argument('--genome_cache_size', metavar="",type=float, default=0,  help='Maximum size of the genome cache in GB, least recently used genomes are removed (default 0, no limit)')
 	download_opts.add_argument('--genomes_path', metavar="",default=None,  help='path to genomes')
+	download_opts.add_argument('--genomes_manifest', metavar="",default=None,  help='Manifest of the genomes_path directory tree, only changed directories are listed again (default: <database>.genomes, "" to disable)')
+	download_opts.add_argument('--rescan', action='store_true', help="List all directories in genomes_path again (update the manifest)")
+	download_opts.add_argument('--walk_threads', metavar="",type=int, default=8, help="Threads used to list directories in genomes_path (default 8)")
 
 
 
@@ -104,6 +114,8 @@ def main():
 	classifier_opts.add_argument('--keep', action='store_true', help="Keep temporary files")
 	classifier_opts.add_argument('--skip', metavar="", default="", help="Do not include genomes within this taxonomy (child tree) in the database (works for kraken)")
 	classifier_opts.add_argument('-kp', '--build_processes',metavar="",type=int, default = None, help="Use a different number of cores for kraken classification")
+	classifier_opts.add_argument('--chunksize', metavar="",type=int, default = 1, help="Number of genomes each process takes at a time when preparing the library, genomes are processed largest first (default 1)")
+	classifier_opts.add_argument('--validate_map', action='store_true', help="Report sequence ids found in more than one genome when the seqid2taxid map is merged (kraken)")
 
 
 	debugopts = parser.add_argument_group("Logging and debug options")
@@ -152,6 +164,10 @@ def main():
 			])
 	logger = logging.getLogger(__name__)
 	logger.info("FlexTaxD-create logging initiated!")
+
+	### Select sqlite connection profile for all database connections
+	DatabaseConnection.set_profile(args.db_profile)
+
 	logger.debug("Supported formats: {formats}".format(formats=programs))
 
 	'''
@@ -176,18 +192,33 @@ def main():
 	if not skip:
 		process_directory = dynamic_import("modules", "ProcessDirectory")
 		logger.info("Processing files; create kraken seq.map")
-		process_directory_obj = process_directory(args.database)
+		if args.genomes_manifest is None:
+			args.genomes_manifest = args.database+".genomes"
+		process_directory_obj = process_directory(args.database,manifest=args.genomes_manifest,rescan=args.rescan,threads=args.walk_threads)
 		genomes, missing = process_directory_obj.process_folder(args.genomes_path)
+		genome_cache = False
+		if args.genome_cache:
+			genome_cache = dynamic_import("modules.database", "GenomeCache")(args.genome_cache,budget=int(args.genome_cache_size*2**30))
+			restored, missing = genome_cache.restore(missing)
+			process_directory_obj.add_genomes(restored)
 		''' 2. Download missing files'''
 		if args.download:
 			download = dynamic_import("modules", "DownloadGenomes")
-			download_obj = download(args.processes,outdir=args.outdir,force=args.force_download)
+			if args.assembly_summary is None:
+				args.assembly_summary = args.outdir
+			download_obj = download(args.processes,outdir=args.outdir,force=args.force_download,summary_dir=args.assembly_summary,base_url=args.download_url)
 			still_missing = download_obj.run(missing)
+			process_directory_obj.add_genomes(download_obj.get_genome_path())
+			if genome_cache:
+				genome_cache.add_genomes(download_obj.get_genome_path())
 			if len(still_missing) > 0: print("Not able to download: {nr}".format(nr=len(still_missing)))
 		else:
 			if len(missing) > 0:
 				logger.info("Genome annotations with no matching source: {nr}".format(nr=len(missing)))
 				write_missing(missing)
+		if genome_cache:
+			genome_cache.evict()
+			genome_cache.close()
 	''' 3. Add genomes to database'''
 	if args.db_name:
 		if args.dbprogram.startswith("kraken"):
@@ -203,6 +234,9 @@ def main():
 		if not skip:
 			genomes = process_directory_obj.get_genome_path_dict()
 		else: genomes=False
+		classifier_opts = {}
+		if args.dbprogram.startswith("kraken"):
+			classifier_opts["validate_map"] = args.validate_map
 		classifierDB = classifier(args.database, args.db_name, genomes,args.outdir,
 										create_db=args.create_db,
 										limit=limit,
@@ -211,8 +245,10 @@ def main():
 										skip=args.skip,
 										processes=args.processes,
 										build_processes=args.build_processes,
+										chunksize=args.chunksize,
 										debug=args.debug,
 										verbose=args.verbose,
+										**classifier_opts
 		)
 		report_time(current_time)
 		if not skip:
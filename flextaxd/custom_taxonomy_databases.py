@@ -95,6 +95,8 @@ def main():
 
     #########################################################################################
 
+    from modules.database.DatabaseConnection import DatabaseConnection,PROFILES
+
     parser = argparse.ArgumentParser()
 
     required = parser.add_argument_group('required', 'Required')
@@ -107,11 +109,13 @@ def main():
     basic.add_argument("--force", action='store_true', help="use when script is implemented in pipeline to avoid security questions on overwrite!")
     basic.add_argument('--validate', action='store_true', help="Validate database format")
     basic.add_argument('--stats', action='store_true', help="Print some statistics from the database")
+    basic.add_argument('--db_profile', metavar="", default="default", choices=list(PROFILES), help="SQLite connection profile [default, safe, bulk (fast imports, no journal), readonly (dump and visualisation)]")
 
     rmodules = get_read_modules()
     read_opts = parser.add_argument_group('read_opts', "Source options")
-    read_opts.add_argument('-tf', '--taxonomy_file',metavar="", default=None, help="Taxonomy source file")
-    read_opts.add_argument('-tt', '--taxonomy_type',metavar="", default="", choices=rmodules, help="Source format of taxonomy input file ({modules})".format(modules=",".join(rmodules)))
+    read_opts.add_argument('-tf', '--taxonomy_file',metavar="", nargs="+", default=None, help="Taxonomy source file, several files (not NCBI) are parsed in parallel and merged in the given order")
+    read_opts.add_argument('-tt', '--taxonomy_type',metavar="", nargs="+", default=[""], choices=rmodules, help="Source format of taxonomy input file ({modules}), one type for all files or one per file".format(modules=",".join(rmodules)))
+    read_opts.add_argument('--ingest_processes', metavar="", type=int, default=1, help="Number of processes parsing taxonomy files when several files are given (default 1)")
     read_opts.add_argument('--taxid_base', metavar="", type=int, default=1, help="The base for internal taxonomy ID numbers, when using NCBI as base select base at minimum 3000000 (default = 1)")
 
     mod_opts = parser.add_argument_group('mod_opts', "Database modification options")
@@ -119,6 +123,10 @@ def main():
     mod_opts.add_argument('-md', '--mod_database', metavar="",default=False, help="Database file containing modifications")
     mod_opts.add_argument('-gt', '--genomeid2taxid', metavar="", default=False, help="File that lists which node a genome should be assigned to")
     mod_opts.add_argument('-gp', '--genomes_path', metavar="",default=None,  help='Path to genome folder is required when using NCBI_taxonomy as source')
+    mod_opts.add_argument('--accession_index', metavar="",default=False,  help='Persistent index of the NCBI accession2taxid file, built on first use and refreshed when the file changes (default: <database>.accession2taxid.idx, the temp directory if the database directory is not writable)')
+    mod_opts.add_argument('--genomes_manifest', metavar="",default=None,  help='Manifest of the genomes_path directory tree and the first sequence id of each genome, shared with create_databases (default: <database>.genomes, "" to disable)')
+    mod_opts.add_argument('--rescan', action='store_true', help="List all directories in genomes_path again (update the manifest)")
+    mod_opts.add_argument('--scan_threads', metavar="", type=int, default=8, help='Number of threads reading genome file headers when annotating genomes from NCBI (default 8)')
     mod_opts.add_argument('-p', '--parent',metavar="", default=False, help="Parent from which to add (replace see below) branch")
     mod_opts.add_argument('--replace', action='store_true', help="Add if existing children of parents should be removed!")
     mod_opts.add_argument('--clean_database',	action='store_true', help="Clean up database from unannotated nodes")
@@ -127,6 +135,8 @@ def main():
     out_opts.add_argument('--dbprogram', metavar="", default=False,choices=__programs_supported__, help="Adjust output file to certain output specifications ["+", ".join(__programs_supported__)+"]")
     out_opts.add_argument("--dump_prefix", metavar="", default="names,nodes", help="change dump prefix reqires two names default(names,nodes)")
     out_opts.add_argument('--dump_sep', metavar="", default="\t|\t", help="Set output separator default(NCBI) also adds extra trailing columns for kraken")
+    out_opts.add_argument('--dump_compress', metavar="", default=False, choices=["gzip","zstd"], help="Write compressed dump files (gzip or zstd, zstd requires the zstandard package)")
+    out_opts.add_argument('--force_dump', action='store_true', default=False, help="Write the dump files even if the database is unchanged since the last dump")
     out_opts.add_argument('--dump_descriptions', action='store_true', default=False, help="Dump description names instead of database integers")
 
     vis_opts = parser.add_argument_group('vis_opts', "Visualisation options")
@@ -144,6 +154,8 @@ def main():
     parser.add_argument("--version", action='store_true', help=argparse.SUPPRESS)
 
     args = parser.parse_args()
+    taxonomy_types = args.taxonomy_type
+    args.taxonomy_type = taxonomy_types[0]
 
     if args.version:
         print("{name}: version {version}".format(name=__pkgname__,version=__version__))
@@ -179,6 +191,9 @@ def main():
     logger = logging.getLogger(__name__)
     logger.info("FlexTaxD logging initiated!")
 
+    ### Select sqlite connection profile for all database connections
+    DatabaseConnection.set_profile(args.db_profile)
+
     ### Run pipeline
 
     force = False
@@ -245,9 +260,14 @@ def main():
     if args.taxonomy_file:
         if not os.path.exists(args.database) or force:
             '''Load taxonomy module'''
-            logger.info("Loading module: ReadTaxonomy{type}".format(type=args.taxonomy_type))
-            read_module = dynamic_import("modules", "ReadTaxonomy{type}".format(type=args.taxonomy_type))
-            read_obj = read_module(args.taxonomy_file, database=args.database)
+            if len(args.taxonomy_file) > 1:
+                logger.info("Loading module: IngestTaxonomy")
+                ingest_module = dynamic_import("modules", "IngestTaxonomy")
+                read_obj = ingest_module(args.taxonomy_file, taxonomy_types, database=args.database, processes=args.ingest_processes)
+            else:
+                logger.info("Loading module: ReadTaxonomy{type}".format(type=args.taxonomy_type))
+                read_module = dynamic_import("modules", "ReadTaxonomy{type}".format(type=args.taxonomy_type))
+                read_obj = read_module(args.taxonomy_file[0], database=args.database)
             logger.info("Parse taxonomy")
             read_obj.parse_taxonomy()                                                           ## Parse taxonomy file
 
@@ -255,8 +275,10 @@ def main():
             if not args.genomeid2taxid:
                 logger.warning("Warning no genomeid2taxid file given!")
             elif args.taxonomy_type == "NCBI" and args.genomeid2taxid:
-                read_obj.parse_genomeid2taxid(args.genomes_path,args.genomeid2taxid)
-            elif args.taxonomy_type == "CanSNPer":
+                if args.genomes_manifest is None:
+                    args.genomes_manifest = args.database+".genomes"
+                read_obj.parse_genomeid2taxid(args.genomes_path,args.genomeid2taxid,accession_index=args.accession_index,genomes_manifest=args.genomes_manifest,rescan=args.rescan,threads=args.scan_threads)
+            elif "CanSNPer" in taxonomy_types:
                 read_obj.parse_genomeid2taxid(args.genomeid2taxid)
 
             logger.info("Nodes in taxonomy tree {n} number of taxonomies {k}".format(n=read_obj.length, k=read_obj.ids))
@@ -290,23 +312,27 @@ def main():
 
     ''' 2. Dump custom taxonomy database into NCBI/kraken readable format)'''
     if args.dump or args.dump_mini:
-        '''Check if datase exists if it does make sure the user intends to overwrite the file'''
-        nameprefix,nodeprefix = args.dump_prefix.split(",")
-        if (os.path.exists(args.outdir.rstrip("/")+"/"+nameprefix+".dmp") or os.path.exists(args.outdir.rstrip("/")+"/"+nameprefix+".dmp")) and not force:
-            ans = input("Warning: {names} and/or {nodes} already exists, overwrite? (y/n): ")
-            if ans not in ["y","Y","yes", "Yes"]:
-                exit("Dump already exists, abort!")
-
         '''Create print out object'''
         logger.info("Loading module: WriteTaxonomy".format(type=args.taxonomy_type))
         write_module = dynamic_import("modules", "WriteTaxonomy")
-        write_obj = write_module(args.outdir, database=args.database,prefix=args.dump_prefix,separator=args.dump_sep,minimal=args.dump_mini,desc=args.dump_descriptions,dbprogram=args.dbprogram)
-
-        '''Print database to file'''
+        write_obj = write_module(args.outdir, database=args.database,prefix=args.dump_prefix,separator=args.dump_sep,minimal=args.dump_mini,desc=args.dump_descriptions,dbprogram=args.dbprogram,compress=args.dump_compress)
         if args.taxonomy_type == "NCBI":
             write_obj.set_minimal()
-        write_obj.nodes()
-        write_obj.names()
+
+        '''Skip the dump if the database and the dump settings are the same as for the last dump'''
+        if not args.force_dump and write_obj.unchanged():
+            logger.info("Database unchanged since the last dump ({fingerprint}), dump skipped (use --force_dump to write the files)".format(fingerprint=write_obj.fingerprint_path()))
+        else:
+            '''Check if datase exists if it does make sure the user intends to overwrite the file'''
+            nameprefix,nodeprefix = args.dump_prefix.split(",")
+            if (os.path.exists(write_obj.dump_path(nameprefix)) or os.path.exists(write_obj.dump_path(nodeprefix))) and not force:
+                ans = input("Warning: {names} and/or {nodes} already exists, overwrite? (y/n): ")
+                if ans not in ["y","Y","yes", "Yes"]:
+                    exit("Dump already exists, abort!")
+
+            '''Print database to file'''
+            write_obj.dump()
+            write_obj.save_fingerprint()
         if False: #args.taxDB:
             write_obj.set_separator("\t")
             write_obj.set_prefix("names,taxDB")
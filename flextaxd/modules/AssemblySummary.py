@@ -0,0 +1,149 @@
+#!/usr/bin/env python3 -c
+
+'''
+Resolve GCF/GCA accessions to taxonomic group, section and ftp path from NCBI assembly_summary files
+'''
+
+import os
+import re
+import time
+from itertools import chain
+from urllib.request import urlopen
+import logging
+logger = logging.getLogger(__name__)
+
+SUMMARY_URL = "https://ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/assembly_summary_{section}.txt"
+### Summary files of one group (https://ftp.ncbi.nlm.nih.gov/genomes/{section}/{group}/assembly_summary.txt) saved as assembly_summary_{section}_{group}.txt
+GROUP_FILE = re.compile(r"assembly_summary_(refseq|genbank)_(\w+)\.txt")
+
+class AssemblySummary(object):
+	"""AssemblySummary reads the NCBI assembly_summary_refseq.txt and assembly_summary_genbank.txt files
+		(downloaded to summary_dir if they are not there or older than max_age days) and maps each
+		accession to its taxonomic group, section and ftp path, instead of asking ncbi-genome-download
+		for each group in turn.
+
+		The summary of a section is read once, the first time an accession of that section is resolved,
+		and only accessions in the accessions list (all accessions if not given) are kept in memory.
+		Summary files of single groups (assembly_summary_{section}_{group}.txt) in summary_dir are read
+		as well, these are used for older summary files without a group column.
+	"""
+	def __init__(self, summary_dir="./", accessions=None, download=True, max_age=30):
+		super(AssemblySummary, self).__init__()
+		self.summary_dir = summary_dir.rstrip("/") or "."
+		self.accessions = set(accession.strip() for accession in accessions) if accessions is not None else None
+		self.download = download
+		self.max_age = max_age  ## Days before a summary file is downloaded again
+		self.index = {}         ## section: {accession: (group, ftp_path)}
+
+	def __repr__(self):
+		return "AssemblySummary({})".format(self.summary_dir)
+
+	def summary_file(self, section):
+		'''Path to the summary file of a section, downloaded if missing or too old
+
+		Returns
+		------
+			str - path to summary file (False if not available)
+		'''
+		path = "{dir}/assembly_summary_{section}.txt".format(dir=self.summary_dir,section=section)
+		if os.path.exists(path) and (not self.download or time.time()-os.path.getmtime(path) < self.max_age*86400):
+			return path
+		if not self.download:
+			return False
+		url = SUMMARY_URL.format(section=section)
+		logger.info("Download {url}".format(url=url))
+		try:
+			with urlopen(url,timeout=60) as response, open(path+".tmp","wb") as out:
+				while True:
+					data = response.read(1048576)
+					if not data:
+						break
+					out.write(data)
+			os.replace(path+".tmp",path)
+		except OSError as e:
+			logger.warning("Could not download {url}: {e}".format(url=url,e=e))
+			if os.path.exists(path+".tmp"):
+				os.remove(path+".tmp")
+			if os.path.exists(path):
+				logger.warning("Using old summary file {path}".format(path=path))
+				return path
+			return False
+		return path
+
+	def read_summary(self, path, group=False):
+		'''Read an assembly summary file, the columns are taken from the header line (#assembly_accession ...)
+
+		Parameters
+			str - path to assembly_summary file
+			str - taxonomic group of all assemblies in the file (False to use the group column)
+		------
+		Returns
+			dict - accession: (group, ftp_path)
+		'''
+		index = {}
+		columns = ["assembly_accession"]+["-"]*18+["ftp_path"]  ## Column order if the file has no header line
+		with open(path, encoding="utf-8", errors="replace") as f:
+			for line in f:
+				if not line.startswith("#"):
+					break
+				if line.lstrip("# ").startswith("assembly_accession"):
+					columns = line.lstrip("# ").rstrip("\n").split("\t")
+			else:
+				return index
+			if not group and "group" not in columns:
+				logger.warning("{path} has no group column and is not the summary of a single group, skipped".format(path=path))
+				return index
+			ftp_col = columns.index("ftp_path")
+			group_col = columns.index("group") if not group else None
+			for line in chain([line],f):
+				accession = line.split("\t",1)[0]
+				if self.accessions is None or accession in self.accessions:
+					row = line.rstrip("\n").split("\t")
+					if len(row) > ftp_col:
+						index[accession] = (row[group_col] if group_col is not None else group, row[ftp_col])
+		return index
+
+	def load(self, section):
+		'''Read the summary files of a section into the index'''
+		start = time.time()
+		index = {}
+		for fname in sorted(os.listdir(self.summary_dir)) if os.path.isdir(self.summary_dir) else []:
+			match = GROUP_FILE.fullmatch(fname)
+			if match and match.group(1) == section:
+				index.update(self.read_summary("{dir}/{fname}".format(dir=self.summary_dir,fname=fname),match.group(2)))
+		path = self.summary_file(section)
+		if path:
+			index.update(self.read_summary(path))
+		self.index[section] = index
+		logger.info("Read {n} {section} assemblies from assembly summary ({time:.1f}s)".format(n=len(index),section=section,time=time.time()-start))
+		return index
+
+	def get_section(self, accession):
+		'''Section of an accession, refseq for GCF and genbank for GCA'''
+		if accession.strip()[2] == "F":
+			return "refseq"
+		return "genbank"
+
+	def resolve(self, accession, section=False, force=False):
+		'''Find taxonomic group and ftp path of an accession
+
+		Parameters
+			str - accession (GCF_000000000.1)
+			str - section (default from accession)
+			boolean - look in the other section if the accession is not found
+		------
+		Returns
+			tuple - (group, section, ftp_path), (False, False, False) if not found
+		'''
+		accession = accession.strip()
+		if not section:
+			section = self.get_section(accession)
+		index = self.index[section] if section in self.index else self.load(section)
+		if accession in index:
+			group,ftp_path = index[accession]
+			return group,section,ftp_path
+		if force:
+			'''This should not be done as genomes removed from RefSeq usually are better to skip'''
+			other = "genbank" if section == "refseq" else "refseq"
+			return self.resolve(accession,section=other)
+		return False,False,False
@@ -9,9 +9,14 @@ import sys
 import gzip
 import random
 import os
-from multiprocessing import Process, Queue
+import zlib
 from subprocess import Popen,PIPE
 from .database.DatabaseConnection import DatabaseFunctions
+from .WorkScheduler import WorkScheduler,file_sizes
+from .functions import concatenate_files
+
+import logging
+logger = logging.getLogger(__name__)
 
 def zopen(path,*args, **kwargs):
 	'''Redefine open to handle zipped files automatically'''
@@ -25,7 +30,8 @@ def zopen(path,*args, **kwargs):
 
 class CreateGanonDB(object):
 	"""docstring for CreateGanonDB."""
-	def __init__(self, database, ganon_database, genomes_path, outdir,verbose=False,processes=1,limit=0,dbprogram="ganon",params=""):
+	blocksize = 4194304  ## Read and write buffer used when copying genomes into the library
+	def __init__(self, database, ganon_database, genomes_path, outdir,verbose=False,processes=1,limit=0,dbprogram="ganon",params="",chunksize=1):
 		super(CreateGanonDB, self).__init__()
 		self.database = DatabaseFunctions(database)
 		if outdir == "":
@@ -38,6 +44,7 @@ class CreateGanonDB(object):
 		self.accession_to_taxid = self.database.get_genomes(self.database , limit=limit)
 		self.files = []
 		self.processes = processes
+		self.chunksize = chunksize  ## Number of genomes a worker takes from the queue at a time
 		self.classifyDatabase= ganon_database
 		self.ncbi_rewrite_speed = "fastest"
 		self.verbose = verbose
@@ -46,51 +53,101 @@ class CreateGanonDB(object):
 			os.system("mkdir -p {classifyDatabase}".format(outdir = self.outdir, classifyDatabase=self.classifyDatabase))
 
 	def ganon_fasta_multiproc(self,filepaths,genomes):
-		'''function to run addition of genomes in paralell'''
-		jobs = []
-		for i in range(self.processes):
-			p = Process(target=self.ganon_fasta, args=(filepaths[i],genomes[i],i))
-			p.start()
-			jobs.append(p)
-		for job in jobs:
-			job.join()
+		'''function to run addition of genomes in paralell, genomes are scheduled largest first on a shared queue'''
+		self.genome_names = dict(zip(filepaths,genomes))
+		scheduler = WorkScheduler(self.processes,chunksize=self.chunksize)
+		results = scheduler.run(self.ganon_fasta,filepaths,file_sizes({filepath: filepath for filepath in filepaths}))
 		## Concatenate each tmp file (per processor) to one big datafile
-		os.system("cat {outdir}/.tmp*.gz > {classifyDatabase}/library.fasta.gz".format(outdir=self.outdir, classifyDatabase=self.classifyDatabase))
-		## Rm tmp files
-		os.system("rm {outdir}/.tmp*.gz".format(outdir=self.outdir))
+		shards = ["{outdir}/.tmp{process}.gz".format(outdir=self.outdir.rstrip("/"),process=i) for i in range(self.processes)]
+		maps = ["{outdir}/.tmp{process}.map".format(outdir=self.outdir.rstrip("/"),process=i) for i in range(self.processes)]
+		concatenate_files([shard for shard in shards if os.path.exists(shard)],"{classifyDatabase}/library.fasta.gz".format(classifyDatabase=self.classifyDatabase.rstrip("/")),remove=True)
+		concatenate_files([seqmap for seqmap in maps if os.path.exists(seqmap)],self.seqid2taxid,remove=True)
+		self.added = sum(n for n in results if n)
 		return "Processes done"
 
-	def ganon_fasta(self,filepaths, genomes,process):
-		'''Change fasta file to contain ganon fasta header'''
-		tmpname = ".tmp{rand}.gz".format(rand=process)
-		tmppath = "{outdir}/{tmppath}".format(outdir=self.outdir.rstrip("/"),tmppath=tmpname)
-		seqlen = 0
-		for i in range(len(filepaths)):
-			genome = genomes[i]
-			filepath = filepaths[i]
-			taxid = self.accession_to_taxid[genome]
-			with zopen(filepath,"r") as f:
-				'''Create a sequence to taxid mapping file according to ganon specifications
-					Pre-generated file with sequence information
-					(seqid <tab> seq.len <tab> taxid [<tab> assembly id])
-				'''
-				with open(self.seqid2taxid, "a") as seqidtotaxid:
-					for line in f:
-						if line.startswith(">"):
-							if seqlen > 0:
-								print(row[0].lstrip(">"),seqlen , taxid,end="\n", sep="\t",file=seqidtotaxid)  ## print contig name to seqtoid map
-							row = line.split(" ")
-							seqlen = 0
-						else:
-							## count lenght of sequence
-							seqlen += len(line.strip())
-						#print(row[0].lstrip(">"),seqlen , taxid,end="\n", sep="\t",file=seqidtotaxid)   ## print chromosome name to seqtoid map
-						#seqlen = 0
-					print(row[0].lstrip(">"),seqlen , taxid,end="\n", sep="\t",file=seqidtotaxid)   ## print chromosome name to seqtoid map
-					seqlen = 0
-			## Concatenate source files into one big file (per processor)
-			os.system("cat {file} >> {tmppath}".format(file=filepath, tmppath=tmppath))
-		return
+	def sequence_lengths(self,data,state,seqinfo,taxid):
+		'''Count sequence lengths in a block of (decompressed) fasta data, state keeps the current sequence between
+			blocks, finished sequences are added to seqinfo (seqid, seq.len, taxid)'''
+		pos = 0
+		while pos < len(data):
+			if state["header"] is not None:
+				end = data.find(b"\n",pos)
+				if end < 0:
+					state["header"] += data[pos:]
+					break
+				state["seqid"] = (state["header"]+data[pos:end]).decode("utf-8").split(" ")[0].strip()
+				state["header"] = None
+				state["line_start"] = True
+				pos = end+1
+				continue
+			if state["line_start"] and data[pos:pos+1] == b">":
+				self.end_sequence(state,seqinfo,taxid)
+				state["header"] = b""
+				pos += 1
+				continue
+			end = data.find(b"\n>",pos)
+			end = len(data) if end < 0 else end+1
+			## count lenght of sequence
+			state["seqlen"] += len(data[pos:end].translate(None,b" \t\r\n\x0b\x0c"))
+			state["line_start"] = data[end-1:end] == b"\n"
+			pos = end
+		return state
+
+	def end_sequence(self,state,seqinfo,taxid):
+		'''Add the current sequence to seqinfo'''
+		if state["seqid"] and state["seqlen"] > 0:
+			seqinfo.append("{seqid}\t{seqlen}\t{taxid}".format(seqid=state["seqid"],seqlen=state["seqlen"],taxid=taxid))
+		state["seqlen"] = 0
+
+	def ganon_fasta(self,filepaths,process):
+		'''Copy gzipped genomes to the library shard of the process and create the sequence to taxid map, each
+			file is read once, the compressed data is written to the shard as it is (gzip members can be
+			concatenated) and decompressed in memory to count sequence lengths
+
+			Create a sequence to taxid mapping file according to ganon specifications
+			Pre-generated file with sequence information
+			(seqid <tab> seq.len <tab> taxid [<tab> assembly id])
+
+		Returns
+		------
+			int - number of genomes added
+		'''
+		tmppath = "{outdir}/.tmp{process}.gz".format(outdir=self.outdir.rstrip("/"),process=process)
+		tmpmap = "{outdir}/.tmp{process}.map".format(outdir=self.outdir.rstrip("/"),process=process)
+		added = 0
+		with open(tmppath,"wb",buffering=self.blocksize) as tmpout, open(tmpmap,"w") as seqidtotaxid:
+			for filepath in filepaths:
+				taxid = self.accession_to_taxid[self.genome_names[filepath]]
+				start = tmpout.tell()
+				seqinfo = []
+				state = {"seqid": False, "seqlen": 0, "header": None, "line_start": True}
+				decompressor = zlib.decompressobj(zlib.MAX_WBITS|16)
+				member = False  ## Data of the current gzip member has been read
+				try:
+					with open(filepath,"rb") as f:
+						for block in iter(lambda: f.read(self.blocksize), b""):
+							tmpout.write(block)
+							while block:
+								member = True
+								self.sequence_lengths(decompressor.decompress(block),state,seqinfo,taxid)
+								block = b""
+								if decompressor.eof:  ## Next gzip member
+									block = decompressor.unused_data
+									decompressor = zlib.decompressobj(zlib.MAX_WBITS|16)
+									member = False
+					if member:
+						raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+				except (zlib.error,EOFError,OSError) as e:
+					logger.warning("Could not process {genome}, {e}".format(genome=filepath,e=e))
+					'''Remove the partially written genome from the shard'''
+					tmpout.seek(start)
+					tmpout.truncate()
+					continue
+				self.end_sequence(state,seqinfo,taxid)
+				for line in seqinfo:
+					print(line,end="\n",file=seqidtotaxid)  ## print contig name to seqtoid map
+				added += 1
+		return added
 
 	def process_folder(self):
 		id_dict = self.accession_to_taxid
@@ -113,17 +170,10 @@ class CreateGanonDB(object):
 				else:
 					pass
 
-		processes = self.processes
-		self.files = self.split(self.files,processes)
-		self.GCF_names = self.split(self.GCF_names,processes)
 		print(self.ganon_fasta_multiproc(self.files,self.GCF_names))
-		print("Number of genomes added to ganon database: {count}".format(count=count))
+		print("Number of genomes added to ganon database: {count}".format(count=self.added))
 		return self.files
 
-	def split(self,a, n):
-		k, m = divmod(len(a), n)
-		return list(a[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n))
-
 	def create_database(self,outdir,keep=False):
 		'''For test create a small database and run tests'''
 		if not os.path.exists("{ganon}/taxonomy".format(outdir=outdir, ganon=self.classifyDatabase)):
@@ -9,9 +9,11 @@ import sys
 import gzip
 import random
 import os
-from multiprocessing import Process, Queue
+import zlib
 from subprocess import Popen,PIPE
 from .database.DatabaseConnection import DatabaseFunctions
+from .WorkScheduler import WorkScheduler,file_sizes
+from .functions import concatenate_files
 from time import sleep
 from gzip import BadGzipFile
 
@@ -30,7 +32,8 @@ def zopen(path,*args, **kwargs):
 
 class CreateGanonDB(object):
 	"""docstring for CreateGanonDB."""
-	def __init__(self, database, ganon_database, genome_names, outdir,verbose=False,debug=False,processes=1,limit=0,dbprogram="ganon",params="",create_db=False,skip=False,build_processes=False,usezip=False):
+	blocksize = 4194304  ## Read and write buffer used when streaming genomes into the library
+	def __init__(self, database, ganon_database, genome_names, outdir,verbose=False,debug=False,processes=1,limit=0,dbprogram="ganon",params="",create_db=False,skip=False,build_processes=False,usezip=False,chunksize=1):
 		super(CreateGanonDB, self).__init__()
 		self.database = DatabaseFunctions(database)
 		if outdir == "":
@@ -47,6 +50,7 @@ class CreateGanonDB(object):
 		if usezip:
 			self.usezip+=".gz"
 		self.processes = processes
+		self.chunksize = chunksize  ## Number of genomes a worker takes from the queue at a time
 		if not build_processes:
 			self.build_processes = self.processes
 		else:
@@ -58,22 +62,105 @@ class CreateGanonDB(object):
 			os.system("mkdir -p {ganondb}".format(outdir = self.outdir, ganondb=self.ganondb))
 
 	def ganon_fasta_multiproc(self,genomes):
-		'''function to run addition of genomes in paralell'''
-		jobs = []
-		for i in range(self.processes):
-			p = Process(target=self.ganon_fasta, args=(genomes[i],i))
-			p.start()
-			jobs.append(p)
-		for job in jobs:
-			job.join()
+		'''function to run addition of genomes in paralell, genomes are scheduled largest first on a shared queue'''
+		scheduler = WorkScheduler(self.processes,chunksize=self.chunksize)
+		scheduler.run(self.ganon_fasta,genomes,file_sizes({genome: self.genome_path[genome] for genome in genomes}))
 		## Concatenate each tmp file (per processor) to one big datafile
 		logger.info("Merge tmp files.")
 		logger.debug("Merge geneid map")
-		os.system("cat {outdir}/.tmp*.map > {taxidmap}".format(outdir=self.outdir, taxidmap=self.seqid2taxid))
-		os.system("rm {outdir}/.tmp*.map".format(outdir=self.outdir))
+		maps = ["{outdir}/.tmp{process}.map".format(outdir=self.outdir.rstrip("/"),process=i) for i in range(self.processes)]
+		concatenate_files([seqmap for seqmap in maps if os.path.exists(seqmap)],self.seqid2taxid,remove=True)
+		return "Processes done"
 
+	def ganon_sequences(self,source,tmpout,genome,taxid):
+		'''Stream a fasta file to the ganon library, sequence lines are written as they are read (stripped, empty
+			lines removed) and the header of a sequence is written with its first sequence line. Each sequence
+			id is made unique by adding the genome id. The file is read in blocks of blocksize bytes, blocks
+			with only sequence lines are written as they are, so memory does not depend on the size of the sequences.
 
-		return "Processes done"
+			Create a sequence to taxid mapping file according to ganon specifications
+			Pre-generated file with sequence information
+			(seqid <tab> seq.len <tab> taxid [<tab> assembly id])
+
+		Returns
+		------
+			list - seq-info lines of the sequences written
+		'''
+		seqinfo = []
+		id = False
+		seqlen = 0
+		open_line = False  ## Part of a sequence line is written without newline
+		line_start = True
+		leading = False  ## A line started in a previous block has had only whitespace
+		carry = b""
+		while True:
+			data = source.read(self.blocksize)
+			block = carry + data if carry else data
+			carry = b""
+			if not block:
+				break
+			if id and self.sequence_block(block,line_start):
+				### Only sequence lines, count and write the block as is
+				if seqlen == 0:
+					tmpout.write(b">"+id.encode("utf-8")+b"\n")  ## Print new unique header
+				seqlen += len(block)-block.count(b"\n")
+				tmpout.write(block)
+				line_start = block.endswith(b"\n")
+				open_line = not line_start
+				leading = False
+				continue
+			for line in block.splitlines(True):
+				if line_start and line.startswith(b">"):
+					if data and not line.endswith((b"\n",b"\r")):
+						carry = line  ## Header continues in the next block
+						break
+					if open_line:
+						tmpout.write(b"\n")
+						open_line = False
+					if seqlen > 0:
+						seqinfo.append("{id}\t{seqlen}\t{taxid}".format(id=id,seqlen=seqlen,taxid=taxid))
+					seqlen = 0
+					## Update ID
+					id = line.decode("utf-8").split(" ")[0].lstrip(">").strip()+"_"+genome
+					continue
+				line_end = line.endswith((b"\n",b"\r"))
+				if data and not line_end:
+					'''Whitespace at the end of a partial line is carried to the next block, it is only removed if the line ends there'''
+					sequence = line.rstrip()
+					carry = line[len(sequence):]
+					line = sequence
+				sequence = line.strip() if line_start or leading else line.rstrip()  ## Leading whitespace is only removed at the start of a line
+				leading = not line_end and (line_start or leading) and not sequence  ## Only whitespace so far in this line
+				line_start = line_end
+				if sequence:
+					if not id:
+						logger.debug("Sequence before the first header in {genome} is skipped".format(genome=genome))
+						continue
+					if seqlen == 0:
+						tmpout.write(b">"+id.encode("utf-8")+b"\n")  ## Print new unique header
+					## count lenght of sequence
+					seqlen += len(sequence)
+					tmpout.write(sequence)
+					open_line = True
+				if line_start and open_line:
+					tmpout.write(b"\n")
+					open_line = False
+		if open_line:
+			tmpout.write(b"\n")
+		if seqlen > 0: ## Print final sequence after loop has completed
+			seqinfo.append("{id}\t{seqlen}\t{taxid}".format(id=id,seqlen=seqlen,taxid=taxid))
+		return seqinfo
+
+	def sequence_block(self,block,line_start):
+		'''Check if a block only contains sequence data in lines without surrounding whitespace or empty lines'''
+		if block[:1] in (b"\n",b"\r") or (line_start and block[:1] == b">"):
+			return False
+		if b"\n>" in block or b"\n\n" in block:
+			return False
+		for space in (b" ",b"\t",b"\r",b"\x0b",b"\x0c"):
+			if space in block:
+				return False
+		return len(block) > block.count(b"\n")
 
 	def ganon_fasta(self,genomes,process):
 		'''Change fasta file to contain ganon fasta header'''
@@ -81,81 +168,46 @@ class CreateGanonDB(object):
 		tmpmapname =  ".tmp{rand}.map".format(rand=process)
 		tmppath = "{outdir}/{tmppath}".format(outdir=self.ganondb.rstrip("/"),tmppath=tmpname)
 		tmpmap =  "{outdir}/{tmppath}".format(outdir=self.outdir.rstrip("/"),tmppath=tmpmapname)
-		seqlen = 0
-		tmpout = open(tmppath, "w")  ## Open thread output file
-		for i in range(len(genomes)):
-			genome = genomes[i]
-			filepath = self.genome_path[genome]
-			try:
-				taxid = self.accession_to_taxid[genome]
-			except KeyError:
-				logger.debug("# WARNING: {genome} could not be added to database".format(genome=genome))
-				continue
-			with zopen(filepath,"r") as f:
-				'''Create a sequence to taxid mapping file according to ganon specifications
-					Pre-generated file with sequence information
-					(seqid <tab> seq.len <tab> taxid [<tab> assembly id])
-				'''
-				### Set local variables
-				lines = []
-				seqlen = 0
-				idstring = ""
-				header = ">{id}	{seqlen}	{taxid}"
-				with open(tmpmap, "a") as seqidtotaxid:
-					try:
-						for line in f:
-							if line.startswith(">"):
-								row = line.split(" ")
-								header_id = row[0].lstrip(">").strip()+"_"+genome
-								if seqlen > 0:  ## Print header and data
-									header = header.format(id=id,seqlen=seqlen,taxid=taxid)
-									idstring = ">"+id
-									print(header.lstrip(">"),end="\n",file=seqidtotaxid)
-									print(idstring, file=tmpout)  ## Print new unique header
-									print("\n".join(lines),file=tmpout)
-									## Reset local variables
-									lines = []
-									seqlen = 0
-									header = ">{id}	{seqlen}	{taxid}"
-								## Update ID
-								id = row[0].lstrip(">").strip()+"_"+genome
-							else:
-								## count lenght of sequence
-								seqlen += len(line.strip())
-								string = line.strip()
-								if string != "":
-									lines.append(string)
-								#print(line.strip(), file=tmpout)
-						if seqlen > 0: ## Print final sequence after loop has completed
-							header = header.format(id=id,seqlen=seqlen,taxid=taxid)
-							print(header.lstrip(">"),end="\n",file=seqidtotaxid)
-							print(idstring, file=tmpout)  ## Print new unique header
-							print("\n".join(lines),file=tmpout)
-							seqlen = 0
-					except BadGzipFile as e:
-						logger.warning("Could not process {output}, not a valid gzip file".format(output=genome))
-					except EOFError as e:
-						logger.warning("Compressed file ended before the end-of-stream marker was reached {output}".format(output=genome))
-		sleep(0.01)
-		tmpout.close()
+		with open(tmppath,"wb",buffering=self.blocksize) as tmpout, open(tmpmap,"w") as seqidtotaxid:  ## Open thread output files
+			for genome in genomes:
+				filepath = self.genome_path[genome]
+				try:
+					taxid = self.accession_to_taxid[genome]
+				except KeyError:
+					logger.debug("# WARNING: {genome} could not be added to database".format(genome=genome))
+					continue
+				start = tmpout.tell()
+				try:
+					with (gzip.open(filepath,"rb") if filepath.endswith(".gz") else open(filepath,"rb")) as f:
+						seqinfo = self.ganon_sequences(f,tmpout,genome,taxid)
+				except BadGzipFile as e:
+					logger.warning("Could not process {output}, not a valid gzip file".format(output=genome))
+					seqinfo = False
+				except EOFError as e:
+					logger.warning("Compressed file ended before the end-of-stream marker was reached {output}".format(output=genome))
+					seqinfo = False
+				except (zlib.error,OSError) as e:
+					logger.warning("Could not process {output}, {e}".format(output=genome,e=e))
+					seqinfo = False
+				if seqinfo is False:
+					'''Remove the partially written genome from the library'''
+					tmpout.seek(start)
+					tmpout.truncate()
+					continue
+				for line in seqinfo:
+					print(line,end="\n",file=seqidtotaxid)
 		if self.usezip:
 			os.system("gzip {tmpout}".format(tmpout=tmppath))
-		print("Process-{process} completed".format(process=process),end="\r")
+		logger.debug("Process-{process} completed".format(process=process))
 		return True
 
 	def create_library_from_files(self):
-		processes = self.processes
 		logger.info("Process {ngen} genomes".format(ngen=len(self.genome_names)))
-		genome_process_list = self.split(self.genome_names,processes)
-		logger.info(self.ganon_fasta_multiproc(genome_process_list))
+		logger.info(self.ganon_fasta_multiproc(self.genome_names))
 		#sleep(1)
 		#logger.info("Number of genomes added to ganon database: {count}".format(count=len(self.genome_names)))
 		return
 
-	def split(self,a, n):
-		k, m = divmod(len(a), n)
-		return list(a[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n))
-
 	def create_database(self,outdir,keep=False):
 		'''For test create a small database and run tests'''
 		if not os.path.exists("{ganon}/taxonomy".format(outdir=outdir, ganon=self.ganondb)):
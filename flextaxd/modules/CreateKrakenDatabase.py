@@ -10,9 +10,11 @@ import gzip
 import random
 import os
 import glob
-from multiprocessing import Process,Manager,Pool
+import heapq
 from subprocess import Popen,PIPE,check_output,CalledProcessError
 from .database.DatabaseConnection import DatabaseFunctions
+from .functions import concatenate_files
+from .WorkScheduler import WorkScheduler,file_sizes
 from time import sleep
 from gzip import BadGzipFile
 
@@ -31,7 +33,9 @@ def zopen(path,*args, **kwargs):
 
 class CreateKrakenDatabase(object):
 	"""docstring for CreateKrakenDatabase."""
-	def __init__(self, database, kraken_database, genome_names, outdir,verbose=False,processes=1,limit=0,dbprogram="kraken2",params="",skip="",create_db=False,debug=False,build_processes=None):
+	blocksize = 4194304  ## Read and write buffer used when streaming genomes into the library
+	map_runsize = 1000000  ## seqid2taxid map lines a worker sorts in memory before writing them as a run
+	def __init__(self, database, kraken_database, genome_names, outdir,verbose=False,processes=1,limit=0,dbprogram="kraken2",params="",skip="",create_db=False,debug=False,build_processes=None,chunksize=1,validate_map=False):
 		super(CreateKrakenDatabase, self).__init__()
 		self.krakenversion = dbprogram
 		self.database = DatabaseFunctions(database)
@@ -47,6 +51,7 @@ class CreateKrakenDatabase(object):
 		self.files = []
 		self.params = params
 		self.processes = processes
+		self.chunksize = chunksize  ## Number of genomes a worker takes from the queue at a time
 		if not build_processes:
 			self.build_processes = self.processes
 		else:
@@ -56,10 +61,7 @@ class CreateKrakenDatabase(object):
 		self.create_db = create_db
 		self.limit = limit
 		self.debug = debug
-		if self.debug:
-			self.taxidmap_debug = self.database.get_nodes()
-		self.seqhead_validator = {}
-		self.seqhead_count = 0
+		self.validate_map = validate_map or debug  ## Check that sequence ids are unique when the map is merged
 		if skip:
 			self.skiptax = parse_skip(skip.split(","))  ## if node should be skipd this must be true, otherwise nodes in modfile are added to existing database
 		else:
@@ -68,114 +70,214 @@ class CreateKrakenDatabase(object):
 		if not os.path.exists("{krakendb}".format(outdir = self.outdir, krakendb=self.krakendb)):
 			os.system("mkdir -p {krakendb}".format(outdir = self.outdir, krakendb=self.krakendb))
 
-	def _split(self,a, n):
-		k, m = divmod(len(a), n)
-		return list(a[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n))
-
 	def kraken_fasta_header_multiproc(self,genomes):
-		'''function to run addition of genomes in paralell'''
+		'''function to run addition of genomes in paralell, genomes are scheduled largest first on a shared queue
+			and each process writes its own library shard'''
 		logger.info("Processing files; create kraken seq.map")
-		jobs = []
-		manager = Manager()
-		added = manager.Queue()
-		for i in range(self.processes):
-			p = Process(target=self.kraken_fasta_header, args=(genomes[i],added))
-			p.daemon=True
-			p.start()
-			jobs.append(p)
-		for job in jobs:
-			job.join()
-		self.added = added.qsize()
+		self.library_shards = ["{db_path}/library/batch_{i}.fasta".format(db_path=self.krakendb.rstrip("/"),i=i) for i in range(self.processes)]
+		scheduler = WorkScheduler(self.processes,chunksize=self.chunksize)
+		results = scheduler.run(self.kraken_fasta_header,genomes,file_sizes({genome: self.genome_path[genome] for genome in genomes}))
+		self.added = 0
+		self.map_runs = []
+		for result in results:
+			if result:
+				self.added += result[0]
+				self.map_runs += result[1]
 		return "Processes done"
 
-	def kraken_fasta_header(self,genomes,added):
-		'''Change fasta file to contain kraken fasta header'''
+	def format_header(self,header,taxid):
+		'''Format a fasta header line (bytes without newline) for the library and the seqid2taxid map
+
+		Returns
+		------
+			bytes - header line for the library (with newline)
+			list - seqid2taxid map columns of the sequence
+		'''
+		kraken_header = "kraken:taxid"
+		line = header.decode("utf-8")
+		row = line.strip().split(" ")
+		if len(row) == 1:
+			row.append("")
+		endhead = "\n"  ## Remove end heading in all files as it may contain bad chars
+		'''Format sequence header'''
+		if not self.krakenversion == "krakenuniq":
+			line = row[0] + "|" + kraken_header + "|" + str(taxid) + "  " + endhead	 ## Nessesary to be able to add sequences outside NCBI
+		else:
+			line = line + "\n"
+		'''Format seqid2taxid map'''
+		if not self.krakenversion == "kraken2":
+			taxidmap = [row[0].lstrip(">"), str(taxid)]
+		else:
+			taxidmap= ["TAXID", row[0].lstrip(">") + "|" + kraken_header + "|" + str(taxid), str(taxid)]
+		return line.encode("utf-8"),taxidmap
+
+	def rewrite_fasta(self,source,library,taxid):
+		'''Stream a fasta file in blocks of blocksize bytes to the library, sequence data is written unchanged
+			and only header lines are rewritten
+
+		Returns
+		------
+			list - seqid2taxid map lines
+		'''
+		taxidlines = []
+		buffer = b""
+		line_start = True  ## buffer[0] is the first character of a line
+		while True:
+			block = source.read(self.blocksize)
+			if b"\r" in block:
+				### Universal newlines, as when genomes were read in text mode
+				if block.endswith(b"\r"):
+					block += source.read(1)
+				block = block.replace(b"\r\n",b"\n").replace(b"\r",b"\n")
+			buffer = buffer + block if buffer else block
+			pos = 0
+			while pos < len(buffer):
+				if line_start and buffer[pos:pos+1] == b">":
+					end = buffer.find(b"\n",pos)
+					if end < 0:
+						if block:
+							break  ## Header continues in the next block
+						end = len(buffer)
+					line,taxidmap = self.format_header(buffer[pos:end],taxid)
+					library.write(line)
+					if taxidmap[0] != "" and taxid: ## print chromosome name to seqtoid map
+						taxidlines.append("\t".join(taxidmap))
+					pos = end+1
+					continue
+				header = buffer.find(b"\n>",pos)
+				if header < 0:
+					library.write(buffer[pos:] if pos else buffer)
+					line_start = buffer.endswith(b"\n")
+					pos = len(buffer)
+					break
+				library.write(buffer[pos:header+1])
+				line_start = True
+				pos = header+1
+			buffer = buffer[pos:]
+			if not block:
+				break
+		if not line_start:
+			library.write(b"\n")  ## The next genome in the shard must start on a new line
+		return taxidlines
+
+	def kraken_fasta_header(self,genomes,process):
+		'''Change fasta file to contain kraken fasta header, genomes are streamed into the library shard of the process
+
+		Returns
+		------
+			int - number of genomes added
+			list - sorted runs of the seqid2taxid map written by the process
+		'''
+		shard = self.library_shards[process]
 		count = 0
+		added = 0
+		map_lines,map_runs = [],[]
 		batchint = random.randint(10**3,10**7)
-		tmpbatch = "{db_path}/library/batch_{rand}.fasta".format(db_path=self.krakendb,rand=batchint)
-		check_output("touch {tmpfile}".format(tmpfile=tmpbatch),shell=True)
 		tmplog = "{outdir}/{rand}.log".format(outdir=self.outdir.rstrip("/"),rand=batchint)
-		for i in range(len(genomes)):
-			genome = genomes[i]
-			filepath = self.genome_path[genome]
-			kraken_header = "kraken:taxid"
-			tmpname = ".tmp{rand}.gz".format(rand=random.randint(10**7,10**9))
-			tmppath = "{outdir}/{tmppath}".format(outdir=self.outdir.rstrip("/"),tmppath=tmpname).rstrip(".gz")
-
-			'''Get taxid from database'''
-			try:
-				taxid = self.accession_to_taxid[genome]
-			except KeyError:
+		with open(shard,"wb",buffering=self.blocksize) as library:
+			for genome in genomes:
+				filepath = self.genome_path[genome]
+
+				'''Get taxid from database'''
 				try:
-					taxid = self.accession_to_taxid[filepath.rsplit("/")[-1]]
+					taxid = self.accession_to_taxid[genome]
 				except KeyError:
-					with open(tmplog, "a") as f:
-						print(genome,file=f)
-					count +=1
-					logger.debug("#Warning kraken header could not be added to {genome}! Total: {count}".format(genome=genome,count=count))
+					try:
+						taxid = self.accession_to_taxid[filepath.rsplit("/")[-1]]
+					except KeyError:
+						with open(tmplog, "a") as f:
+							print(genome,file=f)
+						count +=1
+						logger.debug("#Warning kraken header could not be added to {genome}! Total: {count}".format(genome=genome,count=count))
 
-					continue
-			if self.create_db:
-				if taxid not in self.skiptax:
-					'''Open temp file for manipulated (unzipped) genome fasta files'''
-					tmpfile = zopen(tmppath,"w")
-					taxidlines = []  ## Holder for sequences to be added to the seqid2taxid map from each file
-					'''Open input genome fasta file'''
-					with zopen(filepath,"r") as f:
+						continue
+				if self.create_db:
+					if taxid not in self.skiptax:
+						start = library.tell()
+						'''Open input genome fasta file'''
 						try:
-							for line in f:
-								if line.startswith(">"):
-									taxidmap = []
-									row = line.strip().split(" ")
-									seq_header = row[0]
-									if self.debug:
-										self.seqhead_validator[seq_header] = [seq_header, genome, str(taxid),self.taxidmap_debug[taxid],filepath]
-										self.seqhead_count +=1
-									if len(row) == 1:
-										row.append("")
-									endhead = " ".join(row[1:])
-									if True:  ## Remove end heading in all files as it may contain bad chars
-										endhead = "\n"
-									'''Format sequence header'''
-									if not self.krakenversion == "krakenuniq":
-										line = row[0] + "|" + kraken_header + "|" + str(taxid) + "  " + endhead	 ## Nessesary to be able to add sequences outside NCBI
-									'''Format seqid2taxid map'''
-									if not self.krakenversion == "kraken2":
-										taxidmap = [row[0].lstrip(">"), str(taxid), endhead]
-									else:
-										taxidmap= ["TAXID", row[0].lstrip(">") + "|" + kraken_header + "|" + str(taxid), str(taxid)]
-									'''Add taxid to map'''
-									if taxidmap[0] != "" and taxid: ## print chromosome name to seqtoid map
-										taxidlines.append("\t".join(taxidmap)) ## print chromosome name to seqtoid map
-									'''Don´t include empty lines'''
-								print(line, end="", file=tmpfile)
-						except BadGzipFile as e:
-							logger.warning("Could not process {output}, not a valid gzip file".format(output=genome))
-						except EOFError as e:
-							logger.warning("Compressed file ended before the end-of-stream marker was reached {output}".format(output=genome))
-					tmpfile.close()  ## Close and save tmp file
-					with open(self.seqid2taxid, "a") as seqidtotaxid:
-						print("\n".join(taxidlines),end="\n",file=seqidtotaxid)
-					output = self.krakendb.rstrip("/")+"/"+filepath.split("/")[-1].rstrip(".gz")
-					os.rename(tmppath, output)
-					try:
-						#ans = check_output(self.krakenversion+"-build --add-to-library {file} --skip-maps --db {krakendb}  > /dev/null 2>&1 ".format(file=output,krakendb=self.krakendb),shell=True)
-						check_output("cat {output} >> {tmpbatch}".format(output=output,tmpbatch=tmpbatch),shell=True)
-						added.put(1)
-					except CalledProcessError as e:
-						logger.debug("Could not process {output}, the following error occured:\n{e}".format(output=output,e=e))
-					finally:
-						os.remove(output)
-		'''Validate file'''
-		if self.debug:
-			if len(self.seqhead_validator.keys()) != self.seqhead_count:
-				logger.warning("Sequence headers are not unique added: {added} unique: {nunique}".format(nunique=len(self.seqhead_validator.keys()), added=self.seqhead_count))
-				tmpdebug = "{db_path}/library/batch_{rand}.debug".format(db_path=self.krakendb,rand=batchint)
-				with open(tmpdebug, "w") as debugwrite:
-					for seq_header in self.seqhead_validator.keys():
-						print("\t".join(self.seqhead_validator[seq_header]),end="\n",file=debugwrite)
-				return False
-		return tmpbatch
+							with (gzip.open(filepath,"rb") if filepath.endswith(".gz") else open(filepath,"rb")) as f:
+								taxidlines = self.rewrite_fasta(f,library,taxid)
+						except (BadGzipFile,EOFError,OSError) as e:
+							logger.warning("Could not process {output}, {e}".format(output=genome,e=e))
+							'''Remove the partially written genome from the shard'''
+							library.seek(start)
+							library.truncate()
+							continue
+						map_lines += taxidlines
+						if len(map_lines) >= self.map_runsize:
+							map_runs.append(self.write_map_run(map_lines,process,len(map_runs)))
+							map_lines = []
+						added += 1
+		if map_lines:
+			map_runs.append(self.write_map_run(map_lines,process,len(map_runs)))
+		return added,map_runs
+
+	def map_key(self,line):
+		'''Sort key of a seqid2taxid map line, the sequence id (then the line to make the order deterministic)'''
+		if self.krakenversion == "kraken2":
+			seqid = line.split("\t",2)[1].rsplit("|kraken:taxid|",1)[0]
+		else:
+			seqid = line.split("\t",1)[0]
+		return seqid,line
+
+	def write_map_run(self,map_lines,process,run):
+		'''Sort seqid2taxid map lines and write them to a run file of the process
+
+		Returns
+		------
+			str - path to the run file
+		'''
+		path = "{db_path}/library/seqid2taxid_{process}_{run}.part".format(db_path=self.krakendb.rstrip("/"),process=process,run=run)
+		map_lines.sort(key=self.map_key)
+		with open(path,"w",buffering=self.blocksize) as maprun:
+			maprun.writelines(line+"\n" for line in map_lines)
+		return path
+
+	def merge_map(self,map_runs):
+		'''Merge the sorted seqid2taxid map runs of all processes into one map (sorted on sequence id), with
+			validate_map sequence ids found more than once are counted and written to seqid2taxid.duplicates
+
+		Returns
+		------
+			int - number of sequence ids found more than once
+		'''
+		logger.info("Merge {n} seqid2taxid map runs into {map}".format(n=len(map_runs),map=self.seqid2taxid))
+		runs = [open(run,"r",buffering=self.blocksize) for run in map_runs]
+		duplicates = 0
+		duplicates_file = "{outdir}/seqid2taxid.duplicates".format(outdir=self.outdir.rstrip("/"))
+		try:
+			with open(self.seqid2taxid,"w",buffering=self.blocksize) as seqidtotaxid:
+				merged = heapq.merge(*runs,key=lambda line: self.map_key(line.rstrip("\n")))
+				if not self.validate_map:
+					seqidtotaxid.writelines(merged)
+				else:
+					with open(duplicates_file,"w") as duplicatelog:
+						prev_seqid,prev_line = None,None
+						for line in merged:
+							seqid = self.map_key(line.rstrip("\n"))[0]
+							if seqid == prev_seqid:
+								if prev_line:
+									duplicates += 1
+									duplicatelog.write(prev_line)
+								duplicatelog.write(line)
+								prev_line = None
+							else:
+								prev_line = line
+							prev_seqid = seqid
+							seqidtotaxid.write(line)
+		finally:
+			for run in runs:
+				run.close()
+		for run in map_runs:
+			os.remove(run)
+		if self.validate_map:
+			if duplicates > 0:
+				logger.warning("{n} sequence ids occur more than once in the seqid2taxid map, see {file}".format(n=duplicates,file=duplicates_file))
+			else:
+				logger.info("All sequence ids in the seqid2taxid map are unique")
+				os.remove(duplicates_file)
+		return duplicates
 
 	def get_skip_list(self):
 		'''get taxonomy ids not wanted'''
@@ -193,14 +295,14 @@ class CreateKrakenDatabase(object):
 		if self.limit:
 			logger.info("Test use only {n} genomes".format(n=self.limit))
 			self.genome_names = self.genome_names[0:self.limit]
-		self.genome_names_split = self._split(self.genome_names,self.processes)
 		if not os.path.exists("{db_path}/library/".format(db_path=self.krakendb)):
 			logger.info("Create library directory")
 			os.mkdir("{db_path}/library/".format(db_path=self.krakendb))
-		self.kraken_fasta_header_multiproc(self.genome_names_split)
+		self.kraken_fasta_header_multiproc(self.genome_names)
 		'''Merge library files into one library'''
-		check_output("cat {db_path}/library/batch*.fasta > {db_path}/library/library.fna".format(db_path=self.krakendb),shell=True)
-		check_output("rm {db_path}/library/batch*.fasta".format(db_path=self.krakendb),shell=True)
+		shards = [shard for shard in self.library_shards if os.path.exists(shard)]
+		concatenate_files(shards,"{db_path}/library/library.fna".format(db_path=self.krakendb.rstrip("/")),remove=True)
+		self.merge_map(self.map_runs)
 		logger.info("Number of genomes succesfully added to the {krakenversion} database: {count}".format(count=self.added,krakenversion=self.krakenversion))
 		return
 
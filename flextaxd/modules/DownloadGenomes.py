@@ -7,12 +7,17 @@ import logging
 logger = logging.getLogger(__name__)
 
 from modules.functions import download_genomes
+from modules.AssemblySummary import AssemblySummary
+from modules.GenomeDownloader import GenomeDownloader
 from multiprocessing import Process,Manager,Pool
 
 class DownloadGenomes(object):
-	"""DownloadGenomes takes a list of genome names (GCF or GCA) and download (if possible) files from NCBI refseq and or genbank"""
+	"""DownloadGenomes takes a list of genome names (GCF or GCA) and download (if possible) files from NCBI refseq and or genbank
+		Genomes listed in the assembly summary are downloaded over https in parallel threads (GenomeDownloader),
+		without an assembly summary (summary_dir False) each genome is downloaded by ncbi-genome-download
+	"""
 
-	def __init__(self,processes=20,outdir="./",force=False):
+	def __init__(self,processes=20,outdir="./",force=False,summary_dir=False,base_url=False):
 		super(DownloadGenomes, self).__init__()
 		self.not_downloaded = []        ## Place holder for files not possible to download
 		self.download_map   = []        ## Place holder for files in subprocess
@@ -21,6 +26,8 @@ class DownloadGenomes(object):
 		self.genome_path = {}
 		self.outdir = outdir
 		self.force=force
+		self.summary_dir = summary_dir  ## Directory with assembly_summary files, False to download with ncbi-genome-download
+		self.base_url = base_url        ## Download from this server instead of the host in the ftp path (mirror)
 		if self.force:
 			logger.info("Download genomes even if given GCF is not available WARNING: this may attempt to download withdrawn genome assemblies!")
 		max = 50
@@ -50,21 +57,30 @@ class DownloadGenomes(object):
 		'''Write missing genomes to file'''
 		with open("{outdir}/FlexTaxD.missing".format(outdir=self.outdir), "w") as of:
 			for gen in missing:
-				print(gen["genome_id"], end="\n", file=of)
+				print(gen["genome_id"] if isinstance(gen,dict) else gen, end="\n", file=of)
 		return
 
-	def run(self, files):
-		'''Download list of GCF and or GCA files from NCBI
-
-		Parameters
-			list - list of GCF/GCA ids
+	def download_native(self, files):
+		'''Find the ftp path of each genome in the assembly summary and download the genomes in parallel threads (GenomeDownloader)'''
+		summary = AssemblySummary(self.summary_dir,accessions=[gen["genome_id"] for gen in files])
+		genomes = []
+		for gen in files:
+			group,section,ftp_path = summary.resolve(gen["genome_id"],force=self.force)
+			if not group or not ftp_path or ftp_path == "na":
+				logger.debug("{accession} is not in the assembly summary".format(accession=gen["genome_id"]))
+				self.not_downloaded.append(gen["genome_id"])
+				continue
+			genomes.append({"accession":gen["genome_id"].strip(),"ftp_path":ftp_path,"outdir":"/".join([gen["outdir"],group,gen["genome_id"].strip()])})
+		logger.info("Using {np} parallel threads to download files".format(np=self.processes))
+		downloader = GenomeDownloader(self.processes,base_url=self.base_url)
+		downloaded,failed = downloader.run(genomes)
+		self.genome_names += list(downloaded)
+		self.genome_path.update(downloaded)
+		self.not_downloaded += failed
+		return self.not_downloaded
 
-		Returns
-			list - list of files not downloaded
-		'''
-		logger.info("Downloading {files} files".format(files=len(files)))
-		if len(files) < self.processes:
-			self.processes = len(files)
+	def download_ncbi_genome_download(self, files):
+		'''Download genomes with ncbi-genome-download in parallel processes'''
 		self.download_map = self._split(files,self.processes)
 		logger.info("Using {np} parallel processes to download files".format(np=self.processes))
 
@@ -72,37 +88,47 @@ class DownloadGenomes(object):
 		jobs = []
 		manager = Manager()
 		added = manager.Queue()
-		fpath = manager.Queue()
 		missing = manager.Queue()
 		for i in range(self.processes):
-			p = Process(target=download_genomes, args=(self.download_map[i],added,fpath,missing,self.force))
+			p = Process(target=download_genomes, args=(self.download_map[i],added,missing,self.force))
 			p.daemon=True
 			p.start()
 			jobs.append(p)
 		for job in jobs:
 			job.join()
-		self.added = added.qsize()
-		if not any(proc.is_alive() for proc in jobs):
-			logger.info('All download processes completed')
-		elif len(added.qsize()) % 100 == 0:
-			print("{n} downloaded".format(added.qsize()),end="\r")
+		logger.info('All download processes completed')
+		'''Each downloaded genome puts its accession and file path as one item in added'''
+		while not added.empty():
+			gen,path = added.get()
+			self.genome_names.append(gen)
+			self.genome_path[gen] = path
+		while not missing.empty():
+			self.not_downloaded.append(missing.get())
+		return self.not_downloaded
 
-		count = 0
-		while True:
-			if added.qsize() == 0: ## Check if no genome was succesfully downlaoded if no break
-				logger.info("None of listed genomes could be downloaded! Files not downloaded will be printed to {outdir}/FlexTaxD.missing".format(outdir=self.outdir.rstrip("/")))
-				self.write_missing(files)
-				break
-			l = len(self.genome_names)
-			gen = added.get()
-			if gen:
-				self.genome_names += gen
-				self.genome_path[gen] = fpath.get()
-				if l == len(self.genome_names):
-					break
-			else:
-				self.not_downloaded += missing.get()
-				count+=1
+	def run(self, files):
+		'''Download list of GCF and or GCA files from NCBI
+
+		Parameters
+			list - list of dictionaries with genome_id (GCF/GCA id) and outdir
+
+		Returns
+			list - list of files not downloaded
+		'''
+		files = [gen for gen in files if gen]
+		logger.info("Downloading {files} files".format(files=len(files)))
+		if not files:
+			return self.not_downloaded
+		if len(files) < self.processes:
+			self.processes = len(files)
+		if self.summary_dir:
+			self.download_native(files)
+		else:
+			self.download_ncbi_genome_download(files)
+		if len(self.genome_names) == 0:
+			logger.info("None of listed genomes could be downloaded! Files not downloaded will be printed to {outdir}/FlexTaxD.missing".format(outdir=self.outdir.rstrip("/")))
+		else:
+			logger.info("Downloaded {n} genomes".format(n=len(self.genome_names)))
 		if len(self.not_downloaded) > 0:
 			self.write_missing(self.not_downloaded)
 		return self.not_downloaded
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3 -c
+
+'''
+Download genome files from NCBI over https in parallel threads
+'''
+
+import os
+import time
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit,urljoin
+from concurrent.futures import ThreadPoolExecutor,as_completed
+import logging
+logger = logging.getLogger(__name__)
+
+class DownloadError(Exception):
+	"""Raised when a file can not be downloaded (not found, or failed after all retries)"""
+
+class GenomeDownloader(object):
+	"""GenomeDownloader downloads the genomic fasta file of assemblies from the NCBI ftp path given in the
+		assembly summary (see AssemblySummary). Genomes are downloaded in a pool of threads, each thread
+		keeps one connection per host open between files. A failed request is retried after backoff*2^n
+		seconds, data already written to the .part file is kept and the download resumes with a http range
+		request. Each file is verified against md5checksums.txt of the assembly before it is moved in place.
+
+		base_url replaces the scheme and host of the ftp paths, to download from a mirror (or a local server).
+	"""
+	suffix = "_genomic.fna.gz"
+	def __init__(self, threads=8, retries=5, backoff=1.0, timeout=60, base_url=False, blocksize=1048576):
+		super(GenomeDownloader, self).__init__()
+		self.threads = max(1,threads)
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.base_url = base_url.rstrip("/") if base_url else False
+		self.blocksize = blocksize
+		self.local = threading.local()  ## Open connections of each thread
+		self.lock = threading.Lock()
+		self.bytes = 0
+
+	def __repr__(self):
+		return "GenomeDownloader(threads={}, base_url={})".format(self.threads,self.base_url)
+
+	def url(self, ftp_path, fname=""):
+		'''Https url of a file in an assembly ftp path'''
+		parts = urlsplit(ftp_path.rstrip("/"))
+		base = self.base_url or "https://{host}".format(host=parts.netloc)
+		return "{base}{path}/{fname}".format(base=base,path=parts.path,fname=fname)
+
+	def connection(self, url):
+		'''Open connection of this thread to the host of url'''
+		parts = urlsplit(url)
+		if not hasattr(self.local,"connections"):
+			self.local.connections = {}
+		key = (parts.scheme,parts.netloc)
+		if key not in self.local.connections:
+			if parts.scheme == "https":
+				self.local.connections[key] = http.client.HTTPSConnection(parts.netloc,timeout=self.timeout)
+			else:
+				self.local.connections[key] = http.client.HTTPConnection(parts.netloc,timeout=self.timeout)
+		return self.local.connections[key]
+
+	def close(self, url):
+		'''Close the connection of this thread to the host of url (after an error)'''
+		parts = urlsplit(url)
+		connection = getattr(self.local,"connections",{}).pop((parts.scheme,parts.netloc),None)
+		if connection:
+			connection.close()
+
+	def request(self, url, headers={}):
+		'''GET url on the open connection (redirects are followed), the response must be read before the next request
+
+		Returns
+		------
+			http.client.HTTPResponse
+		'''
+		for redirect in range(5):
+			parts = urlsplit(url)
+			path = parts.path+("?"+parts.query if parts.query else "")
+			try:
+				connection = self.connection(url)
+				connection.request("GET",path,headers=headers)
+				response = connection.getresponse()
+			except (http.client.RemoteDisconnected,BrokenPipeError,ConnectionResetError):
+				'''The server closed the kept open connection, connect again'''
+				self.close(url)
+				connection = self.connection(url)
+				connection.request("GET",path,headers=headers)
+				response = connection.getresponse()
+			if response.status not in (301,302,303,307,308):
+				return response
+			response.read()
+			url = urljoin(url,response.getheader("Location"))  ## The location may be relative to url
+		raise DownloadError("Too many redirects {url}".format(url=url))
+
+	def retry(self, attempt, url, e):
+		'''Close the connection and wait before the next attempt'''
+		self.close(url)
+		if attempt >= self.retries:
+			raise DownloadError("Download of {url} failed after {n} attempts: {e}".format(url=url,n=attempt+1,e=e))
+		logger.debug("Retry {url} ({e})".format(url=url,e=e))
+		time.sleep(self.backoff*2**attempt)
+
+	def fetch(self, url, path):
+		'''Download url to path, the file is written to path.part and resumed from its size if the download is interrupted
+
+		Returns
+		------
+			int - bytes downloaded
+		'''
+		part = path+".part"
+		received = 0
+		for attempt in range(self.retries+1):
+			offset = os.path.getsize(part) if os.path.exists(part) else 0
+			try:
+				response = self.request(url,{"Range": "bytes={offset}-".format(offset=offset)} if offset else {})
+				if response.status == 404:
+					response.read()
+					raise DownloadError("{url} not found".format(url=url))
+				if response.status == 416:  ## The part file is not a prefix of the file, start again
+					response.read()
+					os.remove(part)
+					raise http.client.HTTPException("range not satisfiable")
+				if response.status not in (200,206):
+					response.read()
+					raise http.client.HTTPException("status {status}".format(status=response.status))
+				if response.status == 200:
+					offset = 0  ## The server sent the complete file
+				elif not response.getheader("Content-Range","").startswith("bytes {offset}-".format(offset=offset)):
+					'''The data does not continue the part file, start again'''
+					response.read()
+					os.remove(part)
+					raise http.client.HTTPException("content range {range} does not start at {offset}".format(range=response.getheader("Content-Range"),offset=offset))
+				length = response.getheader("Content-Length")
+				with open(part,"ab" if offset else "wb") as out:
+					while True:
+						data = response.read(self.blocksize)
+						if not data:
+							break
+						out.write(data)
+						received += len(data)
+				if length is not None and os.path.getsize(part)-offset < int(length):
+					raise http.client.IncompleteRead(b"",int(length)-(os.path.getsize(part)-offset))
+				os.replace(part,path)
+				return received
+			except (OSError,http.client.HTTPException) as e:
+				self.retry(attempt,url,e)
+
+	def md5sums(self, ftp_path):
+		'''Read md5checksums.txt of an assembly
+
+		Returns
+		------
+			dict - file name: md5
+		'''
+		url = self.url(ftp_path,"md5checksums.txt")
+		for attempt in range(self.retries+1):
+			try:
+				response = self.request(url)
+				data = response.read()
+				if response.status == 404:
+					raise DownloadError("{url} not found".format(url=url))
+				if response.status != 200:
+					raise http.client.HTTPException("status {status}".format(status=response.status))
+				break
+			except (OSError,http.client.HTTPException) as e:
+				self.retry(attempt,url,e)
+		md5sums = {}
+		for line in data.decode("utf-8",errors="replace").splitlines():
+			md5,_,fname = line.strip().partition(" ")
+			md5sums[fname.strip().lstrip("./")] = md5
+		return md5sums
+
+	def md5(self, path):
+		'''md5 of a file'''
+		md5 = hashlib.md5()
+		with open(path,"rb") as f:
+			for data in iter(lambda: f.read(self.blocksize),b""):
+				md5.update(data)
+		return md5.hexdigest()
+
+	def download(self, ftp_path, outdir):
+		'''Download and verify the genomic fasta file of an assembly
+
+		Parameters
+			str - ftp path of the assembly
+			str - output directory
+		------
+		Returns
+			str - path to the downloaded file
+		'''
+		fname = os.path.basename(ftp_path.rstrip("/"))+self.suffix
+		path = os.path.join(outdir,fname)
+		md5sums = self.md5sums(ftp_path)
+		if fname not in md5sums:
+			raise DownloadError("{fname} is not listed in md5checksums.txt".format(fname=fname))
+		if os.path.exists(path) and self.md5(path) == md5sums[fname]:
+			return path  ## Downloaded in a previous run
+		os.makedirs(outdir,exist_ok=True)
+		for attempt in range(self.retries+1):
+			received = self.fetch(self.url(ftp_path,fname),path)
+			if self.md5(path) == md5sums[fname]:
+				with self.lock:
+					self.bytes += received
+				return path
+			logger.debug("md5 of {path} does not match md5checksums.txt".format(path=path))
+			os.remove(path)
+			if attempt == self.retries:
+				raise DownloadError("md5 of {fname} does not match md5checksums.txt".format(fname=fname))
+
+	def _download(self, genome):
+		'''Download one genome in a thread, errors are logged and the genome is reported as failed'''
+		try:
+			return self.download(genome["ftp_path"],genome["outdir"])
+		except DownloadError as e:
+			logger.debug("Could not download {accession}: {e}".format(accession=genome["accession"],e=e))
+			return False
+		except (OSError,ValueError,http.client.HTTPException) as e:
+			'''Unexpected errors (file system, malformed response) fail this genome only'''
+			logger.warning("Could not download {accession}: {e}".format(accession=genome["accession"],e=e))
+			return False
+
+	def run(self, genomes):
+		'''Download genomes in parallel
+
+		Parameters
+			list - list of dictionaries with accession, ftp_path and outdir
+		------
+		Returns
+			dict - accession: path to downloaded file
+			list - accessions that could not be downloaded
+		'''
+		start = time.time()
+		downloaded,failed = {},[]
+		with ThreadPoolExecutor(max_workers=self.threads) as executor:
+			futures = {executor.submit(self._download,genome): genome["accession"] for genome in genomes}
+			for future in as_completed(futures):
+				path = future.result()
+				if path:
+					downloaded[futures[future]] = path
+				else:
+					failed.append(futures[future])
+				print("Downloaded {n}/{total} genomes ({mb:.1f} MB)".format(n=len(downloaded),total=len(genomes),mb=self.bytes/2**20),end="\r")
+		elapsed = time.time()-start
+		logger.info("Downloaded {n} genomes ({mb:.1f} MB, {rate:.1f} MB/s), {failed} failed".format(n=len(downloaded),mb=self.bytes/2**20,rate=self.bytes/2**20/elapsed if elapsed else 0,failed=len(failed)))
+		return downloaded,failed
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3 -c
+
+'''
+Read several taxonomy source files in parallel and merge them into one database
+'''
+
+from importlib import import_module
+from multiprocessing import Pool
+from .database.DatabaseConnection import DatabaseFunctions
+from .ReadTaxonomy import InputError
+import logging
+logger = logging.getLogger(__name__)
+
+def parse_source(source):
+	'''Parse one taxonomy source file into an in-memory database (run in a worker process)
+
+	------
+	Returns
+		tuple - (taxonomy_file, ranks, nodes, links, genomes) where nodes, links and genomes refer to node names
+	'''
+	taxonomy_file,taxonomy_type = source
+	module = import_module(".ReadTaxonomy{type}".format(type=taxonomy_type), __package__)
+	read_obj = getattr(module, "ReadTaxonomy{type}".format(type=taxonomy_type))(taxonomy_file, database=":memory:")
+	read_obj.parse_taxonomy()
+	database = read_obj.database
+	names = dict(database.query("SELECT id,name FROM nodes").fetchall())
+	ranks = database.query("SELECT rank_i,rank FROM rank ORDER BY rank_i").fetchall()
+	rank_names = dict(ranks)
+	nodes = [name for id,name in database.query("SELECT id,name FROM nodes ORDER BY id").fetchall()]
+	links = [(names[parent],names[child],rank_names.get(rank_i)) for parent,child,rank_i in database.query("SELECT parent,child,rank_i FROM tree ORDER BY rowid").fetchall() if parent in names and child in names]
+	genomes = [(genome,names[id]) for genome,id in database.query("SELECT genome,id FROM genomes ORDER BY rowid").fetchall() if id in names]
+	database.conn.close()
+	return taxonomy_file,[rank for rank_i,rank in ranks],nodes,links,genomes
+
+class IngestTaxonomy(object):
+	"""IngestTaxonomy parses several taxonomy source files in worker processes (each into its own in-memory
+		database) and merges the results in one writer. Nodes are identified by name, as within a single
+		source, and ids are assigned by first appearance in the order the files were given, so the
+		database does not depend on the number of processes used.
+	"""
+	def __init__(self, taxonomy_files, taxonomy_types, database=".ftd", processes=1, verbose=False):
+		super(IngestTaxonomy, self).__init__()
+		if len(taxonomy_types) == 1:
+			taxonomy_types = taxonomy_types*len(taxonomy_files)
+		if len(taxonomy_types) != len(taxonomy_files):
+			raise InputError("Give one taxonomy type or one taxonomy type per taxonomy file!")
+		if "NCBI" in taxonomy_types:
+			raise InputError("NCBI taxonomies keep their own taxonomy ids and cannot be merged with other sources")
+		self.sources = list(zip(taxonomy_files,taxonomy_types))
+		self.processes = max(1,min(processes,len(self.sources)))
+		self.database = DatabaseFunctions(database,verbose=verbose)
+		self.length = 0
+		self.ids = 0
+
+	def parse_taxonomy(self):
+		'''Parse all taxonomy files and merge them into the database'''
+		logger.info("Parse {n} taxonomy files using {p} processes".format(n=len(self.sources),p=self.processes))
+		if self.processes > 1:
+			with Pool(self.processes) as pool:
+				results = pool.map(parse_source,self.sources,chunksize=1)
+		else:
+			results = map(parse_source,self.sources)
+		self.merge(results)
+
+	def merge(self, results):
+		'''Merge parsed taxonomy files in file order, the first parent given for a node is kept'''
+		node_ids,rank_ids,parents = {},{},{}
+		nodes,links,genomes = [],[],[]
+		conflicts = 0
+		for taxonomy_file,f_ranks,f_nodes,f_links,f_genomes in results:
+			logger.info("Merge {file} nodes: {n} links: {l} genomes: {g}".format(file=taxonomy_file,n=len(f_nodes),l=len(f_links),g=len(f_genomes)))
+			for rank in f_ranks:
+				if rank not in rank_ids:
+					rank_ids[rank] = len(rank_ids)+1
+			for name in f_nodes:
+				if name not in node_ids:
+					node_ids[name] = len(node_ids)+1
+					nodes.append((node_ids[name],name))
+			for parent,child,rank in f_links:
+				parent,child = node_ids[parent],node_ids[child]
+				if child in parents:
+					if parents[child] != parent:
+						conflicts += 1
+					continue
+				parents[child] = parent
+				links.append((parent,child,rank_ids.get(rank)))
+			genomes += [(genome,node_ids[name]) for genome,name in f_genomes]
+		if conflicts > 0:
+			logger.warning("{n} links were not added as the child already had a parent in a previous taxonomy file".format(n=conflicts))
+		self.database.insert_many(((rank_i,rank) for rank,rank_i in rank_ids.items()),"rank",("rank_i","rank"))
+		self.database.insert_many(nodes,"nodes",("id","name"))
+		self.database.insert_many(links,"tree",("parent","child","rank_i"))
+		self.database.insert_many(genomes,"genomes",("genome","id"),ignore=False)
+		self.database.commit()
+		self.length = len(nodes)
+		self.ids = len(links)
+		return self.length
+
+	def parse_genomeid2taxid(self,genomeid2taxid):
+		'''Parse file that annotates genome_id´s to nodes in the tree'''
+		nodeDict = self.database.get_nodes()
+		genomes = []
+		with open(genomeid2taxid,"rt") as f:
+			headers = f.readline().strip().split("\t")
+			for row in f:
+				if row.strip() != "": ## If there are trailing empty lines in the file
+					genomeid,taxid = row.strip().split("\t")
+					try:
+						genomes.append((genomeid,nodeDict[taxid.strip()]))
+					except KeyError:
+						logger.warning("# WARNING: {taxid} not found in the database".format(taxid=taxid))
+		self.database.insert_many(genomes,"genomes",("genome","id"),ignore=False)
+		self.database.commit()
+		return
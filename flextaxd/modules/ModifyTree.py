@@ -243,10 +243,12 @@ class ModifyTree(object):
 		self.parent_link = self.taxonomydb.get_parent(self.taxonomydb.get_id(self.parent))
 		if not self.parent_link:
 			raise InputError("The selected parent node ({parent}) count not be found in the source database!".format(parent=self.parent))
-		self.existing_nodes = self.taxonomydb.get_children(set([self.taxonomydb.get_id(self.parent)])) ## - set([self.taxonomydb.get_id(self.parent)] )
+		'''The tree is loaded once (TaxonomyGraph), children and links of the parent are found in memory'''
+		graph = self.taxonomydb.get_graph(reload=True)
+		self.existing_nodes = graph.get_children(set([self.taxonomydb.get_id(self.parent)])) ## - set([self.taxonomydb.get_id(self.parent)] )
 		logger.info("{n} children to {parent}".format(n=len(self.existing_nodes),parent=self.parent))
 		if len(self.existing_nodes) > 0:
-			self.existing_links = set(self.taxonomydb.get_links(self.existing_nodes))
+			self.existing_links = set(graph.get_links(self.existing_nodes))
 		logger.info("{n} existing links to {parent}".format(n=len(self.existing_links),parent=self.parent))
 
 		if modtype == "database":
@@ -264,7 +266,7 @@ class ModifyTree(object):
 		logger.debug("ovl: {ovl}".format(ovl=len(self.existing_nodes & self.new_nodes)))
 
 		if self.replace & len(self.existing_nodes) > 0:  ## remove nodes connected to old nodes that is not replaced
-			self.non_overlapping_old_links = set(self.taxonomydb.get_links((self.existing_nodes & self.new_nodes) - set([self.taxonomydb.get_id(self.parent)])))  ## Remove all links related to new nodes
+			self.non_overlapping_old_links = set(graph.get_links((self.existing_nodes & self.new_nodes) - set([self.taxonomydb.get_id(self.parent)])))  ## Remove all links related to new nodes
 
 		self.overlapping_links = self.existing_links & self.new_links ## (links existing in both networks)
 		self.old_links = self.existing_links - self.new_links
@@ -282,14 +284,7 @@ class ModifyTree(object):
 	def update_annotations(self, genomeid2taxid):
 		'''Function that adds annotation of genome ids to nodes'''
 		logger.info("Update genome to taxid annotations using {genomeid2taxid}".format(genomeid2taxid=genomeid2taxid))
-		update = {
-			"set_column": "id",
-			"where_column": "genome",
-			"set_value": "",
-			"where": ""
-		}
-		updated = 0
-		added = 0
+		genomes = []
 		with open(genomeid2taxid) as f:
 			for row in f:
 				try:
@@ -309,29 +304,14 @@ class ModifyTree(object):
 					logger.debug("# WARNING: there was no database entry for {name} annotation not updated for this entry!".format(name=name))
 				else:
 					## If no exception occured add genome
-					update["set_value"] = id
-					update["where"] = genome.strip()
-					res = self.taxonomydb.update_genome(update)
-					if self.taxonomydb.rowcount()!=0:
-						if res:
-							updated += 1
-						else:
-							added += 1
-		self.taxonomydb.commit()
-		gid = self.taxonomydb.get_genomes()
+					genomes.append((genome.strip(),id))
+		added,updated = self.taxonomydb.update_genomes(genomes)
 		logger.info("{added} added and {updated} genome annotations were updated!".format(added=added, updated=updated))
 		return
 
 	def update_genomes(self):
 		'''When a database is supplied as source for the update genome annotations from that database needs to be transfered to the taxonomydb'''
-		update = {
-			"set_column": "id",
-			"where_column": "genome",
-			"set_value": "",
-			"where": ""
-		}
-		updated = 0
-		added = 0
+		genomes = []
 		notadded = 0
 		'''Database has been updated, so the internal nodeDict needs to be updated'''
 		self.nodeDict = self.taxonomydb.get_nodes()
@@ -344,15 +324,8 @@ class ModifyTree(object):
 				#logger.debug("Genome not added {genome}".format(genome=genome))
 				notadded +=1
 				continue
-			update["set_value"] = id
-			update["where"] = genomeid
-			res = self.taxonomydb.update_genome(update)
-			if self.taxonomydb.rowcount()!=0:
-				if res:
-					updated += 1
-				else:
-					added += 1
-		self.taxonomydb.commit()
+			genomes.append((genomeid,id))
+		added,updated = self.taxonomydb.update_genomes(genomes)
 		if notadded > 0:
 			logger.info("{notadded} genomes not added, taxonomy id does not exist in the receiving database".format(notadded=notadded))
 		logger.info("{added} added and {updated} genome annotations were updated!".format(added=added, updated=updated))
@@ -366,23 +339,24 @@ class ModifyTree(object):
 		logger.info("Annotated nodes: {an}".format(an=an))
 		if an == 0:
 			raise InputError("Database has no annotations, the whole database would be cleaned")
+		graph = self.taxonomydb.get_graph(reload=True)
 		logger.info("Get all links in database")
-		self.all_links = set(self.taxonomydb.get_links())
+		self.all_links = set(graph.get_links())
 		logger.info("Get all nodes in database")
-		self.all_nodes = set(self.taxonomydb.get_nodes(col=1).keys())
+		self.all_nodes = graph.get_nodes()
 		'''Add parents to all nodes that may not have annotations'''
 		logger.info("Retrieve all parents of annotated nodes")
-		self.annotated_nodes |= self.taxonomydb.get_parents(self.annotated_nodes,find_all=True)
+		self.annotated_nodes |= graph.get_parents(self.annotated_nodes)
 		# for node in progressBar(list(self.annotated_nodes), prefix = 'Progress:', suffix = 'Complete', length = 50):
 		# 	self.annotated_nodes |= self.taxonomydb.get_parents(node)
 		logger.info("Parents added: {an}".format(an=len(self.annotated_nodes)-an))
 		if ncbi:
 			logger.info("Keep main nodes of the NCBI taxonomy (parents on level 3 and above)")
-			self.keep = set(self.taxonomydb.get_children([1],maxdepth=1))  #set([self.nodeDict[node] for node in self.taxonomydb.get_children([1],maxdepth=1)])
+			self.keep = graph.get_children([1],maxdepth=1)
 			logger.info("Adding root levels {nlev}".format(nlev=len(self.keep-self.annotated_nodes)))
 			self.annotated_nodes |= self.keep
 		'''Get all links related to an annotated node and its parents'''
-		self.annotated_links = set(self.taxonomydb.get_links(self.annotated_nodes,only_parents=True))
+		self.annotated_links = set(graph.get_links(self.annotated_nodes,only_parents=True))
 		self.clean_links = self.all_links - self.annotated_links
 		self.clean_nodes = self.all_nodes - self.annotated_nodes
 		logger.info("Links to remove {nlinks}".format(nlinks=len(self.clean_links)))
@@ -407,7 +381,8 @@ class ModifyTree(object):
 		'''Update the database file'''
 		if self.replace:
 			logger.info("Clean up genomes annotated to child nodes from  {parent}".format(parent=self.parent))
-			nodes = self.taxonomydb.get_children(set([self.taxonomydb.get_id(self.parent)])) | set([self.taxonomydb.get_id(self.parent)] )
+			## Links are not changed after parse_modification, the graph loaded there is current
+			nodes = self.taxonomydb.get_graph().get_children(set([self.taxonomydb.get_id(self.parent)])) | set([self.taxonomydb.get_id(self.parent)] )
 			logger.debug(nodes)
 			self.taxonomydb.delete_genomes(nodes)
 			self.taxonomydb.query("vacuum") ## Actually remove the data from database
@@ -2,7 +2,7 @@
 Module to read and write newick trees
 
 '''
-from flextaxd.modules.database.DatabaseConnection import ModifyFunctions
+from .database.DatabaseConnection import ModifyFunctions
 from io import StringIO
 import importlib
 
@@ -3,23 +3,43 @@
 Process directory
 '''
 
-import logging,os
+import logging,os,re
 from .database.DatabaseConnection import DatabaseFunctions
+from .database.DirectoryManifest import DirectoryManifest,walk_tree,visit_directory
 logger = logging.getLogger(__name__)
 
+### GCF/GCA genome file names, GCF_000000000.1_*.fna (GCF/GCA, 9 digits, version 1-99)
+GCX_NAME = re.compile(r"(GC[FA][^_]*)_(\d{9})\.(\d{1,2})_.*\.fna",re.DOTALL)
+
+def gcx_name(fname):
+	'''GCF/GCA genome name of a file name (GCF_000000000.1), False if it is not a GCF/GCA file name'''
+	match = GCX_NAME.fullmatch(fname)
+	if match:
+		return "{GCX}_{NUM}.{version}".format(GCX=match.group(1),NUM=match.group(2),version=match.group(3))
+	return False
+
+def manifest_name(file):
+	'''Genome name of an official (GCF/GCA) file name stored in the DirectoryManifest, empty string if not GCF/GCA
+		(all walks sharing a manifest must use this function)'''
+	return gcx_name(file.strip(".gz")) or ""
+
 class ProcessDirectory(object):
 	"""ProcessDirectory matches database entries to files on disk
-		Potential development is to store annotation to disk location for faster
-		processing an option can allow full reprocess of a input directory
+		The directory listings and the genome names parsed from file names are stored in a manifest
+		(DirectoryManifest), only directories changed since the previous run are listed again,
+		rescan allows full reprocess of a input directory
 	"""
 
-	def __init__(self, database,limit=False):
+	def __init__(self, database,limit=False,manifest=False,rescan=False,threads=8):
 		super(ProcessDirectory, self).__init__()
+		self.manifest = manifest
+		self.rescan = rescan
+		self.threads = threads  ## Threads used to list directories
 		self.database = DatabaseFunctions(database)
 		self.genome_id_dict = self.database.get_genomes(self.database , limit=limit)
 		self.ref_ext = [".fna"]
 		self.oth_ext = [".fasta",".fa"]
-		self.ext = self.ref_ext+self.oth_ext
+		self.ext = tuple(self.ref_ext+self.oth_ext)
 		self.genome_names = []
 		self.genome_path_dict = {}
 		self.files = []
@@ -71,21 +91,11 @@ class ProcessDirectory(object):
 			str     - GCF name
 			boolean - false if not GCF/GCA
 		'''
-		try:
-			GCX,END,REST = fname.split("_",2)  ## If a name contains anything after the GCF number remove this if split by _
-			if debug:
-				logger.debug("[{} {} {}]".format(GCX,END,REST))
-			NUM,version = END.split(".",1)
-			if debug:
-				logger.debug("[{} {}]".format(NUM,version))
-			if GCX.startswith(("GCF","GCA")):                        ## Must start with GCF/GCA
-				if len(NUM) == 9 and NUM.isdigit():                    ## All true GCF/GCA names have 9 digits
-					if len(version) <= 2 and version.isdigit():      ## version number after . is 1-99 OBS -> Will have to be updated if a genome reach version number higher than 99
-						if fname.endswith(tuple(self.ref_ext)):         ## A genome downloaded from refseq or genbank will end with .fna
-							genome_name = "{GCX}_{NUM}.{version}".format(GCX=GCX,NUM=NUM,version=version)
-							return genome_name
-		except:        ## If the above is not true it is not a GCF file name return False
-			pass
+		name = gcx_name(fname)  ## A genome downloaded from refseq or genbank will end with .fna
+		if name:
+			return name
+		if debug:
+			logger.debug("{fname} is not a GCF/GCA file name".format(fname=fname))
 		return False
 
 	def find_local(self,fname):
@@ -111,21 +121,26 @@ class ProcessDirectory(object):
 		taxid = self.get_taxid(fname)
 		if not taxid:
 			'''This file had no match in the reference folder, perhaps it is not annotated in the database'''
-			self.is_gcf_gca(fname,True)
 			self.notused.add(fname)
-			logger.debug("#Warning {gcf} could not be matched to a database entry!".format(gcf=fname.strip()))
+			if logger.isEnabledFor(logging.DEBUG):
+				self.is_gcf_gca(fname,True)
+				logger.debug("#Warning {gcf} could not be matched to a database entry!".format(gcf=fname.strip()))
 		return taxid,fname
 
-	def process_file(self,file,fname,root,taxid=False):
+	def process_file(self,file,fname,root,taxid=False,gcf=None):
 		'''Parameters
 			str    - name of file
 			str    - path to file location
+			str    - GCF/GCA name of the file from the manifest (None if not known)
 		------
 		Returns
 			boolean - true if file was processed
 			'''
+		'''In official sources there is sometimes a file called from_genomic.fna; make sure this file does not get included in the file list'''
+		if fname.endswith("from_genomic.fna"):
+			return False
 		'''The bulk of genomes is expected to come from official sources'''
-		genome_name = self.is_gcf_gca(fname)
+		genome_name = self.is_gcf_gca(fname) if gcf is None else gcf
 		if genome_name:
 			taxid = self.get_taxid(genome_name)
 		'''If the file is not a GCF or GCA file check if the file starts with GCF/GCA but is a still a custom filename'''
@@ -134,8 +149,7 @@ class ProcessDirectory(object):
 		'''If the file is still not matching a database entry use the complete name (including .fasta/.fna/.fa)'''
 		if not taxid:
 			taxid,genome_name = self.find_local_fasta(fname)
-		'''In official sources there is sometimes a file called from_genomic.fna; make sure this file does not get included in the file list'''
-		if not file.strip(".gz").endswith("from_genomic.fna") and taxid:
+		if taxid:
 			filepath = os.path.join(root, file)  ## Save the path to the file
 			self.files.append(filepath)
 			self.genome_names.append(genome_name.strip())
@@ -158,23 +172,47 @@ class ProcessDirectory(object):
 		if not folder_path:
 			raise IOError("Parameter --genomes_path was not set".format(folder_path))
 		logger.info("Process genome path ({path})".format(path=folder_path))
-		for root, dirs, files in os.walk(folder_path,followlinks=True):
-			for file in files:
+		if self.manifest:
+			manifest = DirectoryManifest(self.manifest,rescan=self.rescan)
+			walk = manifest.walk(folder_path,manifest_name,threads=self.threads)
+		else:
+			walk = ((root,[(entry[0],None) for entry in entries if not entry[1]]) for root,entries,info in walk_tree(folder_path,visit_directory,self.threads))
+		for root, files in walk:
+			for file,gcf in files:
 				fname = file.strip(".gz") ## remove gz if present
-				if fname.endswith(tuple(self.ext)):
+				if fname.endswith(self.ext):
 					if count % 1000 == 0:
 						print("Processed {count} genomes".format(count=count), end="\r")
-					if self.process_file(file,fname,root):
+					if self.process_file(file,fname,root,gcf=gcf):
 						count +=1
 				elif file == "MD5SUMS" or file.endswith(".txt"):
 					pass
 				else:
 					logger.debug("#Warning {gcf} does not have a valid file ending".format(gcf=file))
+		if self.manifest:
+			manifest.close()
 		logger.info("Processed {count} genomes".format(count=count))
 		self.files = list(set(self.files))
 		self.genome_names = list(set(self.genome_names))
 		return self.files, self.genome_names
 
+	def add_genomes(self,genome_path):
+		'''Add genomes found outside the genome directory walk (downloaded or restored from the genome cache)
+		Parameters
+			dict    - genome_id to path of genome file (directories are skipped)
+		------
+		Returns
+			int     - number of genomes added
+		'''
+		added = 0
+		for genome,filepath in genome_path.items():
+			if os.path.isfile(filepath):
+				self.files.append(filepath)
+				self.genome_names.append(genome)
+				self.genome_path_dict[genome] = filepath
+				added += 1
+		return added
+
 	def process_folder(self,folder_path):
 		'''Walk through folder and match genomes to database entries, database entries with no matching file be downloaded'''
 		logger.info("Number of genomes annotated in database {n}".format(n=len(self.genome_id_dict)))
@@ -4,14 +4,23 @@
 Read NCBI taxonomy dmp files (nodes or names) and holds a dictionary
 '''
 
-from .ReadTaxonomy import ReadTaxonomy
+from .ReadTaxonomy import ReadTaxonomy,InputError
+from .database.AccessionIndex import AccessionIndex,default_index
+from .database.DirectoryManifest import DirectoryManifest,walk_tree,visit_directory
+from .ProcessDirectory import manifest_name
 from gzip import open as zopen
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
+import tarfile
+import time
 import logging
 logger = logging.getLogger(__name__)
 
 class ReadTaxonomyNCBI(ReadTaxonomy):
 	"""docstring for ReadTaxonomyNCBI."""
+	buffersize = 1048576  ## Read buffer of dmp files
 	def __init__(self, taxonomy_file=False, database=False):
 		super(ReadTaxonomyNCBI, self).__init__(database=database,ncbi=True)
 		self.taxonomy_file = taxonomy_file
@@ -37,72 +46,134 @@ class ReadTaxonomyNCBI(ReadTaxonomy):
 			self.read_nodes(self.taxonomy_file)
 			self.ids = self.database.num_rows("tree")
 
-	def read_nodes(self, taxfile):
-		'''Read NCBI node file and store a dictionary with names in object'''
-		with open(taxfile, "r") as _taxfile:
-			for taxonomy_row in _taxfile:
-				data = taxonomy_row.strip().split("\t|\t")
-				child,parent,rank = data[0],data[1],data[2]
-				if rank == "None" or rank == None:
+	@contextmanager
+	def open_dmp(self, taxfile, member):
+		'''Open a dmp file for buffered reading, taxfile may be the plain dmp file, a gzipped
+			dmp file or the NCBI taxdump archive (taxdump.tar.gz) in which case member is read directly
+		'''
+		if taxfile.endswith((".tar.gz",".tgz",".tar")):
+			with tarfile.open(taxfile, "r:*") as archive:
+				try:
+					_member = archive.extractfile(member)
+				except KeyError:
+					raise InputError("{member} is missing in {archive}".format(member=member,archive=taxfile))
+				with io.TextIOWrapper(io.BufferedReader(_member,self.buffersize), encoding="utf-8") as _taxfile:
+					yield _taxfile
+		elif taxfile.endswith(".gz"):
+			with zopen(taxfile, "rt", encoding="utf-8") as _taxfile:
+				yield _taxfile
+		else:
+			with open(taxfile, "r", buffering=self.buffersize, encoding="utf-8") as _taxfile:
+				yield _taxfile
+
+	def parse_nodes(self, _taxfile):
+		'''Parse nodes.dmp rows into tree links (parent, child, rank_i)'''
+		rank_index = self.rank
+		for taxonomy_row in _taxfile:
+			data = taxonomy_row.split("\t|\t",3)
+			if len(data) < 3:
+				continue
+			child,parent,rank = data[0],data[1],data[2]
+			try:
+				lev = rank_index[rank]
+			except KeyError:
+				if rank == "None" or rank == "":
 					rank = "no rank"
-				if rank not in self.rank:
-					self.add_rank(rank,ncbi=True)
-				lev = self.rank[rank]
-				self.database.add_link(child=data[0],parent=data[1],rank=lev)
-			self.database.commit()
-		return
+				lev = self.add_rank(rank,ncbi=True)
+				rank_index[data[2]] = lev
+			yield (parent,child,lev)
+
+	def parse_names(self, _taxfile):
+		'''Parse names.dmp rows into nodes (id, name), only scientific names are kept'''
+		for taxonomy_row in _taxfile:
+			data = taxonomy_row.rstrip("\t|\r\n").split("\t|\t")
+			if len(data) > 3 and data[3] != "scientific name":
+				continue
+			if len(data) < 2 or data[1].strip() == "":
+				continue
+			yield (data[0],data[1])
+
+	def _report(self, what, rows, start):
+		'''Log the number of rows loaded and rows per second'''
+		elapsed = max(time.time() - start, 1e-6)
+		logger.info("Loaded {rows} {what} in {time:.1f}s ({rate:.0f} rows/sec)".format(rows=rows,what=what,time=elapsed,rate=rows/elapsed))
+
+	def read_nodes(self, taxfile):
+		'''Read NCBI node file and bulk load the links into the tree table'''
+		start = time.time()
+		with self.open_dmp(taxfile, "nodes.dmp") as _taxfile:
+			added = self.database.insert_many(self.parse_nodes(_taxfile),"tree",("parent","child","rank_i"))
+		self.database.commit()
+		self._report("links", added, start)
+		return added
 
 	def read_names(self, taxfile):
-		'''Read NCBI node file and store a dictionary with nodes in object'''
-		with open(taxfile, "r") as _taxfile:
-			for taxonomy_row in _taxfile:
-				data = taxonomy_row.strip().split("\t|\t")
-				taxid = data[0]
-				name = data[1]
-				_type = False
-				if len(data) > 3:
-					_type = data[3].rstrip("|\t")
-				if _type == "scientific name" or not _type:
-					self.add_node(name, id=taxid)
-			self.database.commit()
-		return
+		'''Read NCBI names file and bulk load the scientific names into the nodes table'''
+		start = time.time()
+		with self.open_dmp(taxfile, "names.dmp") as _taxfile:
+			added = self.database.insert_many(self.parse_names(_taxfile),"nodes",("id","name"))
+		self.database.commit()
+		self._report("names", added, start)
+		return added
+
+	def read_header(self,filepath):
+		'''Read the sequence id of the first header in a (gzipped) fasta file'''
+		with (zopen(filepath,"rb") if filepath.endswith(".gz") else open(filepath,"rb")) as f:
+			return f.readline().split(b" ")[0].lstrip(b">").strip().decode("utf-8")
 
-	def parse_genebank_file(self,filepath,filename):
+	def parse_genebank_file(self,filepath,filename,refseqid=False):
 		logger.debug("Parse file {filename}".format(filename=filename))
 		genebankid = filename.split("_",2)
 		genebankid = genebankid[0]+"_"+genebankid[1]
-		f = zopen(filepath,"r")
-		refseqid = f.readline().split(b" ")[0].lstrip(b">")
-		f.close()
+		if not refseqid:
+			refseqid = self.read_header(filepath)
 		self.refseqid_to_GCF[refseqid] = genebankid
 		return
 
-	def parse_genomeid2taxid(self, genomes_path,annotation_file):
+	def scan_genomes(self,genomes_path,manifest=False,threads=8):
+		'''Find the first sequence id of all genome files in genomes_path, the headers are read by a pool of
+			threads (opening many small gzip files is bound by I/O latency). With the manifest of the genome
+			directory (DirectoryManifest) only changed directories are listed and the headers of files with
+			the same size and mtime as before are not read again
+		'''
+		self.refseqid_to_GCF = {}
+		if manifest:
+			walk = manifest.walk(genomes_path,manifest_name,threads=threads)  ## The manifest is shared with ProcessDirectory
+		else:
+			walk = ((root,[(entry[0],None) for entry in entries if not entry[1]]) for root,entries,info in walk_tree(genomes_path,visit_directory,threads))
+		files = [(root,filename) for root,filenames in walk for filename,genome in filenames if filename.strip(".gz").endswith(".fna")]
+		if manifest:
+			refseqids = manifest.headers(files,self.read_header,threads)
+		else:
+			with ThreadPoolExecutor(max_workers=threads) as executor:
+				refseqids = list(executor.map(self.read_header,[os.path.join(root,filename) for root,filename in files]))
+		for (root,filename),refseqid in zip(files,refseqids):
+			if refseqid is not None:
+				self.parse_genebank_file(os.path.join(root,filename),filename,refseqid=refseqid)
+		return self.refseqid_to_GCF
+
+	def parse_genomeid2taxid(self, genomes_path,annotation_file,accession_index=False,genomes_manifest=False,rescan=False,threads=8):
 		'''To allow NCBI databases to be build from scratch the sequences names needs to be stored in the database,
-			this function parses the accession2taxid file from NCBI to speed up the function and reduce the amount
-			of stored datata only sequences in input genomes_path will be fetched
+			this function looks up the sequences in genomes_path in an index of the accession2taxid file from NCBI
+			(see AccessionIndex), the index is built on first use and refreshed when the accession2taxid file changes.
+			The genome files are found with the manifest of genomes_path (genomes_manifest, see scan_genomes)
 		'''
 		logger.info("Parsing ncbi accession2taxid, genome_path: {dir}".format(dir = genomes_path))
-		self.refseqid_to_GCF = {}
-		for root, dirs, files in os.walk(genomes_path,followlinks=True):
-			for filename in files:
-				if filename.strip(".gz").endswith(".fna"):
-					filepath = os.path.join(root, filename)
-					self.parse_genebank_file(filepath,filename)
-		logger.info("genomes folder read {n} sequence files found".format(n=len(self.refseqid_to_GCF)))
 		if not annotation_file.endswith("accession2taxid.gz"):
 			raise TypeError("The supplied annotation file does not seem to be the ncbi nucl_gb.accession2taxid.gz")
-		count = 0
-		with zopen(annotation_file,"r") as f:
-			headers = f.readline().split(b"\t")
-			for row in f:
-				if row.strip() != "": ## If there are trailing empty lines in the file
-					refseqid,taxid = row.split(b"\t")[1:3]
-					try:
-						genebankid = self.refseqid_to_GCF[refseqid]
-						self.database.add_genome(genome=genebankid,_id=taxid.decode("utf-8"))
-					except:
-						count +=1
-			self.database.commit()
-		logger.info("Genomes not matching any annotation {len}".format(len=count))
+		if not accession_index:
+			accession_index = default_index(self.database.database)
+		manifest = DirectoryManifest(genomes_manifest,rescan=rescan) if genomes_manifest else False
+		self.scan_genomes(genomes_path,manifest,threads=threads)
+		if manifest:
+			manifest.close()
+		index = AccessionIndex(accession_index)
+		logger.info("genomes folder read {n} sequence files found".format(n=len(self.refseqid_to_GCF)))
+		index.refresh(annotation_file)
+		taxids = index.lookup(self.refseqid_to_GCF.keys())
+		index.close()
+		genomes = [(genebankid,taxids[refseqid]) for refseqid,genebankid in self.refseqid_to_GCF.items() if refseqid in taxids]
+		self.database.insert_many(genomes,"genomes",("genome","id"),ignore=False)
+		self.database.commit()
+		logger.info("Genomes not matching any annotation {len}".format(len=len(self.refseqid_to_GCF)-len(genomes)))
 		return
@@ -5,19 +5,17 @@ Read QIIME formatted taxonomy files and holds a dictionary with taxonomy tree an
 '''
 
 from .ReadTaxonomy import ReadTaxonomy
-from .database.DatabaseConnection import DatabaseFunctions
+from itertools import accumulate
 import logging
 logger = logging.getLogger(__name__)
 
 class ReadTaxonomyQIIME(ReadTaxonomy):
 	"""docstring for ReadTaxonomyQIIME."""
 	def __init__(self, taxonomy_file=False, names_dmp=False, database=False, verbose=False, taxid_base=1):
-		super(ReadTaxonomyQIIME, self).__init__(self)
-		self.database = DatabaseFunctions(database,verbose=verbose)
+		super(ReadTaxonomyQIIME, self).__init__(database=database,verbose=verbose)  ## Adds the root node and rank "no rank"
 		self.input = taxonomy_file
 		self.names = {}
 		self.taxid_base = taxid_base
-		self.taxonomy = {}
 		self.length = 0
 		self.ids = 0
 		self.levelDict = {
@@ -35,7 +33,8 @@ class ReadTaxonomyQIIME(ReadTaxonomy):
 		}
 		self.set_qiime(True)
 		### Add root name these manual nodes are required when parsing the GTDB database!
-		rootid = self.add_node("root")  ## Allways set in ReadTaxonomy
+		rootid = self.taxonomy["root"]  ## Allways set in ReadTaxonomy
+		self.rank["n"] = self.rank["no rank"]
 		coid = self.add_node("cellular organisms")
 		bac_id = self.add_node("Bacteria")
 		Euk_id = self.add_node("Eukaryota")
@@ -60,48 +59,76 @@ class ReadTaxonomyQIIME(ReadTaxonomy):
 		'''Parse taxonomy information'''
 		self.qiime_to_tree()
 
-	def parse_tree(self,tree,current_i=0):
-		'''The taxonomy tree does not exist in the standard nomenclature, add a new tree'''
-		### Add parent description if not exist
-		level,description = self.parse_description(tree,current_i)
-		if description.strip() == "":
-			return False
-		if level not in self.taxonomy:
-			self.add_rank(level)
-		if current_i == len(tree)-1:
-			'''Top parent reached return top parent id'''
-			try:
-				return self.taxonomy[description]
-			except KeyError:
-				node_i = self.add_node(description)
-			return node_i
-		parent_i = self.parse_tree(tree,current_i+1)
+	def parse_tree(self,lineage):
+		'''The taxonomy tree does not exist in the standard nomenclature, add a new tree
+			lineage is the QIIME formatted string (d__X;p__Y;...), each lineage prefix is stored in
+			self.lineages so that only the part of a lineage not seen before is parsed (most rows are a single dict hit)
+
+		------
+		Returns
+			int - node id of the last level, False if the last level has no description
+		'''
 		try:
-			'''If parent is already in the database return parent ID'''
-			return self.taxonomy[description]
+			return self.lineages[lineage]
 		except KeyError:
-			''' Add current node to names file '''
-			node_i = self.add_node(description)
-
-		'''When all parents exist add current relation to tree file'''
-		self.add_link(node_i,parent_i,rank=level)
-		'''return new tax_i'''
+			pass
+		tree = lineage.split(";")
+		prefixes = list(accumulate(tree, lambda prefix,level: prefix+";"+level))
+		### Find the longest known prefix of the lineage
+		known = len(tree)
+		while known > 0 and prefixes[known-1] not in self.lineages:
+			known -= 1
+		parent_i = self.lineages[prefixes[known-1]] if known > 0 else False
+		### Ranks are added from the last level up (same rank order as previous versions)
+		levels = [self.parse_description(tree,current_i) for current_i in range(known,len(tree))]
+		for level,description in reversed(levels):
+			if description.strip() != "":
+				self.add_rank(level)
+		for current_i,(level,description) in enumerate(levels,known):
+			if description.strip() == "":
+				### Empty levels are skipped, the next level is linked to the closest annotated parent
+				node_i = parent_i if current_i < len(tree)-1 else False
+			else:
+				try:
+					'''If the node is already in the database use the existing node ID'''
+					node_i = self.taxonomy[description]
+				except KeyError:
+					''' Add current node to names file '''
+					node_i = self.stage_node(description)
+					if parent_i:
+						'''When all parents exist add current relation to tree file'''
+						self.new_links.append((parent_i,node_i,self.rank[level]))
+						self.ids += 1
+			self.lineages[prefixes[current_i]] = node_i
+			parent_i = node_i
 		return node_i
 
+	def stage_node(self,description):
+		'''Assign the next node id to a new node, staged nodes and links are added to the database in one batch (see qiime_to_tree)'''
+		self.taxid_base += 1
+		self.taxonomy[description] = self.taxid_base
+		self.new_nodes.append((self.taxid_base,description))
+		return self.taxid_base
+
 	def parse_description(self,tree,current_i):
 		'''Retrieve node description from QIIME formatted tree'''
 		current_level = tree[current_i]
 		level, description = current_level.split("__")
-		return level,description
+		return level.strip(),description
 
 	def qiime_to_tree(self, sep="\t"):
 		'''Read the qiime format file and parse out the relation tree (nodes.dmp)'''
 		self.sep = sep
 		self.tree = set()
+		self.lineages = {}
+		self.new_nodes = []
+		self.new_links = []
 		self.missed = 0
 		self.errors = 0
 		self.added = 0
+		self.taxid_base = self.database.query("SELECT max(id) FROM nodes").fetchone()[0]
 		taxid_start = self.taxid_base
+		genomes = []
 		with open(self.input) as f:
 			'''Each row defines a genome annotation file connected to a tree level'''
 			for row in f:
@@ -117,16 +144,21 @@ class ReadTaxonomyQIIME(ReadTaxonomy):
 					except IndexError:
 						logger.debug("Row {row} could not be parsed".format(row=data))
 						self.errors +=1
+						continue
 					### Walk through tree and make sure all nodes back to root are annotated!
-					taxonomy = list(reversed(data[-1].split(";")))
-					taxonomy_i = self.parse_tree(taxonomy)
+					try:
+						taxonomy_i = self.parse_tree(data[-1].strip())
+					except ValueError:
+						taxonomy_i = False
 					if taxonomy_i:
-						test = self.database.add_genome(genome=genome_id,_id=taxonomy_i)
-						if not str(test).startswith("UNIQUE"):
-							self.added +=1
+						genomes.append((genome_id,taxonomy_i))
 					else:
-						logger.debug("Warning taxonomy: {taxonomy} could not be parsed!!")
+						logger.debug("Warning taxonomy: {taxonomy} could not be parsed!!".format(taxonomy=data[-1]))
 						self.missed +=1
+		### New nodes, links and genome annotations are added in one batch
+		self.database.insert_many(self.new_nodes,"nodes",("id","name"),ignore=False)
+		self.database.insert_many(self.new_links,"tree",("parent","child","rank_i"))
+		self.added = self.database.insert_many(genomes,"genomes",("genome","id"),ignore=False)
 		self.database.commit()
 		self.length = self.taxid_base - taxid_start
 		logger.info("Genomes added to database: {genomes}".format(genomes=self.added))
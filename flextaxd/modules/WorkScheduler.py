@@ -0,0 +1,130 @@
+#!/usr/bin/env python3 -c
+
+'''
+Distribute genome files over worker processes, largest files first
+'''
+
+import os
+import time
+from multiprocessing import Process,Queue
+from queue import Empty
+import logging
+logger = logging.getLogger(__name__)
+
+class WorkScheduler(object):
+	"""WorkScheduler sorts jobs (genome files) by size, largest first, and puts them in chunks of chunksize
+		jobs on a queue shared by all worker processes. A worker takes the next chunk when it is done with
+		the previous one, so a few very large genomes are started first and do not end up in the same worker.
+
+		The target function is called once in each worker with an iterator over the jobs of that worker
+		and the worker number, the return value of the target is returned from run together with the
+		time the worker was busy, which is used to report the utilisation of each worker.
+	"""
+	def __init__(self, processes=1, chunksize=1):
+		super(WorkScheduler, self).__init__()
+		self.processes = max(1,processes)
+		self.chunksize = max(1,chunksize)
+		self.stats = []
+
+	def __repr__(self):
+		return "WorkScheduler(processes={}, chunksize={})".format(self.processes,self.chunksize)
+
+	def schedule(self, jobs, sizes):
+		'''Sort jobs by size (largest first) and split them in chunks
+
+		Returns
+		------
+			list - list of chunks (job, size)
+		'''
+		jobs = sorted(((job,sizes.get(job,0)) for job in jobs), key=lambda job: job[1], reverse=True)
+		return [jobs[i:i+self.chunksize] for i in range(0,len(jobs),self.chunksize)]
+
+	def _jobs(self, queue, stats):
+		'''Take chunks from the queue until the end of the queue is reached'''
+		while True:
+			start = time.time()
+			chunk = queue.get()
+			stats["wait"] += time.time()-start
+			if chunk is None:
+				break
+			for job,size in chunk:
+				stats["jobs"] += 1
+				stats["size"] += size
+				yield job
+
+	def _worker(self, target, worker, queue, results, args):
+		'''Run target in a worker process and report its statistics'''
+		stats = {"worker": worker, "jobs": 0, "size": 0, "wait": 0.0}
+		start = time.time()
+		stats["result"] = target(self._jobs(queue,stats),worker,*args)
+		stats["time"] = time.time()-start
+		results.put(stats)
+
+	def run(self, target, jobs, sizes, args=()):
+		'''Run target in parallel over jobs
+
+		Parameters
+			function target - called as target(jobs, worker, *args) in each worker
+			list jobs - jobs (genome ids)
+			dict sizes - size of each job (bytes)
+			tuple args - additional arguments to target
+		Returns
+			list - return value of target for each worker (in worker order)
+		'''
+		chunks = self.schedule(jobs,sizes)
+		logger.info("Schedule {n} genomes ({size:.1f} MB) in {c} chunks on {p} processes".format(n=len(jobs),size=sum(sizes.get(job,0) for job in jobs)/2**20,c=len(chunks),p=self.processes))
+		queue,results = Queue(),Queue()
+		for chunk in chunks:
+			queue.put(chunk)
+		for i in range(self.processes):
+			queue.put(None)
+		start = time.time()
+		workers = []
+		for i in range(self.processes):
+			p = Process(target=self._worker, args=(target,i,queue,results,args))
+			p.daemon=True
+			p.start()
+			workers.append(p)
+		stats = []
+		while len(stats) < len(workers):  ## Results are read before join, a full pipe would block the workers
+			try:
+				stats.append(results.get(timeout=1))
+			except Empty:
+				if not any(p.is_alive() for p in workers) and results.empty():
+					break
+		for p in workers:
+			p.join()
+		done = set(stat["worker"] for stat in stats)
+		for i,p in enumerate(workers):
+			if i not in done:
+				logger.error("Worker {worker} exited with code {code} before all its genomes were processed".format(worker=i,code=p.exitcode))
+				stats.append({"worker": i, "jobs": 0, "size": 0, "wait": 0.0, "time": 0.0, "result": None})
+		self.stats = sorted(stats, key=lambda stat: stat["worker"])
+		self.report(time.time()-start)
+		return [stat["result"] for stat in self.stats]
+
+	def report(self, elapsed):
+		'''Log the number of jobs and the utilisation (time busy / total time) of each worker'''
+		busy = 0
+		for stat in self.stats:
+			stat["busy"] = max(0,stat["time"]-stat["wait"])
+			busy += stat["busy"]
+			logger.info("Worker {worker}: {jobs} genomes {size:.1f} MB busy {busy:.1f}s utilisation {util:.0%}".format(util=stat["busy"]/elapsed if elapsed else 1,busy=stat["busy"],size=stat["size"]/2**20,worker=stat["worker"],jobs=stat["jobs"]))
+		utilisation = busy/(elapsed*self.processes) if elapsed else 1
+		logger.info("Workers completed in {elapsed:.1f}s, mean utilisation {util:.0%}".format(elapsed=elapsed,util=utilisation))
+		return utilisation
+
+def file_sizes(paths):
+	'''Size of each file in a job to path dictionary (0 if the file can not be read)
+
+	Returns
+	------
+		dict - job: size
+	'''
+	sizes = {}
+	for job,path in paths.items():
+		try:
+			sizes[job] = os.path.getsize(path)
+		except (OSError,TypeError):
+			sizes[job] = 0
+	return sizes
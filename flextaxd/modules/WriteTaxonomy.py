@@ -4,14 +4,30 @@
 Read NCBI taxonomy dmp files (nodes or names) and holds a dictionary
 '''
 
+import os
+import gzip
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from .database.DatabaseConnection import DatabaseFunctions
 import logging
 logger = logging.getLogger(__name__)
 
 class WriteTaxonomy(object):
-	"""docstring for WriteTaxonomy."""
-	def __init__(self, path, database=".taxonomydb",separator="\t|\t",minimal=False,prefix="names,nodes",desc=False,dbprogram=None):
+	"""WriteTaxonomy writes the database to names.dmp and nodes.dmp. Rows are read from the database in batches
+		of batchsize rows (fetchmany), formatted with one format string per file and written with writelines,
+		so memory use does not depend on the size of the database.
+
+		compress gzip or zstd writes compressed dump files (.dmp.gz or .dmp.zst, zstd requires the zstandard package)
+
+		dump writes names.dmp and nodes.dmp at the same time in two threads, each with its own readonly connection.
+		A fingerprint of the database and the dump settings is stored next to the dump files, when the database
+		has not changed since the last dump (see unchanged) the dump can be skipped.
+	"""
+	batchsize = 100000
+	def __init__(self, path, database=".taxonomydb",separator="\t|\t",minimal=False,prefix="names,nodes",desc=False,dbprogram=None,compress=False):
 		super(WriteTaxonomy, self).__init__()
+		self.database_path = database
 		self.database = DatabaseFunctions(database)
 		logging.debug("Write settings: ")
 		self.path = path.rstrip("/")+"/"
@@ -37,6 +53,14 @@ class WriteTaxonomy(object):
 		if self.dbprogram: logging.debug("Output format for program {program}".format(program=self.dbprogram))
 		self.link_order = False ## Default print is NCBI structure with child in the first column
 		logging.debug("NCBI structure (child first): {parent}".format(parent=self.link_order))
+		self.compress = compress
+		if self.compress == "zstd":
+			try:
+				import zstandard
+			except ImportError:
+				raise ImportError("zstd compressed dump files require the zstandard package (pip install zstandard)")
+		elif self.compress and self.compress != "gzip":
+			raise ValueError("Unknown compression {compress} (gzip or zstd)".format(compress=self.compress))
 
 
 	def set_separator(self,sep):
@@ -51,9 +75,7 @@ class WriteTaxonomy(object):
 	def set_minimal(self):
 		logging.debug("Set minimal output to True!")
 		self.dbprogram = None
-		if self.separator != "\t|\t":
-			self.separator = separator
-		else:
+		if self.separator == "\t|\t":
 			self.separator = "\t"
 		self.minimal=True
 
@@ -72,44 +94,170 @@ class WriteTaxonomy(object):
 		logging.debug(QUERY)
 		return self.database.query(QUERY).fetchall()
 
-	def nodes(self):
-		'''Write database tree to nodes.dmp'''
-		logging.info('Write tree to: {}{}.dmp'.format(self.path,self.prefix[1]))
-		with open('{}{}.dmp'.format(self.path,self.prefix[1]),"w") as outputfile:
-			## Retrieve all links that exists in the database
+	def dump_path(self, prefix):
+		'''Path of a dump file (with .gz or .zst if compressed)'''
+		suffix = {"gzip": ".gz", "zstd": ".zst"}.get(self.compress,"")
+		return "{path}{prefix}.dmp{suffix}".format(path=self.path,prefix=prefix,suffix=suffix)
+
+	def open_dump(self, prefix):
+		'''Open a dump file for writing (text)'''
+		path = self.dump_path(prefix)
+		if self.compress == "gzip":
+			return gzip.open(path,"wt",compresslevel=6)
+		if self.compress == "zstd":
+			import zstandard
+			return zstandard.open(path,"wt")
+		return open(path,"w",buffering=1048576)
+
+	def row_format(self, columns, extra=[], end="\n"):
+		'''Format string of one row, columns values from the database followed by the extra (constant) columns'''
+		fields = ["%s"]*columns+[field.replace("%","%%") for field in extra]
+		return self.separator.replace("%","%%").join(fields)+end.replace("%","%%")
+
+	def write_rows(self, outputfile, cursor, row_format):
+		'''Write all rows of a cursor in batches of batchsize rows
+
+		Returns
+		------
+			int - number of rows written
+		'''
+		written = 0
+		while True:
+			rows = cursor.fetchmany(self.batchsize)
+			if not rows:
+				break
+			outputfile.writelines([row_format % row for row in rows])
+			written += len(rows)
+		return written
+
+	def nodes(self, database=False):
+		'''Write database tree to nodes.dmp (database connection to read from, default the connection of WriteTaxonomy)'''
+		database = database or self.database
+		path = self.dump_path(self.prefix[1])
+		logging.info('Write tree to: {}'.format(path))
+		columns = "child,parent" if not self.link_order else "parent,child"
+		if self.dump_descriptions:
+			### Node names are joined in the query, the order of the tree table is kept (nodes are looked up by id)
+			select = ",".join("{col}.name".format(col=col) for col in columns.split(","))+",rank"
+			QUERY = "SELECT {select} FROM tree CROSS JOIN rank ON rank.rank_i = tree.rank_i LEFT JOIN nodes AS child ON child.id = tree.child LEFT JOIN nodes AS parent ON parent.id = tree.parent".format(select=select)
+		else:
+			QUERY = "SELECT {columns},rank FROM tree JOIN (rank) on rank.rank_i = tree.rank_i".format(columns=columns)
+		logging.debug(QUERY)
+		extra = []
+		if self.dbprogram in ["bracken","kraken2"]:
+			extra.append("-")
+		if not self.minimal:
+			extra.append("")
+		with self.open_dump(self.prefix[1]) as outputfile:
 			if self.dump_descriptions:
-				self.nodeDict = self.database.get_nodes()
-				print("child\tparent\trank", sep=self.separator, end="\n", file=outputfile)
-
-			links = self.get_links('tree','child,parent,rank')
-			for link in links:
-				link = list(link)
-				if self.link_order:
-					link[0],link[1] = link[1],link[0]
-				if self.dump_descriptions:
-					link[0],link[1] = self.nodeDict[link[0]],self.nodeDict[link[1]]
-				if self.dbprogram in ["bracken","kraken2"]:
-					link = list(link)+["-"]
-				# if self.dbprogram == "kraken2":
-				# 	link = list(link)+["",""] ## Make sure to add enough extra columns so that kraken2 does not trim away nessesary columns
-				if not self.minimal:
-					link = list(link)+[""]
-				print(*link, sep=self.separator, end="\n", file=outputfile)
-
-	def names(self):
-		'''Write node annotations to names.dmp'''
-		logging.info('Write annotations to: {}{}.dmp'.format(self.path,self.prefix[0]))
+				outputfile.write("child\tparent\trank\n")
+			written = self.write_rows(outputfile,database.query(QUERY),self.row_format(3,extra))
+		logging.debug("{n} links written".format(n=written))
+
+	def names(self, database=False):
+		'''Write node annotations to names.dmp (database connection to read from, default the connection of WriteTaxonomy)'''
+		database = database or self.database
+		path = self.dump_path(self.prefix[0])
+		logging.info('Write annotations to: {}'.format(path))
 		end = "\n"
 		if self.dbprogram in ["krakenuniq","kraken2"]:
 			end = "\t|\n"
-		with open('{}{}.dmp'.format(self.path,self.prefix[0]),"w") as outputfile:
-			## Retrieve all nodes that exists in the database
-			nodes = self.get_all('nodes', 'id,name')
-			empty = ""
-			for node in nodes:
-				if not self.minimal:
-					empty = ""
-					if self.dbprogram == "bracken":
-						empty = "-"
-					node = list(node) + [empty,"scientific name"]
-				print(*node, sep=self.separator, end=end, file=outputfile)
+		extra = []
+		if not self.minimal:
+			extra = ["-" if self.dbprogram == "bracken" else "","scientific name"]
+		QUERY = "SELECT id,name FROM nodes"
+		logging.debug(QUERY)
+		with self.open_dump(self.prefix[0]) as outputfile:
+			written = self.write_rows(outputfile,database.query(QUERY),self.row_format(2,extra,end))
+		logging.debug("{n} names written".format(n=written))
+
+	def _write(self, part):
+		'''Write names or nodes on a new readonly connection (run in a thread, sqlite connections can not be shared between threads)'''
+		database = DatabaseFunctions(self.database_path,profile="readonly")
+		try:
+			getattr(self,part)(database)
+		finally:
+			database.conn.close()
+
+	def dump(self, parallel=True):
+		'''Write names.dmp and nodes.dmp, in parallel threads on separate readonly connections (sqlite reads without the GIL)'''
+		if not parallel:
+			self.nodes()
+			self.names()
+			return
+		with ThreadPoolExecutor(max_workers=2) as executor:
+			for future in [executor.submit(self._write,part) for part in ("nodes","names")]:
+				future.result()  ## Raise errors of the dump threads
+		return
+
+	def fingerprint_path(self):
+		'''Path to the fingerprint of the last dump'''
+		return "{path}{names}.{nodes}.fingerprint".format(path=self.path,names=self.prefix[0],nodes=self.prefix[1])
+
+	def settings(self):
+		'''Dump settings that change the dump files'''
+		return {"separator": self.separator, "prefix": self.prefix, "minimal": self.minimal, "descriptions": bool(self.dump_descriptions),
+				"dbprogram": self.dbprogram, "link_order": self.link_order, "compress": self.compress or False}
+
+	def database_stat(self):
+		'''Size and modification time of the database file (and its write ahead log)'''
+		stat = []
+		for path in (self.database_path,self.database_path+"-wal"):
+			if os.path.exists(path):
+				st = os.stat(path)
+				stat.append([st.st_size,st.st_mtime_ns])
+		return stat
+
+	def database_hash(self):
+		'''sha256 of the database file (and its write ahead log), the change counters of the sqlite header (bytes 24-27 and
+			92-95) are left out so a database rebuilt with the same content in the same way has the same hash
+
+		Returns
+		------
+			str - hex digest
+		'''
+		sha = hashlib.sha256()
+		for path in (self.database_path,self.database_path+"-wal"):
+			if not os.path.exists(path):
+				continue
+			with open(path,"rb") as f:
+				if path == self.database_path:
+					header = f.read(100)
+					sha.update(header[:24]+header[28:92])
+				for data in iter(lambda: f.read(4194304),b""):
+					sha.update(data)
+		return sha.hexdigest()
+
+	def unchanged(self):
+		'''Check if the dump files were written from the same database content with the same settings
+
+		Returns
+		------
+			boolean - True if the dump can be skipped
+		'''
+		try:
+			with open(self.fingerprint_path()) as f:
+				previous = json.load(f)
+		except (OSError,ValueError):
+			return False
+		if previous.get("settings") != json.loads(json.dumps(self.settings())):
+			return False
+		for path,size in previous.get("files",{}).items():
+			if not os.path.exists(path) or os.path.getsize(path) != size:
+				return False
+		if previous.get("stat") == self.database_stat():
+			return True
+		self.sha256 = self.database_hash()
+		if previous.get("sha256") != self.sha256:
+			return False
+		self.save_fingerprint()  ## Same content in a new database file, store the new file stat
+		return True
+
+	def save_fingerprint(self):
+		'''Store the fingerprint of the database and the dump files written'''
+		files = [self.dump_path(prefix) for prefix in self.prefix]
+		fingerprint = {"settings": self.settings(), "stat": self.database_stat(), "sha256": getattr(self,"sha256",None) or self.database_hash(),
+						"files": {path: os.path.getsize(path) for path in files if os.path.exists(path)}}
+		with open(self.fingerprint_path(),"w") as f:
+			json.dump(fingerprint,f,indent=1)
+		return fingerprint
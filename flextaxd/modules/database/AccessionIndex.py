@@ -0,0 +1,167 @@
+#!/usr/bin/env python3 -c
+
+'''
+Persistent index of NCBI accession2taxid files (accession.version to taxid)
+'''
+
+import os
+import sqlite3
+import shutil
+import subprocess
+import time
+import tempfile
+from gzip import open as zopen
+from contextlib import contextmanager
+from itertools import islice
+import logging
+logger = logging.getLogger(__name__)
+
+def default_index(database):
+	'''Default location of the accession index of a taxonomy database, next to the database (<database>.accession2taxid.idx),
+		the temp directory is used if the database directory is not writable
+
+	Returns
+	------
+		str - path to the index file
+	'''
+	index_file = database + ".accession2taxid.idx"
+	if os.access(os.path.dirname(os.path.abspath(index_file)), os.W_OK):
+		return index_file
+	fallback = os.path.join(tempfile.gettempdir(),os.path.basename(index_file))
+	logger.warning("Directory of {database} is not writable, the accession index is kept in {index}".format(database=database,index=fallback))
+	return fallback
+
+class AccessionIndex(object):
+	"""AccessionIndex keeps the accession.version to taxid columns of one or more accession2taxid files in a
+		sqlite3 table clustered on accession (WITHOUT ROWID), the index is built once and queried in bulk.
+
+		Each source file is fingerprinted (size and mtime), when NCBI publishes a new file it is read again and
+		only rows of that source that were added, removed or changed are written (refresh), unchanged sources
+		are not read again. Rows are kept
+		per source, an accession found in more than one source is resolved to the source indexed first.
+	"""
+	version = 2  ## Index format (PRAGMA user_version), tables of an older format are rebuilt
+	def __init__(self, index_file, chunksize=500000):
+		super(AccessionIndex, self).__init__()
+		self.index_file = index_file
+		self.chunksize = chunksize
+		self.updated = 0  ## Rows written or removed by the last refresh
+		self.conn = sqlite3.connect(index_file)
+		self.conn.execute("PRAGMA synchronous = OFF")
+		version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+		if version < 1:
+			'''Accessions were keyed on accession only, a refresh of one source could take over rows of another source'''
+			self.conn.execute("DROP TABLE IF EXISTS accessions")
+			self.conn.execute("DROP TABLE IF EXISTS sources")
+		if version < 2:
+			'''Genome file headers are kept in the manifest of the genome directory (DirectoryManifest)'''
+			self.conn.execute("DROP TABLE IF EXISTS manifest")
+		if version < self.version:
+			self.conn.execute("PRAGMA user_version = {version}".format(version=self.version))
+		self.conn.execute("CREATE TABLE IF NOT EXISTS sources (source integer PRIMARY KEY, path text UNIQUE NOT NULL, size integer, mtime integer, rows integer)")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS accessions (accession text, source integer NOT NULL, taxid integer NOT NULL, PRIMARY KEY (accession,source)) WITHOUT ROWID")
+		self.conn.commit()
+
+	def __repr__(self):
+		return "AccessionIndex({})".format(self.index_file)
+
+	def close(self):
+		self.conn.close()
+
+	def fingerprint(self, accession_file):
+		'''Returns
+		------
+			tuple - (size, mtime) of the accession2taxid file
+		'''
+		stat = os.stat(accession_file)
+		return (stat.st_size, int(stat.st_mtime))
+
+	def is_current(self, accession_file):
+		'''Check if the accession file is indexed and unchanged since it was indexed'''
+		res = self.conn.execute("SELECT size,mtime FROM sources WHERE path = ?",(os.path.abspath(accession_file),)).fetchone()
+		return res is not None and tuple(res) == self.fingerprint(accession_file)
+
+	@contextmanager
+	def open_source(self, accession_file):
+		'''Open the (gzipped) accession2taxid file as a binary stream, pigz is used for decompression when available'''
+		if accession_file.endswith(".gz") and shutil.which("pigz"):
+			logger.debug("Decompress {file} with pigz".format(file=accession_file))
+			with subprocess.Popen(["pigz","-dc",accession_file],stdout=subprocess.PIPE,bufsize=1048576) as pigz:
+				yield pigz.stdout
+			if pigz.returncode != 0:
+				raise OSError("pigz could not decompress {file}".format(file=accession_file))
+		elif accession_file.endswith(".gz"):
+			with zopen(accession_file, "rb") as _source:
+				yield _source
+		else:
+			with open(accession_file, "rb", buffering=1048576) as _source:
+				yield _source
+
+	def parse_source(self, _source, source):
+		'''Parse rows of an accession2taxid file (accession, accession.version, taxid, gi)'''
+		_source.readline()  ## header
+		for row in _source:
+			data = row.split(b"\t",3)
+			if len(data) < 3:
+				continue
+			yield (data[1].decode("utf-8"),int(data[2]),source)
+
+	def refresh(self, accession_file, force=False):
+		'''Index an accession2taxid file, if the file was indexed before and changed the index is updated with
+			the rows that differ from the indexed rows of the file
+
+		Returns
+		------
+			int - rows in the index from this file
+		'''
+		path = os.path.abspath(accession_file)
+		if self.is_current(accession_file) and not force:
+			logger.info("Accession index {index} is up to date with {file}".format(index=self.index_file,file=accession_file))
+			return self.conn.execute("SELECT rows FROM sources WHERE path = ?",(path,)).fetchone()[0]
+		start = time.time()
+		logger.info("Index {file} into {index}".format(file=accession_file,index=self.index_file))
+		size,mtime = self.fingerprint(accession_file)
+		self.conn.execute("INSERT OR IGNORE INTO sources(path) VALUES (?)",(path,))
+		source = self.conn.execute("SELECT source FROM sources WHERE path = ?",(path,)).fetchone()[0]
+		### Rows are appended to a staging table and moved to the index in accession order, sorted inserts
+		### into the clustered table are much faster than inserts in file order. Only rows that differ from
+		### the indexed rows of the source are removed or written
+		self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS staged_accessions (accession text, taxid integer, source integer)")
+		self.conn.execute("DELETE FROM staged_accessions")
+		with self.open_source(accession_file) as _source:
+			rows = self.parse_source(_source, source)
+			while True:
+				chunk = list(islice(rows,self.chunksize))
+				if not chunk:
+					break
+				self.conn.executemany("INSERT INTO staged_accessions VALUES (?,?,?)",chunk)
+		self.conn.execute("CREATE INDEX IF NOT EXISTS staged_accession ON staged_accessions (accession,taxid)")
+		changes = self.conn.total_changes
+		self.conn.execute("""DELETE FROM accessions WHERE source = ? AND NOT EXISTS
+							(SELECT 1 FROM staged_accessions AS s WHERE s.accession = accessions.accession AND s.taxid = accessions.taxid)""",(source,))
+		self.conn.execute("""INSERT OR REPLACE INTO accessions SELECT accession,source,taxid FROM staged_accessions AS s WHERE NOT EXISTS
+							(SELECT 1 FROM accessions AS a WHERE a.accession = s.accession AND a.source = s.source AND a.taxid = s.taxid) ORDER BY accession""")
+		self.updated = self.conn.total_changes - changes
+		self.conn.execute("DROP TABLE staged_accessions")
+		rows = self.conn.execute("SELECT count(*) FROM accessions WHERE source = ?",(source,)).fetchone()[0]
+		self.conn.execute("UPDATE sources SET size = ?, mtime = ?, rows = ? WHERE source = ?",(size,mtime,rows,source))
+		self.conn.commit()
+		logger.info("Indexed {rows} accessions ({updated} rows updated) in {time:.1f}s".format(rows=rows,updated=self.updated,time=time.time()-start))
+		return rows
+
+	def lookup(self, accessions):
+		'''Find taxids of a list of accessions (accession.version) in one query, an accession in more than one
+			source gets the taxid of the source indexed first (lowest source number)
+
+		Returns
+		------
+			dict - accession: taxid for all accessions found in the index
+		'''
+		self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS query_accessions (accession text PRIMARY KEY) WITHOUT ROWID")
+		self.conn.execute("DELETE FROM query_accessions")
+		self.conn.executemany("INSERT OR IGNORE INTO query_accessions VALUES (?)",((accession,) for accession in accessions))
+		res = self.conn.execute("SELECT a.accession,a.taxid FROM query_accessions AS q JOIN accessions AS a ON a.accession = q.accession ORDER BY a.accession,a.source DESC")
+		found = dict(res.fetchall())  ## The last row of an accession is its first source
+		self.conn.execute("DELETE FROM query_accessions")
+		self.conn.commit()
+		return found
@@ -15,6 +15,7 @@ class ConnectionError(Exception):
 
 class CreateDatabase(object):
     """docstring for CreateDatabase"""
+    schema_version = 1  ## Stored in PRAGMA user_version, increase when a migration is added below
     def __init__(self, verbose=False):
         super().__init__()
         self.verbose=verbose
@@ -44,6 +45,18 @@ class CreateDatabase(object):
                                             FOREIGN KEY (id) REFERENCES nodes (id)
                                         ); """
 
+        ## Schema migrations, each version lists the statements required to upgrade from the previous version
+        ## version 1: lookup indexes (get_id, get_parent, update_genome and delete_genomes)
+        self.migrations = {
+            1: [
+                "CREATE INDEX IF NOT EXISTS tree_child_index ON tree (child);",
+                "CREATE INDEX IF NOT EXISTS tree_parent_index ON tree (parent);",
+                "CREATE INDEX IF NOT EXISTS nodes_name_index ON nodes (name);",
+                "CREATE INDEX IF NOT EXISTS genomes_genome_index ON genomes (genome);",
+                "CREATE INDEX IF NOT EXISTS genomes_id_index ON genomes (id);",
+            ],
+        }
+
     def create_connection(self,db_file):
         """ create a database connection to the SQLite database
             specified by db_file
@@ -74,20 +87,57 @@ class CreateDatabase(object):
         self.conn.commit()
         return
 
+    def get_schema_version(self,conn):
+        """ read the schema version of a database
+        :param conn: Connection object
+        :return: int schema version (PRAGMA user_version)
+        """
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def upgrade_database(self,conn):
+        """ upgrade the schema of an existing database to the current schema_version
+        :param conn: Connection object
+        :return: int schema version after upgrade
+        """
+        version = self.get_schema_version(conn)
+        if version >= self.schema_version:
+            return version
+        logger.info("Upgrade database schema from version {old} to {new}".format(old=version,new=self.schema_version))
+        for migration in range(version+1, self.schema_version+1):
+            for statement in self.migrations[migration]:
+                logger.debug(statement)
+                conn.execute(statement)
+            conn.execute("PRAGMA user_version = {version}".format(version=migration))
+            conn.commit()
+        return self.schema_version
+
+    def create_schema(self,conn):
+        """ create all tables and indexes on an open connection in a single transaction
+        :param conn: Connection object
+        :return: int schema version
+        """
+        self.conn = conn
+        try:
+            conn.execute("BEGIN")
+            # create nodes, tree, genomes and rank tables
+            for table in [self.sql_create_nodes_table,self.sql_create_tree_table,self.sql_create_genomes_table,self.sql_create_rank_table]:
+                conn.execute(table)
+            # create indexes and set schema version
+            for migration in range(1, self.schema_version+1):
+                for statement in self.migrations[migration]:
+                    conn.execute(statement)
+            conn.execute("PRAGMA user_version = {version}".format(version=self.schema_version))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return self.schema_version
+
     def create_database(self,database=False):
         # create a database connection
         self.conn = self.create_connection(database)
         if self.conn is not None:
-            # create nodes table
-            self.create_table(self.sql_create_nodes_table)
-            # create tree table
-            self.create_table(self.sql_create_tree_table)
-            # create genomes table
-            self.create_table(self.sql_create_genomes_table)
-            # create rank tables
-            self.create_table(self.sql_create_rank_table)
-
-            self.conn.commit()
+            self.create_schema(self.conn)
         else:
             raise ConnectionError("Error! cannot connet to the database {db}".format(db=database))
         return
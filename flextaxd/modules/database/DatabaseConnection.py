@@ -2,6 +2,12 @@ import sys
 import os
 import sqlite3
 import logging
+import json
+from itertools import islice
+from urllib.parse import quote
+from .CreateDatabase import CreateDatabase
+from .TaxonomyGraph import TaxonomyGraph
+from .TreeValidator import TreeValidator
 logger = logging.getLogger(__name__)
 
 class ConnectionError(Exception):
@@ -22,23 +28,50 @@ class TreeError(Exception):
 	def __str__(self):
 		return repr(self.value)
 
+'''Connection profiles, sqlite PRAGMA settings applied when a connection is opened
+	default  - sqlite defaults (rollback journal, full sync)
+	safe     - write ahead log, full sync
+	bulk     - no journal and no sync, large page cache and mmap, only for imports that can be rerun
+	readonly - opened with mode=ro and mmap, for dump, statistics and visualisation runs
+'''
+PROFILES = {
+	"default": [],
+	"safe": [("journal_mode","WAL"),("synchronous","FULL")],
+	"bulk": [("journal_mode","OFF"),("synchronous","OFF"),("cache_size",-1048576),("temp_store","MEMORY"),("mmap_size",1073741824)],
+	"readonly": [("query_only","ON"),("cache_size",-262144),("temp_store","MEMORY"),("mmap_size",1073741824)],
+}
+
 class DatabaseConnection(object):
 	"""docstring for DatabaseConnection"""
-	def __init__(self, database, verbose=False):
+	chunksize = 100000  ## Number of rows sent to sqlite per executemany call in bulk inserts
+	profile = "default" ## Connection profile used when no profile is given (see PROFILES)
+	def __init__(self, database, verbose=False, profile=None):
 		super().__init__()
 		self.verbose = verbose
 		self.database = database
-		BASE_DIR = os.path.dirname(os.path.abspath(__file__))  ## Retrieve path
-		if not os.path.exists(self.database):
-			if self.verbose:
-				logger.debug("python {path}/CreateDatabase.py {database}".format(path=BASE_DIR,database=self.database))
-			os.system("python {path}/CreateDatabase.py {database}".format(path=BASE_DIR,database=self.database))
+		if profile:
+			self.profile = profile
+		if self.profile not in PROFILES:
+			raise ConnectionError("Unknown database profile {profile}, choose one of {profiles}".format(profile=self.profile,profiles=", ".join(PROFILES)))
+		new_database = not os.path.exists(self.database)
+		if new_database and self.profile == "readonly":
+			raise ConnectionError("The database {database} does not exist and cannot be created with a readonly profile".format(database=self.database))
 		try: ## If database connection already exists
 			self.conn
 		except AttributeError:
 			logger.debug("Connecting to {database}".format(database=self.database))
 			self.conn = self.connect(self.database)
 			self.cursor = self.create_cursor(self.conn)
+			if new_database:
+				## Create the database schema on the open connection
+				logger.debug("Create database {database}".format(database=self.database))
+				CreateDatabase(verbose=self.verbose).create_schema(self.conn)
+			## Migrate databases created with an older schema (ie. missing indexes), readonly connections are used as is
+			elif self.profile != "readonly":
+				try:
+					CreateDatabase(verbose=self.verbose).upgrade_database(self.conn)
+				except sqlite3.OperationalError as e:
+					logger.warning("Could not upgrade the schema of {database} ({error}), continue without upgrade".format(database=self.database,error=e))
 
 	def __str__(self):
 		return "Object of class DatabaseConnection, connected to {database}".format(database=self.database)
@@ -46,6 +79,18 @@ class DatabaseConnection(object):
 	def __repr__(self):
 		return "DatabaseConnection()"
 
+	@classmethod
+	def set_profile(cls,profile):
+		'''Set the connection profile used by all DatabaseConnection objects opened without a profile
+
+		------
+		Returns
+			str - profile'''
+		if profile not in PROFILES:
+			raise ConnectionError("Unknown database profile {profile}, choose one of {profiles}".format(profile=profile,profiles=", ".join(PROFILES)))
+		DatabaseConnection.profile = profile
+		return profile
+
 	def set_verbose(self,val):
 		'''Set the verbose level of the DatabaseConnection object
 
@@ -63,13 +108,35 @@ class DatabaseConnection(object):
 			connection object (sqlite3)
 		'''
 		try:
-			self.conn = sqlite3.connect(database)
-			logger.info("{database} opened successfully.".format(database=database))
+			if self.profile == "readonly":
+				self.conn = sqlite3.connect("file:{path}?mode=ro".format(path=quote(os.path.abspath(database))),uri=True)
+			else:
+				self.conn = sqlite3.connect(database)
+			for pragma,value in PROFILES[self.profile]:
+				self.conn.execute("PRAGMA {pragma} = {value}".format(pragma=pragma,value=value))
+			self.check_json(self.conn)
+			logger.info("{database} opened successfully ({profile}).".format(database=database,profile=self.profile))
 			return self.conn
+		except ConnectionError:
+			raise
 		except Exception as e:
 			sys.stderr.write(str(e))
 		raise ConnectionError("Count not connect to the database {database} see above message for details!".format(database=database))
 
+	def check_json(self,conn):
+		'''Node ids are bound to tree queries as json arrays (json_each), check that sqlite has the JSON1 functions
+
+		------
+		Returns
+			boolean - True if json_each can be used
+		'''
+		try:
+			conn.execute("SELECT value FROM json_each('[1]')").fetchall()
+		except sqlite3.OperationalError:
+			conn.close()
+			raise ConnectionError("sqlite {version} was built without the JSON1 extension (json_each), use sqlite 3.38 or later or a build with JSON1 enabled".format(version=sqlite3.sqlite_version))
+		return True
+
 	def create_cursor(self,conn):
 		'''Create a db cursor
 
@@ -138,6 +205,55 @@ class DatabaseConnection(object):
 		)
 		return self.query(insertStr,insert_val=values)
 
+	def insert_many(self,rows,table,columns,chunksize=False,ignore=True):
+		'''Bulk insert function
+				rows is an iterable of tuples with values ordered as columns,
+				rows are sent to sqlite with executemany in chunks of chunksize.
+				With ignore rows violating a UNIQUE constraint are skipped (INSERT OR IGNORE)
+		------
+		Returns
+			int - number of rows added to the table
+		'''
+		INSERT_QUERY = '''
+			INSERT {ignore} INTO {table}({columns})
+			VALUES ({values})
+		'''.format(
+				ignore="OR IGNORE" if ignore else "",
+				table=table,
+				columns=",".join(columns),
+				values=",".join(["?" for x in columns])
+		)
+		if not chunksize:
+			chunksize = self.chunksize
+		rows = iter(rows)
+		changes = 0
+		while True:
+			chunk = list(islice(rows,chunksize))
+			if not chunk:
+				break
+			before = self.conn.total_changes
+			self.cursor.executemany(INSERT_QUERY,chunk)
+			changes += self.conn.total_changes - before
+		return changes
+
+	def stream(self,query,chunksize=False):
+		'''Stream rows of a query, fetched in chunks of chunksize on a separate cursor
+				so the shared cursor can be used while the rows are read
+		------
+		Returns
+			generator - rows of the query
+		'''
+		if not chunksize:
+			chunksize = self.chunksize
+		cursor = self.conn.cursor()
+		cursor.execute(query)
+		while True:
+			rows = cursor.fetchmany(chunksize)
+			if not rows:
+				break
+			for row in rows:
+				yield row
+
 	def update(self,data,table):
 		'''Update function requires table column which column to identify row with and value to replace
 
@@ -186,80 +302,56 @@ class DatabaseFunctions(DatabaseConnection):
 	"""DatabaseFunctions class defines additional functions to the DatabaseConnection class
 
 	"""
-	def __init__(self, database, verbose=False):
-		super().__init__(database, verbose)
+	def __init__(self, database, verbose=False, profile=None):
+		super().__init__(database, verbose, profile)
 		logger.debug("Load DatabaseFunctions")
 
 	'''Validate tree function'''
 	def validate_tree(self):
-		'''This function validates the tree structure in the databases
+		'''This function validates the tree structure in the databases in a single pass over the tree table
+			(see TreeValidator), the report is kept in validation_report
 			1. All nodes must only have one parent (check_parent)
-			2. All edges must be attatched to the tree (match tree links and edges)
-			3. All nodes must be attatched to the tree (match tree nodes and nodes)
-			4. All nodes from links must have a node description (match the number of nodes from links with number of annotated nodes)
+			2. All nodes from links must have a node description
+			3. The tree must not contain cycles
+			4. All nodes must be attatched to the tree
+			5. All edges must be attatched to the tree
 
 		------
 		Returns
 			True: if all edges has one and only one parent
 		'''
-		logger.info("Get all database nodes")
-		self.nodes = self.get_nodes(col=1)					## get all nodes
-		logger.info("Get all database edges")
-		self.edges = self.get_links()					## Get all links
-		logger.info("Get all children from root node")
-		self.tree_connections = self.get_children([1])  ## Get all chilren from root
-		logger.info("Get tree edges from children")
-		self.tree_links = self.get_links(self.tree_connections) ## get all links from rooted tree
-		logger.info("Get nodes from tree edges")
-		self.tree_nodes = set()
-		for edge in self.edges:
-			self.tree_nodes.add(edge[0])
-			self.tree_nodes.add(edge[1])
-		logger.info("Validate parents")
-		res = self.check_parent()
-		if len(res) > 0:
-			failed_nodes = [self.nodes[x[0]] for x in list(res)]
-			if len(failed_nodes) > 10:
-				failed_nodes = len(failed_nodes)
-			raise TreeError("There are nodes with multiple parents {nodes}".format(nodes=failed_nodes))
+		report = self.validation_report = TreeValidator(self,chunksize=self.chunksize).validate()
 		stats = """Tree statistics
 					Nodes: {nodes}
 					Links: {links}
-					Tree: n({tnodes}), l({tlinks})
-					LinkNodes: {link_nodes}
-					Parent_ok: True
-					""".format(nodes = len(self.nodes),
-								links=len(self.edges),
-								tnodes=len(self.tree_connections),
-								tlinks = len(self.tree_links),
-								link_nodes = len(self.tree_nodes)
-		)
+					Multiple parents: {multiple_parents}
+					Missing nodes: {missing_nodes}
+					Cycles: {cycles}
+					Unreachable nodes: {unreachable_nodes}
+					Orphan links: {orphan_links}
+					""".format(**report)
 		logger.info(stats)
-		nodeset = set(self.nodes.keys())
-		if len(nodeset - self.tree_connections) != 0:
-			lset = nodeset - self.tree_connections
-			if len(lset) > 10:
-				lset = len(lset)
-			logger.info("{}".format(lset))
+
+		def offenders(check):
+			if report[check] > len(report["samples"][check]):
+				return report[check]
+			return report["samples"][check]
+
+		if report["multiple_parents"] > 0:
+			raise TreeError("There are nodes with multiple parents {nodes}".format(nodes=offenders("multiple_parents")))
+		if not report["root"]:
+			raise TreeError("The root node is missing!")
+		if report["missing_nodes"] > 0:
+			logger.info("{}".format(offenders("missing_nodes")))
+			raise TreeError("The number of annotated nodes does not match with the number of nodes connected to edges!")
+		if report["cycles"] > 0:
+			raise TreeError("There are cycles in the tree {nodes}".format(nodes=offenders("cycles")))
+		if report["unreachable_nodes"] > 0:
+			logger.info("{}".format(offenders("unreachable_nodes")))
 			raise TreeError("The number of nodes and the number nodes under root does not match!")
-		if len(set(self.edges) - set(self.tree_links)) != 0:
-			lset = set(self.edges) - set(self.tree_links)
-			if len(lset) > 10:
-				lset = len(lset)
-			logger.info("{}".format(lset))
+		if report["orphan_links"] > 0:
+			logger.info("{}".format(offenders("orphan_links")))
 			raise TreeError("The number of edges and the number edges under root does not match!")
-		if len(self.tree_nodes - nodeset) != 0:
-			lset = self.tree_nodes - nodeset
-			if len(lset) > 10:
-				lset = len(lset)
-			logger.info("{}".format(lset))
-			raise TreeError("The number of annotated nodes does not match with the number of nodes connected to edges!")
-		if len(self.tree_connections - nodeset) != 0:
-			lset = self.tree_connections - nodeset
-			if len(lset) > 10:
-				lset = len(lset)
-			logger.info("{}".format(lset))
-			raise TreeError("There are nodes in the database not connected to the tree")
 		logger.info("Validation OK!")
 		return True
 
@@ -306,6 +398,18 @@ class DatabaseFunctions(DatabaseConnection):
 		raise TreeError("Node: {node} has more than one parent!".format(node=name))
 
 	'''Get functions of class'''
+	def get_graph(self,reload=False):
+		'''Load the nodes and tree tables into a compact in-memory TaxonomyGraph, the graph is loaded once
+			and reused until reload is requested (ie. after the tree has been modified)
+
+		------
+		Returns
+			TaxonomyGraph
+		'''
+		if reload or getattr(self,"graph",None) is None:
+			self.graph = TaxonomyGraph(self,chunksize=self.chunksize)
+		return self.graph
+
 	def get_all(self, database=False, table=False):
 		'''Get full table from table
 
@@ -381,19 +485,30 @@ class DatabaseFunctions(DatabaseConnection):
 			order[1],order[0] = order[0],order[1]
 
 		if only_parents and nodes:
-			QUERY = '''SELECT {order},rank_i FROM tree WHERE child in ({nodes})'''.format(nodes=",".join(map(str,nodes)),order=",".join(order))
+			QUERY = '''SELECT {order},rank_i FROM tree WHERE child in (SELECT value FROM json_each(:nodes))'''.format(order=",".join(order))
 		elif nodes:
-			QUERY = '''SELECT {order},rank_i FROM tree WHERE parent in ({nodes}) OR child in ({nodes})'''.format(nodes=",".join(map(str,nodes)),order=",".join(order))
-		elif nodes and order:
-			 QUERY = '''SELECT {order},rank_i FROM tree WHERE child in ({nodes}) ORDER BY child ASC'''
+			QUERY = '''SELECT {order},rank_i FROM tree WHERE parent in (SELECT value FROM json_each(:nodes)) OR child in (SELECT value FROM json_each(:nodes))'''.format(order=",".join(order))
 		else:
 			QUERY = '''SELECT {order},rank_i FROM tree'''.format(order=",".join(order))
 		logger.debug(QUERY)
 		if not database:
 			database = self.database
-		links = self.query(QUERY).fetchall()
+		if nodes:
+			## Node ids are bound as one json array instead of a literal IN list
+			links = self.query(QUERY,{"nodes": self.json_ids(nodes)},error=True).fetchall()
+		else:
+			links = self.query(QUERY).fetchall()
 		return links
 
+	def json_ids(self,nodes):
+		'''Format a collection of node ids as a json array that can be bound to a query using json_each
+
+		------
+		Returns
+			str - json array of node ids
+		'''
+		return json.dumps([int(node) for node in nodes])
+
 	'''Add functions of class'''
 	def add_node(self, description, id=False, table="nodes"):
 		'''Add node to tree
@@ -459,42 +574,41 @@ class DatabaseFunctions(DatabaseConnection):
 			info["id"] = _id
 		return self.insert(info, table="genomes")
 
-	def add_links(self,links, table="tree",hold=False):
-		'''Add links from a list to tree
+	def add_links(self,links, table="tree",hold=False,chunksize=False):
+		'''Add links from a list to tree, links are loaded into a temporary staging table
+			and the links not already in the table are inserted with one statement
 
 		Returns
 		------
 			list 	- tree links added
 			set		- set of unique nodes in added links
 		'''
-		added_links = []
+		self.query("CREATE TEMP TABLE IF NOT EXISTS staged_links (parent integer, child integer, rank_i integer, unique (parent, child))")
+		self.query("DELETE FROM staged_links")
+		self.insert_many(links,"staged_links",("parent","child","rank_i"),chunksize=chunksize)
+		### Links that already exist in the database are not added, this overlap may occur when a large new branch is added
+		self.query("DELETE FROM staged_links WHERE EXISTS (SELECT 1 FROM {table} AS t WHERE t.parent = staged_links.parent AND t.child = staged_links.child)".format(table=table))
+		added_links = self.query("SELECT parent,child,rank_i FROM staged_links ORDER BY rowid").fetchall()
+		self.query("INSERT INTO {table}(parent,child,rank_i) SELECT parent,child,rank_i FROM staged_links ORDER BY rowid".format(table=table))
+		self.query("DELETE FROM staged_links")
 		nodes = set()
-		for parent,child,rank in links:
-			#logger.debug("{} {} rank: {} link added!".format(parent,child,rank))
-			res = self.add_link(child,parent,rank,table=table)
-			### Check if the link already exist in the database, this overlap may occur when a large new branch is added
-			if "UNIQUE constraint failed" not in str(res):
-				added_links.append([parent,child,rank])
-				nodes.add(parent)
-				nodes.add(child)
+		for parent,child,rank in added_links:
+			nodes.add(parent)
+			nodes.add(child)
 		## Commit changes
 		if not hold:
 			self.commit()
 		return added_links,nodes
 
-	def add_nodes(self,nodes, table="tree",hold=False):
-		'''Add nodes from a list of nodes
+	def add_nodes(self,nodes, table="nodes",hold=False,chunksize=False):
+		'''Add nodes from a list of nodes (descriptions), empty descriptions are not added
 
 		Returns
 		------
 			int - number of nodes added ()
 		'''
-		added_nodes = 0
-		for node in nodes:
-			res = self.add_node(node)
-			### If the node already exist in the database
-			if "UNIQUE constraint failed" not in str(res):
-				added_nodes +=1
+		rows = ((node,) for node in nodes if node.strip() != "")
+		added_nodes = self.insert_many(rows,table,("name",),chunksize=chunksize)
 		## Commit changes
 		if not hold:
 			self.commit()
@@ -591,8 +705,8 @@ class DatabaseFunctions(DatabaseConnection):
 
 class ModifyFunctions(DatabaseFunctions):
 	"""ModifyFunctions adds nessesary functions when modifying a database"""
-	def __init__(self, database, verbose=False):
-		super().__init__(database, verbose)
+	def __init__(self, database, verbose=False, profile=None):
+		super().__init__(database, verbose, profile)
 		logger.debug("Load ModifyFunctions")
 
 	def get_rank(self,col=1):
@@ -612,21 +726,42 @@ class ModifyFunctions(DatabaseFunctions):
 			rankDict[rank[1]] = rank[0]
 		return rankDict
 
-	def get_children(self,parents,children=set(),level=0,maxdepth=50):
+	def iter_children(self,parents,maxdepth=None):
+		'''Stream all children from a set of parents using one recursive query
+			maxdepth limits the number of levels below the direct children of parents, None walks the whole tree
+
+		Yields
+		------
+			int - node id of each node in the decending tree
+		'''
+		if maxdepth is None:
+			QUERY = '''WITH RECURSIVE subtree(node) AS (
+							SELECT child FROM tree WHERE parent in (SELECT value FROM json_each(:parents))
+							UNION
+							SELECT tree.child FROM tree JOIN subtree ON tree.parent = subtree.node
+						)
+						SELECT node FROM subtree'''
+		else:
+			QUERY = '''WITH RECURSIVE subtree(node,level) AS (
+							SELECT child,0 FROM tree WHERE parent in (SELECT value FROM json_each(:parents))
+							UNION
+							SELECT tree.child,subtree.level+1 FROM tree JOIN subtree ON tree.parent = subtree.node
+								WHERE subtree.level < :maxdepth
+						)
+						SELECT DISTINCT node FROM subtree'''
+		## Use a separate cursor so that other queries can be run while the result is consumed
+		cursor = self.conn.cursor()
+		for child in cursor.execute(QUERY,{"parents": self.json_ids(parents),"maxdepth": maxdepth}):
+			yield child[0]
+
+	def get_children(self,parents,maxdepth=None):
 		'''Get all children from a parent
 
 		Returns
 		------
 			set - unique list of children from a decending tree
 		'''
-		QUERY = '''SELECT child FROM tree WHERE parent in({nodes})'''.format(nodes=",".join(map(str,list(parents))))
-		#logger.debug(QUERY)
-		res = self.query(QUERY).fetchall()
-		if (len(res) + len(children)) != 0:
-			children = set([child_i[0] for child_i in res])
-			if level < maxdepth:
-				children |= self.get_children(parents=children,level=level+1,maxdepth=maxdepth)
-		return children
+		return set(self.iter_children(parents,maxdepth=maxdepth))
 
 	def get_parent(self,name):
 		'''Get parent from node id parent
@@ -636,52 +771,38 @@ class ModifyFunctions(DatabaseFunctions):
 			list - parent link and rank
 		'''
 		#QUERY = '''SELECT parent,child,rank FROM tree LEFT JOIN rank on (tree.rank_i = rank.rank_i) WHERE child = "{node}"'''.format(node=name)
-		QUERY = '''SELECT parent,child,rank_i FROM tree WHERE child = "{node}"'''.format(node=name)
+		QUERY = '''SELECT parent,child,rank_i FROM tree WHERE child = ?'''
 		logger.debug(QUERY)
-		res = self.query(QUERY).fetchone()
+		res = self.query(QUERY,(name,),error=True).fetchone()
 		return res
 
-	def get_parents(self,name,parents=set(),depth=0,find_all=False):
-		'''Get all parents until root
+	def iter_parents(self,nodes):
+		'''Stream all parents until root from a set of nodes using one recursive query
+
+		Yields
+		------
+			int - node id of each parent in the lineage of the nodes
+		'''
+		QUERY = '''WITH RECURSIVE lineage(node) AS (
+						SELECT parent FROM tree WHERE child in (SELECT value FROM json_each(:nodes))
+						UNION
+						SELECT tree.parent FROM tree JOIN lineage ON tree.child = lineage.node
+					)
+					SELECT node FROM lineage'''
+		cursor = self.conn.cursor()
+		for parent in cursor.execute(QUERY,{"nodes": self.json_ids(nodes)}):
+			yield parent[0]
+
+	def get_parents(self,name,find_all=False):
+		'''Get all parents until root, name is a node id or a set of node ids (find_all)
 
 		Returns
 		------
-			list - all parents of a node
+			set - all parents of a node
 		'''
-		ld = depth+1
-		name = set(list(map(int,name))) ## Make sure all names are int
-		if isinstance(name, int):
+		if isinstance(name, int) or isinstance(name, str):
 			name = [name]
-		QUERY = '''SELECT parent,child FROM tree WHERE child in ({node})'''.format(node=",".join(map(str,name)))
-		#logger.debug(QUERY)
-		res = self.query(QUERY).fetchall()
-		if not find_all:
-			try:
-				res = int(res[0])
-			except IndexError:
-				logger.warning("WARNING: parent could not be found for node {res} \n{query}".format(query=QUERY, res=name))
-				return set()
-			if res[0] == res[1]:  ## Special for root
-				return set([res[0]])
-			else:
-				## Add all parents
-				try:
-					parents |= self.get_parents([int(res[0])],depth=ld)
-				except RecursionError:
-					print(res, name)
-			## Add current node
-			parents |= set([int(res[0])])
-		else:
-			parents = set([int(pc[0]) for pc in res])
-			if len(parents-name) == 0:  ## There are no more parents to fetch
-				return parents
-			else:
-				## Add all parents
-				try:
-					parents |= self.get_parents(parents,depth=ld,find_all=find_all)
-				except RecursionError:
-					print(res, name)
-		return parents
+		return set(self.iter_parents(name))
 
 	def get_id(self,name):
 		'''get node id from name
@@ -690,9 +811,9 @@ class ModifyFunctions(DatabaseFunctions):
 		------
 			int - node id from node name
 		'''
-		QUERY = '''SELECT id FROM nodes WHERE name = "{node}"'''.format(node=name)
+		QUERY = '''SELECT id FROM nodes WHERE name = ?'''
 		try:
-			res = self.query(QUERY).fetchone()[0]
+			res = self.query(QUERY,(name,),error=True).fetchone()[0]
 		except TypeError:
 			logger.debug(QUERY)
 			raise NameError("Name not found in the database! {name}".format(name=name))
@@ -706,3 +827,33 @@ class ModifyFunctions(DatabaseFunctions):
 			see update responses
 		'''
 		return self.update(data, table="genomes")
+
+	def update_genomes(self,genomes,hold=False,chunksize=False):
+		'''Set the node of a list of (genome, id) annotations in bulk, genomes already in the table are updated
+			and new genomes are added. The annotations are loaded into a temporary table and applied with one
+			UPDATE and one INSERT statement (the last annotation of a genome given more than once is kept)
+
+		Returns
+		------
+			int - number of genomes added
+			int - number of genome annotations updated (same counts as repeated calls to update_genome)
+		'''
+		self.query("CREATE TEMP TABLE IF NOT EXISTS staged_genomes (genome text PRIMARY KEY, id integer)")
+		self.query("DELETE FROM staged_genomes")
+		if not chunksize:
+			chunksize = self.chunksize
+		genomes = iter(genomes)
+		rows = 0
+		while True:
+			chunk = list(islice(genomes,chunksize))
+			if not chunk:
+				break
+			self.cursor.executemany("INSERT OR REPLACE INTO staged_genomes(genome,id) VALUES (?,?)",chunk)
+			rows += len(chunk)
+		### Only rows where the node changes are written (correlated form, UPDATE ... FROM requires sqlite 3.33)
+		self.query("UPDATE genomes SET id = (SELECT s.id FROM staged_genomes AS s WHERE s.genome = genomes.genome) WHERE genome IN (SELECT s.genome FROM staged_genomes AS s WHERE s.genome = genomes.genome AND s.id IS NOT genomes.id)")
+		added = self.query("INSERT INTO genomes(genome,id) SELECT genome,id FROM staged_genomes AS s WHERE NOT EXISTS (SELECT 1 FROM genomes AS g WHERE g.genome = s.genome)").rowcount
+		self.query("DELETE FROM staged_genomes")
+		if not hold:
+			self.commit()
+		return added,rows-added
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3 -c
+
+'''
+Persistent manifest of a genome directory tree (directory listings, file size and mtime)
+'''
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import logging
+logger = logging.getLogger(__name__)
+
+def scan_directory(path, match=None, stat_files=True):
+	'''List a directory with os.scandir (symbolic links are followed)
+
+	Returns
+	------
+		list - entries (name, is_dir, size, mtime, genome) sorted on name, is_dir is 2 for a symbolic link to a directory
+	'''
+	entries = []
+	with os.scandir(path) as it:
+		for entry in it:
+			try:
+				is_dir = entry.is_dir()
+			except OSError:
+				is_dir = False
+			if is_dir:
+				entries.append((entry.name,2 if entry.is_symlink() else 1,None,None,None))
+				continue
+			size,mtime = None,None
+			if stat_files:
+				try:
+					stat = entry.stat()
+					size,mtime = stat.st_size,stat.st_mtime_ns
+				except OSError:  ## Broken symbolic link
+					pass
+			genome = match(entry.name) if match else None
+			entries.append((entry.name,0,size,mtime,genome))
+	entries.sort()
+	return entries
+
+def visit_directory(path, match=None):
+	'''List a directory (visit function of walk_tree without manifest)'''
+	try:
+		return scan_directory(path,match,stat_files=False),None
+	except OSError as e:
+		logger.debug("Could not list {path}: {e}".format(path=path,e=e))
+		return None
+
+def _visit_many(visit, paths):
+	'''Visit a list of directories (one task in the thread pool)'''
+	return [visit(path) for path in paths]
+
+def walk_tree(folder_path, visit, threads=8, batchsize=10000):
+	'''Walk a directory tree level by level, the directories of a level are visited in a thread pool (in batches
+		of batchsize directories, each thread visits a slice of the batch) and yielded in order as soon as
+		they are visited, so the walk is the same for any number of threads. Symbolic links to a directory
+		are followed unless they point to a directory above them in the walk (a loop). The real path of every
+		directory is kept with its ancestors, only linked directories are resolved (realpath) the real path of
+		a plain directory is the real path of its parent and its name, so plain directories cost a single scandir.
+
+	Parameters
+		str 		- path to the directory tree
+		function 	- visit(path) returns (entries, info) or None if the directory can not be read
+		int 		- number of threads
+	------
+	Yields
+		tuple - (directory, entries, info)
+	'''
+	level = [(folder_path,(os.path.realpath(folder_path),))]
+	with ThreadPoolExecutor(max_workers=max(1,threads)) as executor:
+		while level:
+			next_level = []
+			for i in range(0,len(level),batchsize):
+				batch = level[i:i+batchsize]
+				paths = [path for path,parents in batch]
+				if threads > 1:
+					step = max(1,len(batch)//(threads*4))
+					visits = (result for results in executor.map(_visit_many,[visit]*len(range(0,len(batch),step)),[paths[j:j+step] for j in range(0,len(batch),step)]) for result in results)
+				else:
+					visits = map(visit,paths)
+				for (path,parents),result in zip(batch,visits):
+					if result is None:
+						continue
+					entries,info = result
+					yield path,entries,info
+					for entry in entries:
+						if entry[1] == 1:
+							next_level.append((os.path.join(path,entry[0]),parents+(os.path.join(parents[-1],entry[0]),)))
+						elif entry[1] == 2:
+							subdir = os.path.join(path,entry[0])
+							real = os.path.realpath(subdir)
+							if any(parent == real or parent.startswith(real.rstrip("/")+"/") for parent in parents):
+								logger.debug("Symbolic link {path} is a loop, skipped".format(path=subdir))
+								continue
+							next_level.append((subdir,parents+(real,)))
+			level = next_level
+
+class DirectoryManifest(object):
+	"""DirectoryManifest keeps the listing of each directory in a genome directory tree in a sqlite3 file
+		together with the mtime of the directory. The mtime of a directory changes when files or
+		directories are added, removed or renamed in it, so on the next walk only directories with a
+		new mtime are listed again (os.scandir), for all other directories the stored listing is used.
+
+		For each file the size, mtime and a genome name resolved from the file name (match function
+		given to walk) are stored, the genome name is only resolved when a directory is listed.
+		Directories are visited in parallel threads (see walk_tree).
+
+		The header of a file (for example the first sequence id of a genome, see headers) is stored with
+		the size and mtime of the file when its directory was listed, and read again only if these change.
+		A file rewritten in place does not change the mtime of its directory, rescan lists all directories.
+	"""
+	def __init__(self, manifest_file, rescan=False):
+		super(DirectoryManifest, self).__init__()
+		self.manifest_file = manifest_file
+		self.rescan = rescan
+		self.conn = sqlite3.connect(manifest_file)
+		self.conn.execute("PRAGMA synchronous = OFF")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS directories (path text PRIMARY KEY, mtime integer) WITHOUT ROWID")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS entries (directory text, name text, is_dir integer, size integer, mtime integer, genome text, PRIMARY KEY (directory,name)) WITHOUT ROWID")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS headers (directory text, name text, size integer, mtime integer, header text, PRIMARY KEY (directory,name)) WITHOUT ROWID")
+		self.conn.commit()
+		self.scanned = 0
+		self.cached = 0
+
+	def __repr__(self):
+		return "DirectoryManifest({})".format(self.manifest_file)
+
+	def close(self):
+		self.conn.close()
+
+	def _in_tree(self, path, folder_path):
+		'''Check if path is folder_path or a directory below folder_path'''
+		return path == folder_path or path.startswith(folder_path.rstrip("/")+"/")
+
+	def walk(self, folder_path, match=None, threads=8):
+		'''Walk a directory tree (see walk_tree, symbolic links are followed and entries sorted on name), unchanged
+			directories are not listed again
+
+		Parameters
+			str 		- path to the directory tree
+			function 	- function returning the genome name of a file name (or False)
+			int 		- number of threads
+		------
+		Yields
+			tuple - (directory, list of (file name, genome name))
+		'''
+		start = time.time()
+		self.scanned = self.cached = 0
+		directories = dict(self.conn.execute("SELECT path,mtime FROM directories"))
+		listings = {}
+		for directory,name,is_dir,size,mtime,genome in self.conn.execute("SELECT directory,name,is_dir,size,mtime,genome FROM entries ORDER BY directory,name"):
+			listings.setdefault(directory,[]).append((name,is_dir,size,mtime,genome))
+
+		def visit(path):
+			'''Stat a directory and list it if it changed (run in a thread, database updates are made in walk)'''
+			try:
+				mtime = os.stat(path).st_mtime_ns
+				if not self.rescan and directories.get(path) == mtime:
+					return listings.get(path,[]),None
+				return scan_directory(path,match),mtime
+			except OSError as e:
+				logger.debug("Could not list {path}: {e}".format(path=path,e=e))
+				return None
+
+		visited = set()
+		for path,entries,mtime in walk_tree(folder_path,visit,threads):
+			visited.add(path)
+			if mtime is None:
+				self.cached += 1
+			else:
+				self.conn.execute("DELETE FROM entries WHERE directory = ?",(path,))
+				self.conn.executemany("INSERT INTO entries VALUES (?,?,?,?,?,?)",((path,)+entry for entry in entries))
+				self.conn.execute("DELETE FROM headers WHERE directory = ? AND name NOT IN (SELECT name FROM entries WHERE directory = ?)",(path,path))
+				self.conn.execute("INSERT OR REPLACE INTO directories VALUES (?,?)",(path,mtime))
+				self.scanned += 1
+			yield path,[(name,genome) for name,is_dir,size,mtime,genome in entries if not is_dir]
+		### Directories that were removed from the tree
+		removed = [(path,) for path in directories if path not in visited and self._in_tree(path,folder_path)]
+		self.conn.executemany("DELETE FROM entries WHERE directory = ?",removed)
+		self.conn.executemany("DELETE FROM directories WHERE path = ?",removed)
+		self.conn.executemany("DELETE FROM headers WHERE directory = ?",removed)
+		self.conn.commit()
+		logger.info("Genome directory manifest: {cached} directories unchanged, {scanned} listed, {removed} removed ({time:.1f}s)".format(cached=self.cached,scanned=self.scanned,removed=len(removed),time=time.time()-start))
+
+	def headers(self, files, read, threads=8):
+		'''Header of files found by walk, a header is read (in a pool of threads) only if the file is new or its
+			size or mtime changed since the header was stored
+
+		Parameters
+			list 		- (directory, file name) of files yielded by walk
+			function 	- read(path) returns the header of a file
+			int 		- number of threads
+		------
+		Returns
+			list - header of each file (None if the file could not be read)
+		'''
+		start = time.time()
+		stats = {(directory,name): (size,mtime) for directory,name,size,mtime in self.conn.execute("SELECT directory,name,size,mtime FROM entries WHERE is_dir = 0")}
+		known = {(directory,name): (size,mtime,header) for directory,name,size,mtime,header in self.conn.execute("SELECT directory,name,size,mtime,header FROM headers")}
+		headers,changed = [],[]
+		for i,file in enumerate(files):
+			stat = stats.get(file)
+			header = known.get(file)
+			if header and stat and header[:2] == stat:
+				headers.append(header[2])
+			else:
+				headers.append(None)
+				changed.append((i,file,stat))
+
+		def _read(path):
+			'''Read the header of a file (run in a thread)'''
+			try:
+				return read(path)
+			except OSError as e:
+				logger.debug("Could not read {path}: {e}".format(path=path,e=e))
+				return None
+
+		with ThreadPoolExecutor(max_workers=max(1,threads)) as executor:
+			for (i,file,stat),header in zip(changed,executor.map(_read,[os.path.join(*file) for i,file,stat in changed])):
+				headers[i] = header
+		self.conn.executemany("INSERT OR REPLACE INTO headers VALUES (?,?,?,?,?)",(file+stat+(headers[i],) for i,file,stat in changed if stat and headers[i] is not None))
+		self.conn.commit()
+		logger.info("Read headers of {n} new or changed files ({known} unchanged) ({time:.1f}s)".format(n=len(changed),known=len(files)-len(changed),time=time.time()-start))
+		return headers
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3 -c
+
+'''
+Content addressed store of downloaded genome files shared between database builds
+'''
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409  ## ioctl to reflink a file (linux, btrfs/xfs)
+
+def link_file(source, destination):
+	'''Create destination as a hardlink of source, a reflink if hardlinks are not possible, or else a copy
+
+	Returns
+	------
+		str - link, reflink or copy
+	'''
+	try:
+		os.link(source,destination)
+		return "link"
+	except OSError:
+		pass
+	try:
+		import fcntl
+		with open(source,"rb") as src, open(destination,"wb") as dst:
+			fcntl.ioctl(dst.fileno(),FICLONE,src.fileno())
+		return "reflink"
+	except (ImportError,OSError):
+		pass
+	shutil.copyfile(source,destination)
+	return "copy"
+
+def md5_file(path, blocksize=1048576):
+	'''md5 of a file'''
+	md5 = hashlib.md5()
+	with open(path,"rb") as f:
+		for data in iter(lambda: f.read(blocksize),b""):
+			md5.update(data)
+	return md5.hexdigest()
+
+class GenomeCache(object):
+	"""GenomeCache keeps downloaded genome files in a directory shared by database builds. Files are stored
+		once by their md5 (objects/<md5[:2]>/<md5>) and each accession points to the md5 of its file, so
+		genomes with identical files are stored once. A genome in the cache is linked into the genome
+		directory of a build (hardlink, reflink or copy) instead of being downloaded again.
+
+		The total size of the stored files is kept below budget bytes (0 for no limit) by removing the
+		files least recently added or used.
+	"""
+	def __init__(self, cache_dir, budget=0):
+		super(GenomeCache, self).__init__()
+		self.cache_dir = cache_dir.rstrip("/") or "."
+		self.budget = budget
+		os.makedirs(self.cache_dir+"/objects",exist_ok=True)
+		self.conn = sqlite3.connect(self.cache_dir+"/genomes.db")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS objects (md5 text PRIMARY KEY, size integer, used real)")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS genomes (accession text PRIMARY KEY, md5 text, name text)")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS genomes_md5 ON genomes (md5)")
+		self.conn.commit()
+
+	def __repr__(self):
+		return "GenomeCache({})".format(self.cache_dir)
+
+	def close(self):
+		self.conn.close()
+
+	def object_path(self, md5):
+		'''Path to the stored file with md5'''
+		return "{dir}/objects/{prefix}/{md5}".format(dir=self.cache_dir,prefix=md5[:2],md5=md5)
+
+	def add(self, accession, path):
+		'''Store a genome file (linked into the cache if possible)
+
+		Parameters
+			str - accession
+			str - path to genome file
+		------
+		Returns
+			str - md5 of the file
+		'''
+		md5 = md5_file(path)
+		target = self.object_path(md5)
+		if not os.path.exists(target):
+			os.makedirs(os.path.dirname(target),exist_ok=True)
+			link_file(path,target+".tmp")
+			os.replace(target+".tmp",target)
+		self.conn.execute("INSERT OR REPLACE INTO objects VALUES (?,?,?)",(md5,os.path.getsize(target),time.time()))
+		self.conn.execute("INSERT OR REPLACE INTO genomes VALUES (?,?,?)",(accession,md5,os.path.basename(path)))
+		return md5
+
+	def add_genomes(self, genome_path):
+		'''Store genome files
+
+		Parameters
+			dict - accession: path to genome file (directories are skipped)
+		------
+		Returns
+			int - number of genomes stored
+		'''
+		added = 0
+		for accession,path in genome_path.items():
+			if os.path.isfile(path):
+				self.add(accession,path)
+				added += 1
+		self.conn.commit()
+		logger.info("Added {n} genomes to the genome cache {dir}".format(n=added,dir=self.cache_dir))
+		return added
+
+	def restore(self, missing):
+		'''Link genomes in the cache into their download directory
+
+		Parameters
+			list - list of dictionaries with genome_id and outdir (see ProcessDirectory.process_folder)
+		------
+		Returns
+			dict - accession: path to genome file for genomes in the cache
+			list - genomes not in the cache
+		'''
+		restored,still_missing = {},[]
+		methods = {}
+		now = time.time()
+		for gen in missing:
+			accession = gen["genome_id"].strip()
+			row = self.conn.execute("SELECT md5,name FROM genomes WHERE accession = ?",(accession,)).fetchone()
+			if not row or not os.path.exists(self.object_path(row[0])):
+				still_missing.append(gen)
+				continue
+			md5,name = row
+			outdir = "/".join([gen["outdir"],accession])
+			path = "/".join([outdir,name])
+			os.makedirs(outdir,exist_ok=True)
+			if os.path.exists(path):
+				os.remove(path)
+			method = link_file(self.object_path(md5),path)
+			methods[method] = methods.get(method,0)+1
+			self.conn.execute("UPDATE objects SET used = ? WHERE md5 = ?",(now,md5))
+			restored[accession] = path
+		self.conn.commit()
+		logger.info("Genome cache: {n} genomes restored ({methods}), {m} not in cache".format(n=len(restored),m=len(still_missing),methods=", ".join("{} {}".format(n,method) for method,n in sorted(methods.items())) or "none"))
+		return restored,still_missing
+
+	def evict(self):
+		'''Remove the least recently used files until the cache is within budget
+
+		Returns
+		------
+			int - number of files removed
+		'''
+		if not self.budget:
+			return 0
+		total = self.conn.execute("SELECT COALESCE(SUM(size),0) FROM objects").fetchone()[0]
+		removed = 0
+		for md5,size in self.conn.execute("SELECT md5,size FROM objects ORDER BY used").fetchall():
+			if total <= self.budget:
+				break
+			if os.path.exists(self.object_path(md5)):
+				os.remove(self.object_path(md5))
+			self.conn.execute("DELETE FROM objects WHERE md5 = ?",(md5,))
+			self.conn.execute("DELETE FROM genomes WHERE md5 = ?",(md5,))
+			total -= size
+			removed += 1
+		self.conn.commit()
+		if removed:
+			logger.info("Genome cache: removed {n} least recently used files ({size:.1f} MB in cache)".format(n=removed,size=total/2**20))
+		return removed
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3 -c
+
+'''
+Compact in-memory representation of the taxonomy tree (nodes and tree tables)
+'''
+
+from array import array
+import logging
+logger = logging.getLogger(__name__)
+
+def node_index(ids):
+	'''Node id to node index of a sorted array of node ids, a flat array is used when ids are reasonably
+		dense otherwise a dictionary
+
+	Returns
+	------
+		array/dict - node index of each node id, -1 (array) or missing (dict) if the id does not exist
+	'''
+	n = len(ids)
+	max_id = ids[-1] if n > 0 else 0
+	if n == 0 or (ids[0] >= 0 and max_id <= 4*n + 1000000):
+		index = array("i", [-1]) * (max_id+1)
+	else:
+		index = {}
+	for i,id in enumerate(ids):
+		index[id] = i
+	return index
+
+class TaxonomyGraph(object):
+	"""TaxonomyGraph loads the nodes and tree tables of a database once into parallel integer arrays
+		instead of dictionaries and sets of tuples, all traversals are linear in the size of the tree
+
+		ids 		- node id of each node index (sorted)
+		parent 		- node index of the parent of each node (root is its own parent, -1 no parent)
+		parent_link - link number of the link to the parent of each node
+		link_parent, link_child, link_rank - links (node indexes) ordered by parent, link_rank is -1 for links without rank
+		offsets 	- CSR offsets, the links from node index i are links offsets[i] to offsets[i+1]
+
+		Nodes with more than one parent keep the first parent in the parent array, the other links are
+		kept in extra_links. Links to or from ids missing in the nodes table are kept in missing_links.
+	"""
+	def __init__(self, database, chunksize=100000):
+		super(TaxonomyGraph, self).__init__()
+		self.database = database
+		self.chunksize = chunksize
+		self.load()
+
+	def __repr__(self):
+		return "TaxonomyGraph()"
+
+	def __len__(self):
+		return len(self.ids)
+
+	def load(self):
+		'''Load nodes and links from the database'''
+		logger.info("Load taxonomy graph")
+		ids = array("q", (node[0] for node in self.database.stream("SELECT id FROM nodes ORDER BY id",self.chunksize)))
+		n = len(ids)
+		max_id = ids[-1] if n > 0 else 0
+		self.ids = array("i" if max_id < 2**31 else "q", ids)
+		del ids
+		index = self.index = node_index(self.ids)
+		self.link_parent = array("i")
+		self.link_child = array("i")
+		self.link_rank = array("i")
+		self.parent = array("i", [-1]) * n
+		self.parent_link = array("i", [-1]) * n
+		self.extra_links = {}
+		self.missing_links = []
+		counts = array("i", [0]) * (n+1)
+		link_parent,link_child,link_rank = self.link_parent.append,self.link_child.append,self.link_rank.append
+		parent_array,parent_link = self.parent,self.parent_link
+		link = 0
+		### Links are read in parent order (tree unique index), the links of each parent are consecutive
+		for parent,child,rank_i in self.database.stream("SELECT parent,child,rank_i FROM tree ORDER BY parent,child",self.chunksize):
+			try:
+				p,c = index[parent],index[child]
+			except (IndexError, KeyError, TypeError):
+				p = c = -1
+			if p < 0 or c < 0 or parent < 0 or child < 0:
+				self.missing_links.append((parent,child,rank_i))
+				continue
+			link_parent(p)
+			link_child(c)
+			link_rank(-1 if rank_i is None else rank_i)
+			counts[p+1] += 1
+			if parent_array[c] < 0:
+				parent_array[c] = p
+				parent_link[c] = link
+			else:
+				self.extra_links.setdefault(c,[]).append(link)
+			link += 1
+		for i in range(n):
+			counts[i+1] += counts[i]
+		self.offsets = counts
+		logger.info("Taxonomy graph loaded, nodes: {n} links: {l}".format(n=n,l=len(self.link_child)+len(self.missing_links)))
+		return self
+
+	def get_index(self, id):
+		'''Node index of a node id
+
+		Returns
+		------
+			int - node index, -1 if the node does not exist
+		'''
+		id = int(id)
+		if id < 0:
+			return -1
+		try:
+			return self.index[id]
+		except (IndexError, KeyError):
+			return -1
+
+	def get_nodes(self):
+		'''Returns
+		------
+			set - all node ids
+		'''
+		return set(self.ids)
+
+	def _link(self, link):
+		'''Link number as (parent, child, rank_i)'''
+		rank_i = self.link_rank[link]
+		return (self.ids[self.link_parent[link]],self.ids[self.link_child[link]],rank_i if rank_i >= 0 else None)
+
+	def _parent_links(self, i):
+		'''All link numbers with node index i as child (more than one if the node has multiple parents)'''
+		if self.parent_link[i] < 0:
+			return []
+		return [self.parent_link[i]] + self.extra_links.get(i,[])
+
+	def get_links(self, nodes=False, only_parents=False):
+		'''Links in the tree, if nodes are given only links where parent or child (only_parents; child) is in nodes
+
+		Returns
+		------
+			list - list of links (parent, child, rank_i)
+		'''
+		if not nodes:
+			return [self._link(link) for link in range(len(self.link_child))] + self.missing_links
+		nodes = set(nodes)
+		selected = set()
+		for node in nodes:
+			i = self.get_index(node)
+			if i < 0:
+				continue
+			selected.update(self._parent_links(i))
+			if not only_parents:
+				selected.update(range(self.offsets[i],self.offsets[i+1]))
+		return [self._link(link) for link in sorted(selected)] + [link for link in self.missing_links if link[1] in nodes or (not only_parents and link[0] in nodes)]
+
+	def get_children(self, parents, maxdepth=None):
+		'''Get all children from a set of parents (breadth first), maxdepth limits the number of levels below
+			the direct children of parents (same as ModifyFunctions.get_children)
+
+		Returns
+		------
+			set - unique list of children from a decending tree
+		'''
+		visited = bytearray(len(self.ids))
+		frontier = [i for i in map(self.get_index, parents) if i >= 0]
+		level = 0
+		while frontier and (maxdepth is None or level <= maxdepth):
+			next_frontier = []
+			for i in frontier:
+				for c in self.link_child[self.offsets[i]:self.offsets[i+1]]:
+					if not visited[c]:
+						visited[c] = 1
+						next_frontier.append(c)
+			frontier = next_frontier
+			level += 1
+		return self._marked(visited)
+
+	def get_parents(self, nodes):
+		'''Get all parents until root of a set of nodes
+
+		Returns
+		------
+			set - all parents of the nodes
+		'''
+		visited = bytearray(len(self.ids))
+		for node in nodes:
+			i = self.get_index(node)
+			if i < 0:
+				continue
+			stack = [self.link_parent[link] for link in self._parent_links(i)]
+			while stack:
+				p = stack.pop()
+				if visited[p]:
+					continue
+				visited[p] = 1
+				stack.extend(self.link_parent[link] for link in self._parent_links(p))
+		return self._marked(visited)
+
+	def _marked(self, visited):
+		'''Node ids of all marked node indexes'''
+		ids = self.ids
+		return set(ids[i] for i in range(len(visited)) if visited[i])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3 -c
+
+'''
+Single pass validation of the taxonomy tree (nodes and tree tables)
+'''
+
+from array import array
+from .TaxonomyGraph import node_index
+import logging
+logger = logging.getLogger(__name__)
+
+UNKNOWN,ON_PATH,REACHABLE,UNREACHABLE = 0,1,2,3
+
+class TreeValidator(object):
+	"""TreeValidator streams the nodes and the tree table once and builds a child to parent array, all checks
+		are then made on the parent array in linear time
+
+		1. All nodes must only have one parent (multiple_parents)
+		2. All nodes from links must have a node description (missing_nodes)
+		3. The tree must not contain cycles, except the root link to itself (cycles)
+		4. All nodes must be attatched to the tree under root (unreachable_nodes)
+		5. All edges must be attatched to the tree under root (orphan_links)
+	"""
+	def __init__(self, database, root=1, chunksize=100000, samples=10):
+		super(TreeValidator, self).__init__()
+		self.database = database
+		self.root = root
+		self.chunksize = chunksize
+		self.samples = samples
+
+	def __repr__(self):
+		return "TreeValidator()"
+
+	def _sample(self, report, key, value):
+		'''Count an offender and keep the first few as sample'''
+		report[key] += 1
+		if len(report["samples"][key]) < self.samples:
+			report["samples"][key].append(value)
+
+	def validate(self):
+		'''Validate the tree
+
+		------
+		Returns
+			dict - report with the number of nodes and links, counts for each check and a sample of offenders
+		'''
+		checks = ["multiple_parents","missing_nodes","cycles","unreachable_nodes","orphan_links"]
+		report = {"nodes": 0, "links": 0, "root": False}
+		report.update({check: 0 for check in checks})
+		report["samples"] = {check: [] for check in checks}
+
+		logger.info("Validate: read nodes")
+		ids = array("q", (node[0] for node in self.database.stream("SELECT id FROM nodes ORDER BY id",self.chunksize)))
+		index = node_index(ids)
+		n = report["nodes"] = len(ids)
+		parent = array("i", [-1]) * n
+		extra_links = []
+
+		logger.info("Validate: read links")
+		for p_id,c_id,rank_i in self.database.stream("SELECT parent,child,rank_i FROM tree",self.chunksize):
+			report["links"] += 1
+			try:
+				p,c = index[p_id],index[c_id]
+			except (IndexError, KeyError, TypeError):
+				p = c = -1
+			if p < 0 or c < 0 or p_id < 0 or c_id < 0:
+				self._sample(report,"missing_nodes",(p_id,c_id))
+				continue
+			if parent[c] < 0:
+				parent[c] = p
+			else:
+				self._sample(report,"multiple_parents",c_id)
+				extra_links.append((p,c))
+
+		try:
+			root = index[self.root]
+		except (IndexError, KeyError):
+			root = -1
+		report["root"] = root >= 0
+
+		logger.info("Validate: walk parents")
+		state = bytearray(n)
+		for i in range(n):
+			if state[i]:
+				continue
+			path = []
+			j = i
+			while True:
+				if state[j] == ON_PATH:
+					self._sample(report,"cycles",[ids[k] for k in path[path.index(j):]])
+					result = UNREACHABLE
+					break
+				if state[j]:
+					result = state[j]
+					break
+				state[j] = ON_PATH
+				path.append(j)
+				if j == root:
+					result = REACHABLE
+					break
+				j = parent[j]
+				if j < 0:
+					result = UNREACHABLE
+					break
+			for k in path:
+				state[k] = result
+
+		for i in range(n):
+			if state[i] != REACHABLE:
+				self._sample(report,"unreachable_nodes",ids[i])
+				if parent[i] >= 0:
+					self._sample(report,"orphan_links",(ids[parent[i]],ids[i]))
+		for p,c in extra_links:
+			if state[p] != REACHABLE:
+				self._sample(report,"orphan_links",(ids[p],ids[c]))
+		return report
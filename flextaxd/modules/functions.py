@@ -2,6 +2,8 @@ from subprocess import check_call,CalledProcessError,TimeoutExpired,STDOUT
 from subprocess import Popen,STDOUT,PIPE,CalledProcessError,TimeoutExpired
 from textwrap import wrap
 from os import makedirs,path,walk
+import os
+import shutil
 import glob
 import logging
 from time import sleep
@@ -82,7 +84,8 @@ def check_taxonomic_group(accession,section=False,force=False):
 	return False,False
 
 def get_genome(accession,force=False):
-	'''Return taxonomic group of accession
+	'''Return taxonomic group of accession by asking ncbi-genome-download for each taxonomic group
+		(genomes in an assembly summary are resolved with AssemblySummary, see DownloadGenomes.download_native)
 
 	Parameters
 		str accession
@@ -99,7 +102,7 @@ def ncbi_genome_download(genome,outdir="./downloads"):
 	Parameters
 		dict - accession group and section
 	Returns
-		boolean - True if downloaded, else False
+		str - path to the downloaded genomic fasta file, False if not downloaded
 	'''
 	accession = genome["accession"]
 	group = genome["group"]
@@ -119,21 +122,76 @@ def ncbi_genome_download(genome,outdir="./downloads"):
 	e = run(cmd,accession)
 	if not e:
 		logger.debug(cmd)
-		return outdir
+		'''--flat-output puts the file directly in outdir ({assembly}_genomic.fna.gz), cds and rna files are not genomes'''
+		files = [f for f in sorted(glob.glob("{outdir}/*_genomic.fna*".format(outdir=outdir))) if "_from_genomic" not in f]
+		if files:
+			return files[0]
+		logger.debug("No genomic fasta file in {outdir}".format(outdir=outdir))
 	else:
 		logger.debug(cmd)
 		logger.debug(e)
 	return False
 
-def download_genomes(genomes,added,filepath,missing,force=False):
+def download_genomes(genomes,added,missing,force=False):
+	'''Download genomes with ncbi-genome-download, (accession, file path) of each downloaded genome is put in added'''
 	for gen_i in genomes:
 		if gen_i:
 			outdir = gen_i["outdir"]
 			genome = get_genome(gen_i["genome_id"],force)
 			if genome["accession"].startswith("GCF") or genome["accession"].startswith("GCA"):
-				outdir = ncbi_genome_download(genome,outdir)
-				if outdir:
-					added.put(genome["accession"].strip())
-					filepath.put(outdir)
+				filepath = ncbi_genome_download(genome,outdir)
+				if filepath:
+					added.put((genome["accession"].strip(),filepath))
 				else:
 					missing.put(genome["accession"].strip())
+
+def concatenate_files(sources,destination,remove=False):
+	'''Concatenate files into destination, data is copied by the kernel (copy_file_range, or sendfile)
+		instead of being read into python, if neither is available the files are copied with shutil
+
+	Parameters
+		list sources - files to concatenate in order
+		str destination - output file (overwritten)
+		boolean remove - remove source files when copied
+	Returns
+		int - number of bytes written
+	'''
+	written = 0
+	with open(destination,"wb") as out:
+		for source in sources:
+			with open(source,"rb") as f:
+				size = os.fstat(f.fileno()).st_size
+				start = os.lseek(out.fileno(),0,os.SEEK_CUR)
+				for copy in (_copy_file_range,_sendfile):
+					try:
+						copy(f,out,os.lseek(out.fileno(),0,os.SEEK_CUR)-start,size)
+						break
+					except (AttributeError,OSError):
+						continue
+				offset = os.lseek(out.fileno(),0,os.SEEK_CUR)-start
+				if offset < size:
+					f.seek(offset)
+					shutil.copyfileobj(f,out,1048576)
+					out.flush()
+				written += size
+			if remove:
+				os.remove(source)
+	return written
+
+def _copy_file_range(f,out,offset,size):
+	'''Copy bytes offset to size of f to the end of out with copy_file_range (linux, python 3.8+)'''
+	while offset < size:
+		n = os.copy_file_range(f.fileno(),out.fileno(),size-offset,offset)
+		if n == 0:
+			break
+		offset += n
+	return offset
+
+def _sendfile(f,out,offset,size):
+	'''Copy bytes offset to size of f to the end of out with sendfile'''
+	while offset < size:
+		n = os.sendfile(out.fileno(),f.fileno(),offset,size-offset)
+		if n == 0:
+			break
+		offset += n
+	return offset
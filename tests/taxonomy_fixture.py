@@ -0,0 +1,31 @@
+#!/usr/bin/env python3 -c
+
+'''
+Small taxonomy database shared by the database tests
+
+	root (1) -+- A (2) -+- C (4) --- E (6) --- F (7)
+	          |         +- D (5)
+	          +- B (3)
+'''
+
+from flextaxd.modules.database.DatabaseConnection import ModifyFunctions
+
+NODES = [(1,"root"),(2,"A"),(3,"B"),(4,"C"),(5,"D"),(6,"E"),(7,"F")]
+RANKS = [(0,"no rank"),(1,"phylum"),(2,"genus")]
+LINKS = [(1,1,0),(1,2,0),(1,3,1),(2,4,1),(2,5,None),(4,6,2),(6,7,2)]  ## Rank 0 is a rank, None no rank
+GENOMES = [("GCF_000000001.1",5),("GCF_000000002.1",7),("GCF_000000003.1",3)]
+
+def create_taxonomy(path):
+	'''Create the fixture database at path
+
+	Returns
+	------
+		ModifyFunctions - connection to the database
+	'''
+	database = ModifyFunctions(path)
+	database.conn.executemany("INSERT INTO nodes(id,name) VALUES (?,?)",NODES)
+	database.conn.executemany("INSERT INTO rank(rank_i,rank) VALUES (?,?)",RANKS)
+	database.conn.executemany("INSERT INTO tree(parent,child,rank_i) VALUES (?,?,?)",LINKS)
+	database.conn.executemany("INSERT INTO genomes(genome,id) VALUES (?,?)",GENOMES)
+	database.commit()
+	return database
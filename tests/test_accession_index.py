@@ -0,0 +1,70 @@
+#!/usr/bin/env python3 -c
+
+'''
+AccessionIndex keeps the rows of each accession2taxid source separately
+'''
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from flextaxd.modules.database.AccessionIndex import AccessionIndex,default_index
+
+HEADER = "accession\taccession.version\ttaxid\tgi\n"
+
+class TestAccessionIndex(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.first = os.path.join(self.tmp.name,"first.accession2taxid")
+		self.second = os.path.join(self.tmp.name,"second.accession2taxid")
+		with open(self.first,"w") as f:
+			f.write(HEADER+"A\tA.1\t10\t1\nS\tS.1\t11\t2\n")
+		with open(self.second,"w") as f:
+			f.write(HEADER+"S\tS.1\t99\t3\nB\tB.1\t12\t4\n")
+		self.index = AccessionIndex(os.path.join(self.tmp.name,"index.idx"))
+
+	def tearDown(self):
+		self.index.close()
+		self.tmp.cleanup()
+
+	def test_shared_accession_survives_refresh(self):
+		'''Refreshing one source must not remove an accession that is also in another source'''
+		self.assertEqual(self.index.refresh(self.first),2)
+		self.assertEqual(self.index.refresh(self.second),2)
+		with open(self.first,"a") as f:
+			f.write("C\tC.1\t13\t5\n")
+		stat = os.stat(self.first)
+		os.utime(self.first,(stat.st_atime,stat.st_mtime+10))
+		self.assertEqual(self.index.refresh(self.first),3)
+		self.assertEqual(self.index.refresh(self.second),2)
+		self.assertEqual(self.index.lookup(["A.1","S.1","B.1","C.1"]),{"A.1": 10, "S.1": 11, "B.1": 12, "C.1": 13})
+
+	def test_refresh_writes_changed_rows(self):
+		'''A changed source is read again, only added, removed and changed rows are written'''
+		with open(self.first,"w") as f:
+			f.write(HEADER+"".join("X{i}\tX{i}.1\t{i}\t{i}\n".format(i=i) for i in range(100)))
+		self.assertEqual(self.index.refresh(self.first),100)
+		self.assertEqual(self.index.updated,100)
+		with open(self.first,"w") as f:
+			f.write(HEADER+"".join("X{i}\tX{i}.1\t{taxid}\t{i}\n".format(i=i,taxid=i if i != 5 else 500) for i in range(1,101)))
+		stat = os.stat(self.first)
+		os.utime(self.first,(stat.st_atime,stat.st_mtime+10))
+		self.assertEqual(self.index.refresh(self.first),100)
+		self.assertEqual(self.index.updated,4)  ## X0 removed, X100 added, X5 removed and added
+		self.assertEqual(self.index.lookup(["X0.1","X5.1","X6.1","X100.1"]),{"X5.1": 500, "X6.1": 6, "X100.1": 100})
+
+	def test_default_index(self):
+		'''The index is kept next to the database, or in the temp directory if that is not writable'''
+		database = os.path.join(self.tmp.name,"taxonomy.db")
+		self.assertEqual(default_index(database),database+".accession2taxid.idx")
+		with mock.patch("os.access",return_value=False):
+			with self.assertLogs("flextaxd.modules.database.AccessionIndex","WARNING"):
+				self.assertEqual(default_index(database),os.path.join(tempfile.gettempdir(),"taxonomy.db.accession2taxid.idx"))
+
+	def test_first_source_wins_in_any_refresh_order(self):
+		self.index.refresh(self.second)
+		self.index.refresh(self.first)
+		self.assertEqual(self.index.lookup(["S.1"]),{"S.1": 99})
+
+if __name__ == '__main__':
+	unittest.main()
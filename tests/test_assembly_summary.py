@@ -0,0 +1,52 @@
+#!/usr/bin/env python3 -c
+
+'''
+AssemblySummary on assembly_summary files in the NCBI column layout (tests/data/assembly_summary)
+'''
+
+import os
+import tempfile
+import unittest
+from flextaxd.modules.AssemblySummary import AssemblySummary
+
+SUMMARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),"data","assembly_summary")
+ECOLI_FTP = "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/005/845/GCF_000005845.2_ASM584v2"
+
+class TestAssemblySummary(unittest.TestCase):
+	def test_group_column(self):
+		'''assembly_summary_refseq.txt has the header with a group column'''
+		summary = AssemblySummary(SUMMARY_DIR,download=False)
+		self.assertEqual(summary.resolve("GCF_000005845.2\n"),("bacteria","refseq",ECOLI_FTP))
+		self.assertEqual(summary.resolve("GCF_000001405.40")[0],"vertebrate_mammalian")
+		self.assertEqual(summary.resolve("GCF_999999999.1"),(False,False,False))
+
+	def test_group_file(self):
+		'''Without a group column the group is taken from assembly_summary_{section}_{group}.txt'''
+		summary = AssemblySummary(SUMMARY_DIR,download=False)
+		self.assertEqual(summary.resolve("GCA_000864765.1"),("viral","genbank","https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/000/864/765/GCA_000864765.1_ViralProj15476"))
+		'''assembly_summary_genbank.txt has no group column and is skipped'''
+		self.assertEqual(summary.resolve("GCA_000005845.2"),(False,False,False))
+		self.assertEqual(set(summary.index["genbank"]),{"GCA_000864765.1"})
+
+	def test_accessions(self):
+		'''Only listed accessions are kept'''
+		summary = AssemblySummary(SUMMARY_DIR,accessions=["GCF_000009045.1\n"],download=False)
+		self.assertEqual(summary.resolve("GCF_000009045.1")[:2],("bacteria","refseq"))
+		self.assertEqual(list(summary.index["refseq"]),["GCF_000009045.1"])
+		self.assertEqual(summary.resolve("GCF_000005845.2"),(False,False,False))
+
+	def test_force(self):
+		'''An accession missing from the section is looked up in the other section with force'''
+		summary = AssemblySummary(SUMMARY_DIR,download=False)
+		self.assertEqual(summary.resolve("GCF_000864765.1"),(False,False,False))
+		self.assertEqual(summary.resolve("GCF_000864765.1",section="genbank",force=True),(False,False,False))
+		self.assertEqual(summary.resolve("GCF_000005845.2",section="genbank",force=True),("bacteria","refseq",ECOLI_FTP))
+
+	def test_no_summary(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			summary = AssemblySummary(tmp,download=False)
+			self.assertFalse(summary.summary_file("refseq"))
+			self.assertEqual(summary.resolve("GCF_000005845.2"),(False,False,False))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3 -c
+
+'''
+Bulk inserts of DatabaseConnection add the same rows as inserts of one row at a time
+'''
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from taxonomy_fixture import create_taxonomy,LINKS
+from flextaxd.modules.database.DatabaseConnection import DatabaseConnection,ConnectionError
+from flextaxd.modules.ModifyTree import ModifyTree
+
+class TestBulkInsert(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name,"taxonomy.db")
+		self.database = create_taxonomy(self.path)
+		self.reference = create_taxonomy(os.path.join(self.tmp.name,"reference.db"))
+
+	def tearDown(self):
+		self.database.conn.close()
+		self.reference.conn.close()
+		self.tmp.cleanup()
+
+	def table(self, database, query):
+		return database.query(query).fetchall()
+
+	def test_insert_many(self):
+		'''Rows violating a UNIQUE constraint, in the table or repeated in rows, are ignored and not counted'''
+		rows = [(1,2,0),(3,8,2),(4,9,1),(3,8,1),(2,5,1)]
+		self.assertEqual(self.database.insert_many(rows,"tree",("parent","child","rank_i"),chunksize=2),2)
+		added = sum(1 for parent,child,rank in rows if "UNIQUE constraint failed" not in str(self.reference.add_link(child,parent,rank)))
+		self.assertEqual(added,2)
+		query = "SELECT parent,child,rank_i FROM tree ORDER BY rowid"
+		self.assertEqual(self.table(self.database,query),self.table(self.reference,query))
+
+	def test_add_nodes(self):
+		'''Node names are not unique, every node except empty descriptions is added and counted'''
+		nodes = ["A","X","X"," ","Y"]
+		self.assertEqual(self.database.add_nodes(nodes,chunksize=2),4)
+		self.assertEqual([self.reference.add_node(node) for node in nodes],[8,9,10,False,11])
+		self.assertEqual(self.table(self.database,"SELECT id,name FROM nodes"),self.table(self.reference,"SELECT id,name FROM nodes"))
+
+	def test_add_links(self):
+		'''Links already in the tree are not added, of a repeated link the first is added'''
+		links = [(1,2,0),(3,8,2),(4,9,1),(3,8,1),(2,5,1),(8,10,None)]
+		added,nodes = self.database.add_links(links,chunksize=2)
+		self.assertEqual(added,[(3,8,2),(4,9,1),(8,10,None)])
+		self.assertEqual(nodes,{3,4,8,9,10})
+		for parent,child,rank in links:
+			self.reference.add_link(child,parent,rank)
+		query = "SELECT parent,child,rank_i FROM tree ORDER BY rowid"
+		self.assertEqual(self.table(self.database,query),self.table(self.reference,query))
+		self.assertEqual(self.table(self.database,query),LINKS+added)
+
+	def test_update_database(self):
+		'''Links are added in ModifyTree.update_database, the database is vacuumed without errors afterwards'''
+		self.database.conn.close()
+		modfile = os.path.join(self.tmp.name,"mod.txt")
+		with open(modfile,"w") as f:
+			f.write("parent\tchild\trank\nC\tG\tgenus\nA\tD\tphylum\n")
+		modify = ModifyTree(database=self.path,mod_file=modfile,parent="A")
+		self.database = modify.taxonomydb
+		with self.assertNoLogs("flextaxd.modules.database.DatabaseConnection","WARNING"):
+			modify.update_database()
+		self.assertFalse(self.database.conn.in_transaction)
+		links = self.table(self.database,"SELECT parent,child FROM tree ORDER BY rowid")
+		self.assertEqual(links,[(parent,child) for parent,child,rank in LINKS]+[(4,self.database.get_id("G"))])
+
+class NoJSON(object):
+	'''sqlite3 connection of a sqlite build without the JSON1 functions'''
+	def __init__(self, conn):
+		self.conn = conn
+	def execute(self, query, *args):
+		if "json_each" in query:
+			raise sqlite3.OperationalError("no such table: json_each")
+		return self.conn.execute(query, *args)
+	def close(self):
+		self.conn.close()
+
+class TestTreeQueries(unittest.TestCase):
+	'''Links, children and parents of the fixture taxonomy, the root (1) is linked to itself'''
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name,"taxonomy.db")
+		self.database = create_taxonomy(self.path)
+
+	def tearDown(self):
+		self.database.conn.close()
+		self.tmp.cleanup()
+
+	def test_get_children(self):
+		'''maxdepth is the number of levels below the direct children that are included'''
+		self.assertEqual(self.database.get_children([2],maxdepth=0),{4,5})
+		self.assertEqual(self.database.get_children([2],maxdepth=1),{4,5,6})
+		self.assertEqual(self.database.get_children([2],maxdepth=2),{4,5,6,7})
+		self.assertEqual(self.database.get_children([2]),{4,5,6,7})
+		self.assertEqual(self.database.get_children({4,3}),{6,7})
+		self.assertEqual(self.database.get_children([7]),set())
+		self.assertEqual(self.database.get_children([1],maxdepth=0),{1,2,3})
+		self.assertEqual(self.database.get_children([1]),{1,2,3,4,5,6,7})
+
+	def test_get_parents(self):
+		self.assertEqual(self.database.get_parents([7],find_all=True),{1,2,4,6})
+		self.assertEqual(self.database.get_parents(7),{1,2,4,6})
+		self.assertEqual(self.database.get_parents({5,3},find_all=True),{1,2})
+		self.assertEqual(self.database.get_parents([1],find_all=True),{1})
+
+	def test_get_links(self):
+		self.assertEqual(self.database.get_links(),LINKS)
+		self.assertEqual(self.database.get_links([1]),[(1,1,0),(1,2,0),(1,3,1)])
+		self.assertEqual(self.database.get_links([1],only_parents=True),[(1,1,0)])
+		self.assertEqual(self.database.get_links({5,7},only_parents=True),[(2,5,None),(6,7,2)])
+		self.assertEqual(sorted(self.database.get_links([4],swap=True)),[(4,2,1),(6,4,2)])
+
+	def test_json_required(self):
+		'''A sqlite build without json_each gives a clear error when the database is opened'''
+		connect = sqlite3.connect
+		with mock.patch("sqlite3.connect",lambda *args,**kwargs: NoJSON(connect(*args,**kwargs))):
+			with self.assertRaisesRegex(ConnectionError,"JSON1"):
+				DatabaseConnection(self.path)
+
+if __name__ == '__main__':
+	unittest.main()
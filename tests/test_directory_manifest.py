@@ -0,0 +1,120 @@
+#!/usr/bin/env python3 -c
+
+'''
+DirectoryManifest keeps headers of genome files and reads them again only for new or changed files
+'''
+
+import os
+import gzip
+import tempfile
+import unittest
+from flextaxd.modules.database.DirectoryManifest import DirectoryManifest,walk_tree,visit_directory
+from flextaxd.modules.ReadTaxonomyNCBI import ReadTaxonomyNCBI
+from flextaxd.modules.ProcessDirectory import ProcessDirectory
+from taxonomy_fixture import create_taxonomy
+
+def write_genome(path, header):
+	with gzip.open(path,"wb") as f:
+		f.write(b">"+header+b" description\nACGT\n")
+
+class TestDirectoryManifest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.genomes = os.path.join(self.tmp.name,"genomes")
+		for group in ("a","b"):
+			os.makedirs(os.path.join(self.genomes,group))
+		for i in range(4):
+			write_genome(os.path.join(self.genomes,"ab"[i%2],"GCF_00000000{i}.1_ASM{i}v1_genomic.fna.gz".format(i=i)),"NZ_{i}.1".format(i=i).encode())
+		self.read = []
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def scan(self):
+		'''Scan genomes as ReadTaxonomyNCBI, headers read are kept in self.read'''
+		reader = ReadTaxonomyNCBI.__new__(ReadTaxonomyNCBI)
+		read_header = reader.read_header
+		def read(path):
+			self.read.append(os.path.basename(path))
+			return read_header(path)
+		reader.read_header = read
+		manifest = DirectoryManifest(os.path.join(self.tmp.name,"genomes.manifest"))
+		try:
+			return reader.scan_genomes(self.genomes,manifest,threads=2),manifest.scanned
+		finally:
+			manifest.close()
+
+	def test_unchanged_genomes_are_not_read(self):
+		genomes,scanned = self.scan()
+		self.assertEqual(genomes,{"NZ_{i}.1".format(i=i): "GCF_00000000{i}.1".format(i=i) for i in range(4)})
+		self.assertEqual((len(self.read),scanned),(4,3))
+		self.read = []
+		self.assertEqual(self.scan(),(genomes,0))
+		self.assertEqual(self.read,[])
+
+	def test_changed_directory(self):
+		self.scan()
+		self.read = []
+		os.remove(os.path.join(self.genomes,"b","GCF_000000001.1_ASM1v1_genomic.fna.gz"))
+		write_genome(os.path.join(self.genomes,"a","GCF_000000009.1_ASM9v1_genomic.fna.gz"),b"NZ_9.1")
+		genomes,scanned = self.scan()
+		self.assertEqual(sorted(genomes),["NZ_0.1","NZ_2.1","NZ_3.1","NZ_9.1"])
+		self.assertEqual((self.read,scanned),(["GCF_000000009.1_ASM9v1_genomic.fna.gz"],2))
+
+	def process_directory(self):
+		'''Walk the genomes as create_databases, with the same manifest as the header scan'''
+		database = os.path.join(self.tmp.name,"taxonomy.db")
+		if not os.path.exists(database):
+			create_taxonomy(database).conn.close()
+		process = ProcessDirectory(database,manifest=os.path.join(self.tmp.name,"genomes.manifest"))
+		files,genomes = process.walk_directory(self.genomes)
+		process.database.conn.close()
+		return sorted(genomes)
+
+	def test_shared_manifest(self):
+		'''Directories listed by the header scan keep the genome names used by ProcessDirectory, and the other way around'''
+		annotated = ["GCF_000000001.1","GCF_000000002.1","GCF_000000003.1"]
+		self.scan()
+		self.assertEqual(self.process_directory(),annotated)
+		manifest = DirectoryManifest(os.path.join(self.tmp.name,"genomes.manifest"))
+		self.assertEqual(sorted(genome for genome, in manifest.conn.execute("SELECT genome FROM entries WHERE is_dir = 0")),["GCF_00000000{i}.1".format(i=i) for i in range(4)])
+		manifest.close()
+		write_genome(os.path.join(self.genomes,"b","GCF_000000005.1_ASM5v1_genomic.fna.gz"),b"NZ_5.1")
+		self.assertEqual(self.process_directory(),annotated)
+		self.read = []
+		genomes,scanned = self.scan()
+		self.assertEqual((self.read,scanned),(["GCF_000000005.1_ASM5v1_genomic.fna.gz"],0))
+		self.assertEqual(genomes["NZ_5.1"],"GCF_000000005.1")
+
+	def test_from_genomic_not_counted(self):
+		'''cds and rna files (*_from_genomic.fna) are skipped and not counted as processed genomes'''
+		process = ProcessDirectory.__new__(ProcessDirectory)
+		self.assertFalse(process.process_file("GCF_000000001.1_ASM1v1_cds_from_genomic.fna.gz","GCF_000000001.1_ASM1v1_cds_from_genomic.fna",self.genomes))
+
+class TestWalkTree(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.root = os.path.join(self.tmp.name,"root")
+		os.makedirs(os.path.join(self.root,"a","b"))
+		os.makedirs(os.path.join(self.root,"c"))
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def walk(self):
+		return [os.path.relpath(path,self.root) for path,entries,info in walk_tree(self.root,visit_directory,threads=2)]
+
+	def test_link_to_ancestor(self):
+		'''A symbolic link to a plain directory above it is a loop and is not walked'''
+		os.symlink(os.path.join(self.root,"a"),os.path.join(self.root,"a","b","up"))
+		os.symlink("..",os.path.join(self.root,"c","parent"))
+		self.assertEqual(self.walk(),[".","a","c","a/b"])
+
+	def test_link_to_other_branch(self):
+		'''A link into another branch is walked once, links from there back to its ancestors are loops'''
+		os.symlink(os.path.join(self.root,"a","b"),os.path.join(self.root,"c","b"))
+		os.symlink(os.path.join(self.root,"a"),os.path.join(self.root,"a","b","up"))
+		self.assertEqual(self.walk(),[".","a","c","a/b","c/b"])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3 -c
+
+'''
+CreateGanonDB.ganon_sequences must write the same library at any block size as a line by line rewrite
+'''
+
+import io
+import os
+import gzip
+import random
+import tempfile
+import unittest
+from flextaxd.modules.CreateGanonDB import CreateGanonDB
+
+def rewrite_lines(data, genome, taxid):
+	'''Reference rewrite of a fasta file, one line at a time'''
+	out,seqinfo = [],[]
+	id,seqlen = False,0
+	for line in data.splitlines(True):
+		if line.startswith(b">"):
+			if seqlen > 0:
+				seqinfo.append("{id}\t{seqlen}\t{taxid}".format(id=id,seqlen=seqlen,taxid=taxid))
+			id,seqlen = line.decode("utf-8").split(" ")[0].lstrip(">").strip()+"_"+genome,0
+			continue
+		sequence = line.strip()
+		if sequence and id:
+			if seqlen == 0:
+				out.append(b">"+id.encode("utf-8")+b"\n")
+			out.append(sequence+b"\n")
+			seqlen += len(sequence)
+	if seqlen > 0:
+		seqinfo.append("{id}\t{seqlen}\t{taxid}".format(id=id,seqlen=seqlen,taxid=taxid))
+	return b"".join(out),seqinfo
+
+def rewrite_blocks(data, genome, taxid, blocksize):
+	'''Rewrite with ganon_sequences reading blocks of blocksize bytes'''
+	ganon = CreateGanonDB.__new__(CreateGanonDB)
+	ganon.blocksize = blocksize
+	out = io.BytesIO()
+	seqinfo = ganon.ganon_sequences(io.BytesIO(data),out,genome,taxid)
+	return out.getvalue(),seqinfo
+
+class TestGanonSequences(unittest.TestCase):
+	blocksizes = (1,2,3,5,8,64,4194304)
+
+	def assertSameRewrite(self, data):
+		expected = rewrite_lines(data,"GCF_1",5)
+		for blocksize in self.blocksizes:
+			self.assertEqual(rewrite_blocks(data,"GCF_1",5,blocksize),expected,"blocksize {}".format(blocksize))
+
+	def test_whitespace_line_across_blocks(self):
+		'''A whitespace only line split over two blocks must not add an empty line'''
+		data = b">seq0 desc\n \nTCGACAGCTTAGCA\n"
+		self.assertEqual(rewrite_blocks(data,"GCF_1",5,2)[0],b">seq0_GCF_1\nTCGACAGCTTAGCA\n")
+		self.assertSameRewrite(data)
+
+	def test_whitespace_in_line_across_blocks(self):
+		self.assertSameRewrite(b">seq0 desc\n TT\t  \n\tC CGC\tA \t \r\n\t \n\n>seq1 desc\nTG  C\r \n  GA\t AA \t \n  C G \t\r\n")
+
+	def test_missing_final_newline(self):
+		self.assertSameRewrite(b">seq0\nACGT\nAC\n>seq1\nGGTT")
+
+	def test_random_fasta(self):
+		rand = random.Random(0)
+		for i in range(300):
+			parts = []
+			for s in range(rand.randint(1,3)):
+				parts.append(b">seq%d desc\n" % s)
+				for l in range(rand.randint(0,4)):
+					line = bytes(rand.choice(b"ACGT  \t>") for _ in range(rand.randint(0,12)))
+					parts.append(rand.choice([b"",b" ",b"\t"])+line+rand.choice([b"\n",b"\r\n",b"\n\n",b" \n",b"\r"]))
+			self.assertSameRewrite(b"".join(parts))
+
+class TestGanonLibrary(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.ganon = CreateGanonDB.__new__(CreateGanonDB)
+		self.ganon.outdir = self.tmp.name+"/"
+		self.ganon.ganondb = self.tmp.name
+		self.ganon.seqid2taxid = self.tmp.name+"/seqid2taxid.map"
+		self.ganon.usezip = ""
+		self.ganon.processes = 2
+		self.ganon.chunksize = 1
+		self.ganon.genome_path,self.ganon.accession_to_taxid = {},{}
+		for i,data in enumerate([b">a\nACGT\n",b">b\nGG\n",b">c\nTT\n"]):
+			self.add_genome("GCF_{}".format(i),gzip.compress(data),i+1)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def add_genome(self, genome, data, taxid):
+		path = "{dir}/{genome}.fna.gz".format(dir=self.tmp.name,genome=genome)
+		with open(path,"wb") as f:
+			f.write(data)
+		self.ganon.genome_path[genome] = path
+		self.ganon.accession_to_taxid[genome] = taxid
+
+	def test_corrupt_genomes_are_removed_from_the_shard(self):
+		'''A genome that fails while it is written (corrupt deflate data, unreadable file) is truncated from the shard'''
+		self.add_genome("corrupt",gzip.compress(b">x\n"+b"ACGT"*100000)[:20]+b"\xff"*64,9)
+		self.add_genome("missing",b"",9)
+		os.remove(self.ganon.genome_path["missing"])
+		self.assertTrue(self.ganon.ganon_fasta(["GCF_0","corrupt","missing","GCF_1"],0))
+		with open(self.tmp.name+"/.tmp0.fasta","rb") as f:
+			self.assertEqual(f.read(),b">a_GCF_0\nACGT\n>b_GCF_1\nGG\n")
+		with open(self.tmp.name+"/.tmp0.map") as f:
+			self.assertEqual(f.read(),"a_GCF_0\t4\t1\nb_GCF_1\t2\t2\n")
+
+	def test_maps_are_merged(self):
+		self.ganon.ganon_fasta_multiproc(["GCF_0","GCF_1","GCF_2"])
+		with open(self.ganon.seqid2taxid) as f:
+			self.assertEqual(sorted(f.read().splitlines()),["a_GCF_0\t4\t1","b_GCF_1\t2\t2","c_GCF_2\t2\t3"])
+		self.assertEqual([f for f in os.listdir(self.tmp.name) if f.endswith(".map")],["seqid2taxid.map"])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3 -c
+
+'''
+GenomeDownloader against a local http server: range resume, 416 restart, md5 retries and redirects
+'''
+
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+import http.server
+from flextaxd.modules.GenomeDownloader import GenomeDownloader,DownloadError
+
+FTP_PATH = "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/000/001/GCF_000000001.1_ASM1"
+GENOME = "/genomes/all/GCF/000/000/001/GCF_000000001.1_ASM1/GCF_000000001.1_ASM1_genomic.fna.gz"
+MD5SUMS = "/genomes/all/GCF/000/000/001/GCF_000000001.1_ASM1/md5checksums.txt"
+
+class Handler(http.server.BaseHTTPRequestHandler):
+	'''Serves Handler.files (path: bytes), the first drop GETs of a file without a Range header are cut in half
+		and the first wrong_range range requests are answered from the start of the file'''
+	protocol_version = "HTTP/1.1"
+	files = {}
+	redirects = {}
+	drop = 0
+	wrong_range = 0
+	requests = []
+
+	def log_message(self, *args):
+		pass
+
+	def reply(self, status, body=b"", headers={}):
+		self.send_response(status)
+		for key,value in headers.items():
+			self.send_header(key,value)
+		self.send_header("Content-Length",str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		Handler.requests.append((self.path,self.headers.get("Range")))
+		if self.path in Handler.redirects:
+			return self.reply(302,headers={"Location": Handler.redirects[self.path]})
+		if self.path not in Handler.files:
+			return self.reply(404)
+		data = Handler.files[self.path]
+		range = self.headers.get("Range")
+		if range:
+			start = int(range.split("=")[1].rstrip("-"))
+			if start >= len(data):
+				return self.reply(416)
+			if Handler.wrong_range:
+				Handler.wrong_range -= 1
+				start = 0
+			return self.reply(206,data[start:],{"Content-Range": "bytes {start}-{end}/{size}".format(start=start,end=len(data)-1,size=len(data))})
+		if Handler.drop and self.path.endswith(".fna.gz"):
+			Handler.drop -= 1
+			self.send_response(200)
+			self.send_header("Content-Length",str(len(data)))
+			self.end_headers()
+			self.wfile.write(data[:len(data)//2])
+			self.wfile.flush()
+			self.close_connection = True
+			return
+		self.reply(200,data)
+
+class TestGenomeDownloader(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.server = http.server.ThreadingHTTPServer(("127.0.0.1",0),Handler)
+		cls.base_url = "http://127.0.0.1:{port}".format(port=cls.server.server_address[1])
+		threading.Thread(target=cls.server.serve_forever,daemon=True).start()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.data = os.urandom(100000)
+		self.serve(hashlib.md5(self.data).hexdigest())
+		Handler.redirects = {}
+		Handler.drop = 0
+		Handler.wrong_range = 0
+		Handler.requests = []
+		self.downloader = GenomeDownloader(threads=2,retries=2,backoff=0.01,timeout=5,base_url=self.base_url,blocksize=4096)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def serve(self, md5):
+		Handler.files = {
+			GENOME: self.data,
+			MD5SUMS: "{md5}  ./{fname}\n".format(md5=md5,fname=os.path.basename(GENOME)).encode("utf-8"),
+		}
+
+	def genome_requests(self):
+		return [range for path,range in Handler.requests if path == GENOME]
+
+	def test_resume_after_dropped_transfer(self):
+		Handler.drop = 1
+		path = self.downloader.download(FTP_PATH,self.tmp.name)
+		with open(path,"rb") as f:
+			self.assertEqual(f.read(),self.data)
+		self.assertEqual(self.genome_requests(),[None,"bytes={}-".format(len(self.data)//2)])
+		self.assertFalse(os.path.exists(path+".part"))
+
+	def test_restart_after_wrong_content_range(self):
+		'''A range reply that does not start at the size of the part file is not appended'''
+		Handler.drop = 1
+		Handler.wrong_range = 1
+		path = self.downloader.download(FTP_PATH,self.tmp.name)
+		with open(path,"rb") as f:
+			self.assertEqual(f.read(),self.data)
+		self.assertEqual(self.genome_requests(),[None,"bytes={}-".format(len(self.data)//2),None])
+
+	def test_restart_after_416(self):
+		'''A part file longer than the file is removed and the download starts again'''
+		with open(os.path.join(self.tmp.name,os.path.basename(GENOME))+".part","wb") as f:
+			f.write(os.urandom(len(self.data)+10))
+		path = self.downloader.download(FTP_PATH,self.tmp.name)
+		with open(path,"rb") as f:
+			self.assertEqual(f.read(),self.data)
+		self.assertEqual(self.genome_requests(),["bytes={}-".format(len(self.data)+10),None])
+
+	def test_md5_mismatch(self):
+		'''A file not matching md5checksums.txt is downloaded again, and fails after all retries'''
+		self.serve("0"*32)
+		with self.assertRaises(DownloadError):
+			self.downloader.download(FTP_PATH,self.tmp.name)
+		self.assertEqual(self.genome_requests(),[None]*3)
+		self.assertEqual(os.listdir(self.tmp.name),[])
+
+	def test_redirects(self):
+		moved = "/moved/"+os.path.basename(GENOME)
+		Handler.files[moved] = Handler.files.pop(GENOME)
+		Handler.redirects[GENOME] = self.base_url+moved
+		path = self.downloader.download(FTP_PATH,self.tmp.name)
+		with open(path,"rb") as f:
+			self.assertEqual(f.read(),self.data)
+		Handler.redirects[GENOME] = "../../../../../../../moved/"+os.path.basename(GENOME)  ## Relative location
+		os.remove(path)
+		self.assertEqual(self.downloader.download(FTP_PATH,self.tmp.name),path)
+		self.assertEqual(Handler.requests[-1],(moved,None))
+		loop = "/loop"
+		Handler.redirects[loop] = self.base_url+loop
+		with self.assertRaises(DownloadError):
+			self.downloader.request(self.base_url+loop)
+
+	def test_run(self):
+		downloaded,failed = self.downloader.run([
+			{"accession": "GCF_000000001.1", "ftp_path": FTP_PATH, "outdir": self.tmp.name},
+			{"accession": "GCF_000000002.1", "ftp_path": FTP_PATH.replace("001.1","002.1"), "outdir": self.tmp.name},
+		])
+		self.assertEqual(list(downloaded),["GCF_000000001.1"])
+		self.assertEqual(failed,["GCF_000000002.1"])
+
+	def test_run_worker_exception(self):
+		'''An error other than DownloadError in one genome (here outdir is a file) does not stop the other downloads'''
+		outfile = os.path.join(self.tmp.name,"file")
+		open(outfile,"w").close()
+		downloaded,failed = self.downloader.run([
+			{"accession": "GCF_000000001.1", "ftp_path": FTP_PATH, "outdir": outfile},
+			{"accession": "GCF_000000001.1_copy", "ftp_path": FTP_PATH, "outdir": os.path.join(self.tmp.name,"genomes")},
+		])
+		self.assertEqual(list(downloaded),["GCF_000000001.1_copy"])
+		self.assertEqual(failed,["GCF_000000001.1"])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3 -c
+
+'''
+IngestTaxonomy gives the same database with any number of processes
+'''
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from flextaxd.modules.IngestTaxonomy import IngestTaxonomy
+
+SOURCES = [
+	"RS_GCF_000000001.1\td__Bacteria;p__Firmicutes;c__Bacilli;o__Bacillales;f__Bacillaceae;g__Bacillus;s__Bacillus subtilis\n"
+	"GB_GCA_000000002.1\td__Bacteria;p__Firmicutes;c__Bacilli;o__Lactobacillales;f__Lactobacillaceae;g__Lactobacillus;s__Lactobacillus casei\n",
+	"GCF_000000003.1\td__Archaea;p__Halobacteriota;c__Halobacteria;o__Halobacteriales;f__Halobacteriaceae;g__Halobacterium;s__Halobacterium salinarum\n"
+	"GCF_000000004.1\td__Bacteria;p__Firmicutes;c__Bacilli;o__Bacillales;f__Bacillaceae;g__Bacillus;s__Bacillus cereus\n"
+]
+
+class TestIngestTaxonomy(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.files = []
+		for i,source in enumerate(SOURCES):
+			self.files.append(os.path.join(self.tmp.name,"source{i}.tsv".format(i=i)))
+			with open(self.files[-1],"w") as f:
+				f.write(source)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def ingest(self, processes):
+		'''Ingest both sources, returns the rows of the rank, nodes, tree and genomes tables'''
+		database = os.path.join(self.tmp.name,"p{p}.db".format(p=processes))
+		ingest = IngestTaxonomy(self.files,["QIIME"],database=database,processes=processes)
+		self.assertEqual(ingest.processes,processes)
+		ingest.parse_taxonomy()
+		ingest.database.conn.close()
+		conn = sqlite3.connect(database)
+		tables = [conn.execute("SELECT {columns} FROM {table} ORDER BY rowid".format(columns=columns,table=table)).fetchall() for table,columns in
+					(("rank","rank_i,rank"),("nodes","id,name"),("tree","parent,child,rank_i"),("genomes","genome,id"))]
+		conn.close()
+		return tables
+
+	def test_same_database_with_processes(self):
+		tables = self.ingest(1)
+		self.assertEqual(tables,self.ingest(2))
+		ranks,nodes,links,genomes = tables
+		names = dict((name,id) for id,name in nodes)
+		self.assertEqual(len(names),len(nodes))
+		self.assertEqual(sorted(genome for genome,id in genomes),["GCA_000000002.1","GCF_000000001.1","GCF_000000003.1","GCF_000000004.1"])
+		self.assertIn((names["Bacillus"],names["Bacillus cereus"]),[(parent,child) for parent,child,rank_i in links])
+		self.assertLess(names["Bacillus subtilis"],names["Halobacterium salinarum"])  ## Ids follow the order of the files
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3 -c
+
+'''
+CreateKrakenDatabase merges the sorted seqid2taxid runs of all processes into one map
+'''
+
+import os
+import gzip
+import tempfile
+import unittest
+from taxonomy_fixture import create_taxonomy,GENOMES
+from flextaxd.modules.CreateKrakenDatabase import CreateKrakenDatabase
+
+## Sequences of each genome, S2 is found in the first two genomes
+SEQUENCES = {
+	"GCF_000000001.1": ["S3","S1","S2"],
+	"GCF_000000002.1": ["S2","S4"],
+	"GCF_000000003.1": ["S6","S5"],
+}
+
+def map_line(seqid, taxid):
+	return "TAXID\t{seqid}|kraken:taxid|{taxid}\t{taxid}".format(seqid=seqid,taxid=taxid)
+
+class TestKrakenLibrary(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name,"taxonomy.db")
+		create_taxonomy(self.path).conn.close()
+		self.genomes = {}
+		for genome,seqids in SEQUENCES.items():
+			self.genomes[genome] = os.path.join(self.tmp.name,genome+"_genomic.fna.gz")
+			with gzip.open(self.genomes[genome],"wb") as f:
+				f.write(b"".join(">{seqid} {genome}\nACGT\n".format(seqid=seqid,genome=genome).encode() for seqid in seqids))
+		self.taxids = dict((genome,taxid) for genome,taxid in GENOMES)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def kraken(self, name, processes=2, validate_map=True):
+		outdir = os.path.join(self.tmp.name,name)
+		os.makedirs(outdir)
+		kraken = CreateKrakenDatabase(self.path,os.path.join(outdir,"db"),self.genomes,outdir,processes=processes,create_db=True,validate_map=validate_map)
+		kraken.map_runsize = 2  ## More than one sorted run per process
+		return kraken
+
+	def read(self, path):
+		with open(path) as f:
+			return f.read().splitlines()
+
+	def test_merge_map(self):
+		'''The map is sorted on sequence id, all lines of a sequence id found more than once are written to seqid2taxid.duplicates'''
+		kraken = self.kraken("merge")
+		os.makedirs(os.path.join(kraken.krakendb,"library"))
+		first = kraken.write_map_run([map_line("S3",5),map_line("S1",5),map_line("S2",5)],0,0)
+		second = kraken.write_map_run([map_line("S4",7),map_line("S2",7),map_line("S3",7),map_line("S3",3)],1,0)
+		self.assertEqual(kraken.merge_map([first,second]),2)
+		self.assertEqual(self.read(kraken.seqid2taxid),[map_line("S1",5),map_line("S2",5),map_line("S2",7),map_line("S3",3),map_line("S3",5),map_line("S3",7),map_line("S4",7)])
+		self.assertEqual(self.read(os.path.join(kraken.outdir,"seqid2taxid.duplicates")),[map_line("S2",5),map_line("S2",7),map_line("S3",3),map_line("S3",5),map_line("S3",7)])
+		self.assertFalse(os.path.exists(first) or os.path.exists(second))
+
+	def test_library(self):
+		'''The library and map do not depend on the number of processes, duplicates are only written with validate_map'''
+		expected = sorted(map_line(seqid,self.taxids[genome]) for genome,seqids in SEQUENCES.items() for seqid in seqids)
+		for processes in (1,2):
+			kraken = self.kraken("p{}".format(processes),processes=processes)
+			kraken.create_library_from_files()
+			self.assertEqual(kraken.added,3)
+			self.assertEqual(self.read(kraken.seqid2taxid),expected)
+			self.assertEqual(self.read(os.path.join(kraken.outdir,"seqid2taxid.duplicates")),[map_line("S2",5),map_line("S2",7)])
+			with open(os.path.join(kraken.krakendb,"library","library.fna")) as f:
+				self.assertEqual(sorted(line for line in f if line.startswith(">")),sorted(">{seqid}|kraken:taxid|{taxid}  \n".format(seqid=seqid,taxid=self.taxids[genome]) for genome,seqids in SEQUENCES.items() for seqid in seqids))
+			self.assertEqual(sorted(os.listdir(os.path.join(kraken.krakendb,"library"))),["library.fna"])
+		kraken = self.kraken("unchecked",validate_map=False)
+		kraken.create_library_from_files()
+		self.assertEqual(self.read(kraken.seqid2taxid),expected)
+		self.assertFalse(os.path.exists(os.path.join(kraken.outdir,"seqid2taxid.duplicates")))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3 -c
+
+'''
+TaxonomyGraph gives the same links, children and parents as the database queries it replaces
+'''
+
+import os
+import tempfile
+import unittest
+from taxonomy_fixture import create_taxonomy,LINKS
+from flextaxd.modules.ModifyTree import ModifyTree
+
+class TestTaxonomyGraph(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name,"taxonomy.db")
+		self.database = create_taxonomy(self.path)
+		self.graph = self.database.get_graph()
+
+	def tearDown(self):
+		self.database.conn.close()
+		self.tmp.cleanup()
+
+	def test_links(self):
+		'''Rank 0 is kept as a rank, links without rank have rank None'''
+		self.assertEqual(self.graph.get_links(),LINKS)
+		for nodes in ([4,5],[7],[1]):
+			self.assertEqual(sorted(self.graph.get_links(nodes),key=str),sorted(self.database.get_links(nodes),key=str))
+			self.assertEqual(sorted(self.graph.get_links(nodes,only_parents=True),key=str),sorted(self.database.get_links(nodes,only_parents=True),key=str))
+
+	def test_children_and_parents(self):
+		for parents in ([1],[2],[4,3],[7]):
+			self.assertEqual(self.graph.get_children(parents),self.database.get_children(parents))
+			for maxdepth in range(4):
+				self.assertEqual(self.graph.get_children(parents,maxdepth=maxdepth),self.database.get_children(parents,maxdepth=maxdepth))
+		self.assertEqual(self.graph.get_parents([7,5]),self.database.get_parents([7,5],find_all=True))
+
+	def test_modify_uses_graph(self):
+		'''Children and links of the modified parent are taken from the graph'''
+		self.database.conn.close()
+		modfile = os.path.join(self.tmp.name,"mod.txt")
+		with open(modfile,"w") as f:
+			f.write("parent\tchild\trank\nC\tG\tgenus\n")
+		modify = ModifyTree(database=self.path,mod_file=modfile,parent="A")
+		self.database = modify.taxonomydb
+		self.assertIsNotNone(self.database.graph)
+		self.assertEqual(modify.existing_nodes,{4,5,6,7})
+		self.assertEqual(modify.existing_links,{(2,4,1),(2,5,None),(4,6,2),(6,7,2)})
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3 -c
+
+'''
+The dump of flextaxd-create is skipped when the database and the dump settings are the same as for the last dump
+'''
+
+import os
+import sys
+import gzip
+import tempfile
+import subprocess
+import unittest
+from taxonomy_fixture import create_taxonomy
+from flextaxd.modules.database.DatabaseConnection import DatabaseFunctions
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"flextaxd","custom_taxonomy_databases.py")
+
+class TestDumpFingerprint(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name,"taxonomy.db")
+		self.outdir = os.path.join(self.tmp.name,"dump")
+		create_taxonomy(self.path).conn.close()
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def dump(self, *options):
+		'''Dump the database, returns the dump files that were written (the files are dated back before each dump)'''
+		files = [os.path.join(self.outdir,name) for name in os.listdir(self.outdir)] if os.path.exists(self.outdir) else []
+		for path in files:
+			os.utime(path,ns=(0,0))
+		subprocess.run([sys.executable,SCRIPT,"-db",self.path,"--dump","-o",self.outdir,"--force","--logs",os.path.join(self.tmp.name,"logs")]+list(options),check=True,capture_output=True)
+		return sorted(name for name in os.listdir(self.outdir) if name.endswith((".dmp",".dmp.gz")) and os.stat(os.path.join(self.outdir,name)).st_mtime_ns > 0)
+
+	def test_unchanged_database_is_not_dumped(self):
+		self.assertEqual(self.dump(),["names.dmp","nodes.dmp"])
+		self.assertEqual(self.dump(),[])
+		os.utime(self.path)  ## Same content, new file stat
+		self.assertEqual(self.dump(),[])
+
+	def test_force_dump(self):
+		self.dump()
+		self.assertEqual(self.dump("--force_dump"),["names.dmp","nodes.dmp"])
+
+	def test_changed_settings(self):
+		self.dump()
+		self.assertEqual(self.dump("--dump_compress","gzip"),["names.dmp.gz","nodes.dmp.gz"])
+		self.assertEqual(self.dump("--dump_compress","gzip"),[])
+		with gzip.open(os.path.join(self.outdir,"names.dmp.gz"),"rt") as f:
+			self.assertEqual(len(f.readlines()),7)
+		self.assertEqual(self.dump(),["names.dmp","nodes.dmp"])
+
+	def test_changed_database(self):
+		self.dump()
+		database = DatabaseFunctions(self.path)
+		database.add_node("G")
+		database.commit()
+		database.conn.close()
+		self.assertEqual(self.dump(),["names.dmp","nodes.dmp"])
+		with open(os.path.join(self.outdir,"names.dmp")) as f:
+			self.assertEqual(len(f.readlines()),8)
+
+if __name__ == '__main__':
+	unittest.main()